@@ -0,0 +1,150 @@
+"""
+Compare `retrieve()` with IVF candidate retrieval against exact scoring.
+
+The benchmark builds a synthetic, clustered index shaped like a lattice index
+(`num_entities` x 13 x `dim`), whose entities of a topic share the topic's
+word, and queries made of the topic word and noisy vectors of one entity.
+Query embeddings are put in the query cache up front so `retrieve()` runs
+without network calls.
+
+The exact baseline scores every entity, by making every entity a BM25
+candidate. For it, for BM25 candidates only and for every `n_probe` the
+benchmark reports the p50 and p95 latency of `retrieve()` and its recall@k,
+the share of the exact top `k` results it returns.
+
+Run from the repository root:
+
+    python -m benchmarks.ann_benchmark --num-entities 20000 --n-lists 256
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.lattice.retrieve import prompts
+from src.lattice.retrieve.ann import build_ivf_index
+from src.lattice.retrieve.bm25 import build_bm25_index, tokenize_entity
+from src.lattice.retrieve.query_cache import get_query_cache
+from src.lattice.retrieve.retriever import NUM_BM25_CANDIDATES, retrieve
+
+EMBEDDING_MODEL = "benchmark"
+
+
+def normalize(x: np.ndarray) -> np.ndarray:
+    return x / np.linalg.norm(x, axis=-1, keepdims=True)
+
+
+def make_entities(num_entities, vectors_per_entity, dim, num_topics, noise, rng):
+    topics = normalize(rng.standard_normal((num_topics, dim)).astype(np.float32))
+    entity_topics = rng.integers(num_topics, size=num_entities)
+    scale = noise / np.sqrt(dim)
+    noise = rng.standard_normal((num_entities, vectors_per_entity, dim))
+    vectors = topics[entity_topics][:, None, :] + scale * noise.astype(np.float32)
+    entity = pd.DataFrame(
+        {
+            "id": np.arange(num_entities),
+            "function_name": [f"function_{row}" for row in range(num_entities)],
+            "description": [f"topic{topic}" for topic in entity_topics],
+            "definition": [f"def function_{row}():" for row in range(num_entities)],
+        }
+    )
+    return entity, entity_topics, normalize(vectors).astype(np.float32)
+
+
+def make_queries(
+    entity_embeddings, entity_topics, num_queries, num_keywords, noise, rng
+):
+    num_entities, vectors_per_entity, dim = entity_embeddings.shape
+    targets = rng.integers(num_entities, size=num_queries)
+    picks = rng.integers(vectors_per_entity, size=(num_queries, num_keywords))
+    scale = noise / np.sqrt(dim)
+    noise = rng.standard_normal((num_queries, num_keywords, dim)).astype(np.float32)
+    embeddings = entity_embeddings[targets[:, None], picks] + scale * noise
+    # numbering the queries keeps repeated targets from sharing a cache entry
+    texts = [
+        f"topic{entity_topics[target]} query{idx}" for idx, target in enumerate(targets)
+    ]
+    return texts, normalize(embeddings).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--num-entities", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--num-topics", type=int, default=500)
+    parser.add_argument(
+        "--noise", type=float, default=1.0, help="Norm of the per-vector noise."
+    )
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--n-lists", type=int, default=256)
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    entity, entity_topics, entity_embeddings = make_entities(
+        args.num_entities, 13, args.dim, args.num_topics, args.noise, rng
+    )
+    texts, query_embeddings = make_queries(
+        entity_embeddings, entity_topics, args.num_queries, 10, args.noise, rng
+    )
+    bm25_index = build_bm25_index(tokenize_entity(entity))
+
+    start = time.perf_counter()
+    ivf_index = build_ivf_index(entity_embeddings, n_lists=args.n_lists)
+    print(f"built {ivf_index.n_lists} lists in {time.perf_counter() - start:.2f}s")
+
+    with tempfile.TemporaryDirectory() as project_path:
+        query_cache = get_query_cache(f"{project_path}/.lattice", EMBEDDING_MODEL)
+        for text, embeddings in zip(texts, query_embeddings):
+            query_cache.set(text, [text], embeddings)
+
+        # every entity is a BM25 candidate of the exact baseline
+        settings = [
+            ("exact", None, 0, len(entity)),
+            ("bm25 only", None, 0, NUM_BM25_CANDIDATES),
+        ]
+        settings += [
+            (f"n_probe={n}", ivf_index, n, NUM_BM25_CANDIDATES) for n in args.n_probe
+        ]
+        exact = []
+        for name, ann_index, n_probe, num_bm25_candidates in settings:
+            latencies, recalls = [], []
+            for query_idx, text in enumerate(texts):
+                start = time.perf_counter()
+                results = retrieve(
+                    entity=entity,
+                    query=text,
+                    num_keywords=10,
+                    keyword_extraction_prompt_template=prompts.keyword_extraction,
+                    together_llm_client=None,
+                    together_llm_model_name=None,
+                    together_embedding_client=None,
+                    together_embedding_model_name=EMBEDDING_MODEL,
+                    project_path=project_path,
+                    entity_embeddings=entity_embeddings,
+                    bm25_index=bm25_index,
+                    ann_index=ann_index,
+                    n_probe=n_probe,
+                    top_k=args.k,
+                    num_bm25_candidates=num_bm25_candidates,
+                )
+                latencies.append((time.perf_counter() - start) * 1000)
+                ids = {result["id"] for result in results}
+                if name == "exact":
+                    exact.append(ids)
+                recalls.append(len(ids & exact[query_idx]) / len(exact[query_idx]))
+            p50, p95 = np.percentile(latencies, [50, 95])
+            print(
+                f"{name:>10} p50 {p50:8.2f} ms  p95 {p95:8.2f} ms  "
+                f"{'recall@' + str(args.k):>9} {np.mean(recalls):.3f}"
+            )
+        query_cache.close()
+
+
+if __name__ == "__main__":
+    main()
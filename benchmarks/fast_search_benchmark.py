@@ -0,0 +1,120 @@
+"""
+Compare fast search with keyword extraction search on an indexed project.
+
+Every query of the queries file is embedded in both modes with an empty
+query cache, so each one pays its full uncached cost, then ranked against
+the project's index. The benchmark reports the p50 and p95 latency of each
+mode and how often the top-1 results of the two modes agree. With `--exact`
+every entity of the index is scored instead of the BM25 and ANN candidates.
+
+Run from the repository root, with `TOGETHER_API_KEY` set, on a project
+indexed with `lattice index`:
+
+    python -m benchmarks.fast_search_benchmark PROJECT_PATH queries.txt
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+from src.lattice.cli.main import get_ai_clients
+from src.lattice.retrieve import prompts
+from src.lattice.retrieve.ann import DEFAULT_N_PROBE, load_ann_index
+from src.lattice.retrieve.bm25 import load_or_build_bm25_index
+from src.lattice.retrieve.query_cache import QueryCache
+from src.lattice.retrieve.retriever import (
+    FAST_BASE_VECTORS,
+    NUM_BM25_CANDIDATES,
+    get_fast_query_embeddings,
+    get_query_embeddings,
+    rank_entities,
+)
+from src.lattice.storage import load_index, load_keyword_vocabulary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("project_path")
+    parser.add_argument("queries", type=argparse.FileType("r"))
+    parser.add_argument("--n-probe", type=int, default=DEFAULT_N_PROBE)
+    parser.add_argument(
+        "--exact",
+        action="store_true",
+        help="Score every entity instead of the BM25 and ANN candidates.",
+    )
+    args = parser.parse_args()
+
+    load_dotenv()
+    clients = get_ai_clients()
+    index_path = os.path.join(args.project_path, ".lattice")
+    entity, entity_embeddings = load_index(index_path, mmap=False)
+    bm25_index = load_or_build_bm25_index(index_path, entity)
+    ann_index = None if args.exact else load_ann_index(index_path, entity_embeddings)
+    # every entity is a BM25 candidate in exact mode
+    num_bm25_candidates = len(entity) if args.exact else NUM_BM25_CANDIDATES
+    keyword_vocabulary = load_keyword_vocabulary(index_path, entity_embeddings)
+    queries = [line.strip() for line in args.queries if line.strip()]
+
+    with tempfile.TemporaryDirectory() as directory:
+        query_cache = QueryCache(directory, clients["embedding"]["model"])
+
+        def keywords_mode(query: str) -> np.ndarray:
+            return get_query_embeddings(
+                query=query,
+                keyword_extraction_prompt_template=prompts.keyword_extraction,
+                together_llm_client=clients["llm"]["client"],
+                together_llm_model_name=clients["llm"]["model"],
+                together_embedding_client=clients["embedding"]["client"],
+                together_embedding_model_name=clients["embedding"]["model"],
+                project_path=args.project_path,
+                keyword_vocabulary=keyword_vocabulary,
+                query_cache=query_cache,
+            )
+
+        def fast_mode(query: str) -> np.ndarray:
+            return get_fast_query_embeddings(
+                query=query,
+                together_embedding_client=clients["embedding"]["client"],
+                together_embedding_model_name=clients["embedding"]["model"],
+                project_path=args.project_path,
+                keyword_vocabulary=keyword_vocabulary,
+                query_cache=query_cache,
+            )
+
+        modes = [
+            ("keywords", keywords_mode, None),
+            ("fast", fast_mode, FAST_BASE_VECTORS),
+        ]
+        latencies = {name: [] for name, _, _ in modes}
+        top1 = {name: [] for name, _, _ in modes}
+        for query in queries:
+            for name, embed, base_vectors in modes:
+                start = time.perf_counter()
+                results = rank_entities(
+                    entity=entity,
+                    entity_embeddings=entity_embeddings,
+                    query=query,
+                    query_embeddings=embed(query),
+                    bm25_index=bm25_index,
+                    ann_index=ann_index,
+                    n_probe=args.n_probe,
+                    num_bm25_candidates=num_bm25_candidates,
+                    base_vectors=base_vectors,
+                )
+                latencies[name].append((time.perf_counter() - start) * 1000)
+                top1[name].append(results[0]["id"] if results else None)
+        query_cache.close()
+
+    for name, _, _ in modes:
+        p50, p95 = np.percentile(latencies[name], [50, 95])
+        print(f"{name:>10} p50 {p50:9.1f} ms  p95 {p95:9.1f} ms")
+    agreement = np.mean([a == b for a, b in zip(top1["keywords"], top1["fast"])])
+    print(f"top-1 agreement over {len(queries)} queries: {agreement:.3f}")
+
+
+if __name__ == "__main__":
+    main()
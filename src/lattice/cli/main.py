@@ -6,11 +6,26 @@ import logging
 import json
 from together import Together
 from openai import OpenAI
+import uvicorn
 from dotenv import load_dotenv
+from ..compiler.callgraph import SymbolTable
 from ..compiler.digest import iterate_over_functions_project
+from ..compiler.walk import WalkStats
 from ..indexer.local import index_project
+from ..llm.cache import ResponseCache
+from ..llm.governor import MAX_RETRIES, REQUEST_TIMEOUT, RequestGovernor
+from ..llm.together import set_request_governor, set_response_cache
 from ..logger import logger
-from ..retrieve import get_db_data, retrieve, prompts
+from ..retrieve import (
+    DEFAULT_N_PROBE,
+    load_ann_index,
+    load_or_build_bm25_index,
+    retrieve,
+    retrieve_batch,
+    prompts,
+)
+from ..server import create_app
+from ..storage import load_index, load_keyword_vocabulary
 
 
 @click.group()
@@ -21,10 +36,45 @@ def lattice():
 
 @click.command(name="search")
 @click.argument("path", required=True, type=click.Path(exists=True))
-@click.argument("query", required=True)
+@click.argument("query", required=False)
+@click.option(
+    "--batch",
+    type=click.File("r"),
+    help="File with one query per line ('-' for stdin), printed as JSON lines.",
+)
+@click.option(
+    "--concurrency",
+    default=8,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of concurrent keyword extractions in batch mode.",
+)
+@click.option(
+    "--n-probe",
+    default=DEFAULT_N_PROBE,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of ANN lists to probe; higher is slower but more accurate.",
+)
+@click.option(
+    "--top-k",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of results to return.",
+)
+@click.option(
+    "--fast",
+    is_flag=True,
+    help="Embed the query as is instead of asking the LLM for its keywords.",
+)
+@click.option("--json", "as_json", is_flag=True, help="Print the results as JSON.")
 @click.option("--verbose", is_flag=True, help="Print info.")
-def search(path, query, verbose):
+def search(path, query, batch, concurrency, n_probe, top_k, fast, as_json, verbose):
     """Search for code using human language queries."""
+    if (query is None) == (batch is None):
+        raise click.UsageError("Pass either a QUERY or --batch, but not both.")
+
     if verbose:
         logger.setLevel(logging.DEBUG)
 
@@ -35,16 +85,40 @@ def search(path, query, verbose):
     together_llm_model_name = clients["llm"]["model"]
     together_embedding_model_name = clients["embedding"]["model"]
 
-    entity_path = os.path.join(path, ".lattice", "entity.csv")
-    relationship_path = os.path.join(path, ".lattice", "relationship.csv")
-
-    entity, _ = get_db_data(entity_path)
+    index_path = os.path.join(path, ".lattice")
+    entity, entity_embeddings = load_index(index_path)
+    bm25_index = load_or_build_bm25_index(index_path, entity)
+    keyword_vocabulary = load_keyword_vocabulary(index_path, entity_embeddings)
 
     # reading prompt templates
     keyword_extraction_prompt_template = prompts.keyword_extraction
 
     num_keywords = 10
-    result = retrieve(
+    if batch is not None:
+        queries = (line.strip() for line in batch if line.strip())
+        for batch_query, results in retrieve_batch(
+            entity=entity,
+            queries=queries,
+            num_keywords=num_keywords,
+            keyword_extraction_prompt_template=keyword_extraction_prompt_template,
+            together_llm_client=together_llm_client,
+            together_llm_model_name=together_llm_model_name,
+            together_embedding_client=together_embedding_client,
+            together_embedding_model_name=together_embedding_model_name,
+            project_path=path,
+            score_type="normalized_l2_score",
+            entity_embeddings=entity_embeddings,
+            bm25_index=bm25_index,
+            top_k=top_k,
+            concurrency=concurrency,
+            keyword_vocabulary=keyword_vocabulary,
+            fast=fast,
+        ):
+            click.echo(json.dumps({"query": batch_query, "results": results}))
+        return
+
+    ann_index = load_ann_index(index_path, entity_embeddings)
+    results = retrieve(
         entity=entity,
         query=query,
         num_keywords=num_keywords,
@@ -55,11 +129,29 @@ def search(path, query, verbose):
         together_embedding_model_name=together_embedding_model_name,
         project_path=path,
         score_type="normalized_l2_score",
+        entity_embeddings=entity_embeddings,
+        bm25_index=bm25_index,
+        ann_index=ann_index,
+        n_probe=n_probe,
+        top_k=top_k,
+        keyword_vocabulary=keyword_vocabulary,
+        fast=fast,
     )
 
-    click.echo(f"function name: {result['function_name']}")
-    click.echo(f"description: {result['description']}")
-    click.echo(f"definition: {result['definition']}")
+    if as_json:
+        click.echo(json.dumps({"query": query, "results": results}, indent=4))
+        return
+
+    for rank, result in enumerate(results, start=1):
+        if len(results) > 1:
+            click.echo(f"#{rank}")
+        click.echo(f"function name: {result['function_name']}")
+        click.echo(f"description: {result['description']}")
+        click.echo(f"definition: {result['definition']}")
+        click.echo(
+            f"scores: bm25={result['scores']['bm25']:.4f} "
+            f"embedding={result['scores']['embedding']:.4f}"
+        )
 
 
 def read_prompt(config_path):
@@ -78,16 +170,22 @@ def read_config(config_path):
     return {"db_url": config["database"]["url"]}
 
 
-def get_ai_clients():
+def get_ai_clients(timeout: float = REQUEST_TIMEOUT):
     together_api_key = os.getenv("TOGETHER_API_KEY")
+    # retries are left to the request governor
     return {
         "llm": {
-            "client": Together(api_key=together_api_key),
+            "client": Together(
+                api_key=together_api_key, timeout=timeout, max_retries=0
+            ),
             "model": "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo",
         },
         "embedding": {
             "client": OpenAI(
-                api_key=together_api_key, base_url="https://api.together.xyz/v1"
+                api_key=together_api_key,
+                base_url="https://api.together.xyz/v1",
+                timeout=timeout,
+                max_retries=0,
             ),
             "model": "togethercomputer/m2-bert-80M-32k-retrieval",
         },
@@ -97,27 +195,204 @@ def get_ai_clients():
 @click.command(name="index")
 @click.argument("path", required=True, type=click.Path(exists=True))
 @click.option(
-    "--exclude", required=False, help="Exclude Path from the project directory."
+    "--exclude",
+    multiple=True,
+    help="Name of directories to exclude from the project, may be repeated.",
+)
+@click.option(
+    "--concurrency",
+    default=8,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of concurrent API requests while indexing.",
+)
+@click.option(
+    "--initial-concurrency",
+    default=2,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help=(
+        "Concurrent API requests to start indexing with, grown up to "
+        "--concurrency while the provider keeps up."
+    ),
+)
+@click.option(
+    "--workers",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of processes parsing source files.",
+)
+@click.option(
+    "--cache-size",
+    default=1024,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Size cap of the response cache in megabytes.",
+)
+@click.option("--no-cache", is_flag=True, help="Disable the response cache.")
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Resume an interrupted run, skipping functions it already indexed.",
+)
+@click.option(
+    "--ann-lists",
+    default=0,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Build an IVF approximate nearest-neighbour index with this many lists (0 disables it).",
+)
+@click.option(
+    "--single-call/--two-calls",
+    default=False,
+    show_default=True,
+    help="Extract the description and keywords of a function in one LLM request.",
+)
+@click.option(
+    "--docstring-min-words",
+    default=0,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help=(
+        "Describe functions by their docstring when its summary has at least "
+        "this many words, and strip docstrings from the prompts (0 disables it)."
+    ),
+)
+@click.option(
+    "--max-retries",
+    default=MAX_RETRIES,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Retries of a failed API request.",
+)
+@click.option(
+    "--timeout",
+    default=REQUEST_TIMEOUT,
+    show_default=True,
+    type=click.FloatRange(min=0, min_open=True),
+    help="Seconds before an API request times out.",
+)
+@click.option(
+    "--rpm",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Budget of API requests per minute.",
+)
+@click.option(
+    "--tpm",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Budget of API tokens per minute.",
 )
 @click.option("--verbose", is_flag=True, help="Print info.")
-def index(path, exclude, verbose):
+def index(
+    path,
+    exclude,
+    concurrency,
+    initial_concurrency,
+    workers,
+    cache_size,
+    no_cache,
+    resume,
+    ann_lists,
+    single_call,
+    docstring_min_words,
+    max_retries,
+    timeout,
+    rpm,
+    tpm,
+    verbose,
+):
     """Index a project."""
-    if exclude is None:
+    if not exclude:
         exclude = [".venv", ".env", "venv", "env"]
 
     if verbose:
         logger.setLevel(logging.DEBUG)
 
-    # call compiler
-    compiler_iter = iterate_over_functions_project(path, exclude=exclude)
-    clients = get_ai_clients()
+    # call compiler, collecting the call graph symbols from the same parse
+    walk_stats = WalkStats()
+    call_symbols = SymbolTable()
+    compiler_iter = iterate_over_functions_project(
+        path,
+        exclude=exclude,
+        workers=workers,
+        stats=walk_stats,
+        call_symbols=call_symbols,
+    )
+    clients = get_ai_clients(timeout=timeout)
+    # the concurrency option caps what the governor may grow to
+    governor = RequestGovernor(
+        max_retries=max_retries,
+        initial_concurrency=min(initial_concurrency, concurrency),
+        max_concurrency=concurrency,
+        requests_per_minute=rpm,
+        tokens_per_minute=tpm,
+    )
+    set_request_governor(governor)
+
+    cache = None
+    if not no_cache:
+        cache = ResponseCache(
+            os.path.join(path, ".lattice", "cache"), max_size=cache_size * 1024 * 1024
+        )
+    set_response_cache(cache)
+
+    summary = index_project(
+        compiler_iter,
+        path,
+        clients,
+        concurrency=concurrency,
+        ann_lists=ann_lists,
+        resume=resume,
+        single_call=single_call,
+        docstring_min_words=docstring_min_words,
+        call_symbols=call_symbols,
+    )
+    click.echo(
+        f"indexed {summary['indexed']} functions, reused {summary['reused']}, "
+        f"resumed {summary['resumed']}, removed {summary['removed']}"
+    )
+    click.echo(
+        f"compiled {walk_stats.files} files, skipped {walk_stats.skipped_files} "
+        f"files ({walk_stats.skipped_bytes / 1024 / 1024:.1f} MB) and pruned "
+        f"{walk_stats.pruned_directories} directories without entering them"
+    )
+    if docstring_min_words > 0:
+        click.echo(f"docstrings saved {summary['llm_calls_saved']} LLM calls")
+    governor_stats = governor.stats()
+    click.echo(
+        f"API requests: {governor_stats['retries']} retries, "
+        f"{governor_stats['throttled']} throttled, "
+        f"concurrency settled at {governor_stats['concurrency']}"
+    )
+
+    if cache is not None:
+        for kind, counts in cache.stats().items():
+            click.echo(
+                f"{kind} cache: {counts['hits']} hits, {counts['misses']} misses"
+            )
+
+
+@click.command(name="serve")
+@click.argument("path", required=True, type=click.Path(exists=True))
+@click.option("--host", default="127.0.0.1", show_default=True, help="Bind host.")
+@click.option("--port", default=8000, show_default=True, help="Bind port.")
+@click.option("--verbose", is_flag=True, help="Print info.")
+def serve(path, host, port, verbose):
+    """Serve search requests from an index kept in memory."""
+    if verbose:
+        logger.setLevel(logging.DEBUG)
 
-    index_project(compiler_iter, path, clients)
+    app = create_app(path, get_ai_clients())
+    uvicorn.run(app, host=host, port=port)
 
 
 # Add the index command to the lattice group
 lattice.add_command(index)
 lattice.add_command(search)
+lattice.add_command(serve)
 
 
 if __name__ == "__main__":
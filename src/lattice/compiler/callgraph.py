@@ -0,0 +1,471 @@
+import ast
+import os
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .source import get_source_map
+
+CALL_GRAPH_FILE = "callgraph.npz"
+# the call graph as a table of calls between index ids
+RELATIONSHIP_FILE = "relationship.parquet"
+# how many re-exports are followed when resolving an imported name
+MAX_IMPORT_DEPTH = 8
+
+
+@dataclass
+class FunctionSymbol:
+    path: str
+    lineno: int
+    qualname: str
+    arguments: str = ""
+    returns: str = ""
+
+
+@dataclass
+class CallGraph:
+    """
+    Calls between functions as a CSR adjacency. The callees of function `i`
+    are `targets[indptr[i]:indptr[i + 1]]`, called on `line_numbers` of the
+    same slice.
+    """
+
+    indptr: np.ndarray
+    targets: np.ndarray
+    line_numbers: np.ndarray
+
+    @property
+    def num_functions(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.targets)
+
+    def callees(self, function: int) -> np.ndarray:
+        return self.targets[self.indptr[function] : self.indptr[function + 1]]
+
+    def remap(self, rows: np.ndarray, num_rows: int) -> "CallGraph":
+        """
+        Move the graph onto other row numbers, `rows[i]` being the new row of
+        function `i`. Calls from or to functions mapped to -1 are dropped.
+        """
+        sources = np.repeat(np.arange(self.num_functions), np.diff(self.indptr))
+        sources, targets = rows[sources], rows[self.targets]
+        kept = (sources >= 0) & (targets >= 0)
+        return _make_call_graph(
+            sources[kept], targets[kept], self.line_numbers[kept], num_rows
+        )
+
+
+@dataclass
+class _Module:
+    name: str
+    is_package: bool
+    imports: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class _Class:
+    module: _Module
+    # the dotted names of the bases, so no syntax tree is kept
+    bases: List[str]
+
+
+def _make_call_graph(
+    sources: np.ndarray, targets: np.ndarray, line_numbers: np.ndarray, num_rows: int
+) -> CallGraph:
+    order = np.lexsort((line_numbers, targets, sources))
+    indptr = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=num_rows), out=indptr[1:])
+    return CallGraph(
+        indptr=indptr,
+        targets=np.asarray(targets, dtype=np.int64)[order],
+        line_numbers=np.asarray(line_numbers, dtype=np.int64)[order],
+    )
+
+
+def module_name(file_path: str, project_path: str) -> Tuple[str, bool]:
+    relative_path = os.path.splitext(os.path.relpath(file_path, project_path))[0]
+    parts = relative_path.split(os.sep)
+    is_package = parts[-1] == "__init__"
+    if is_package:
+        parts = parts[:-1]
+    return ".".join(parts), is_package
+
+
+def _dotted_name(node: ast.expr) -> Optional[str]:
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return ".".join(reversed(parts))
+
+
+def _import_target(module: _Module, node: ast.ImportFrom) -> str:
+    if not node.level:
+        return node.module or ""
+    package = module.name.split(".") if module.name else []
+    if not module.is_package:
+        package = package[:-1]
+    package = package[: len(package) - (node.level - 1)]
+    return ".".join(package + ([node.module] if node.module else []))
+
+
+def _add_imports(module: _Module, node: ast.AST) -> None:
+    # imports anywhere in the file are treated as module level bindings
+    if isinstance(node, ast.Import):
+        for alias in node.names:
+            if alias.asname:
+                module.imports[alias.asname] = alias.name
+            else:
+                head = alias.name.split(".")[0]
+                module.imports[head] = head
+    else:
+        target = _import_target(module, node)
+        for alias in node.names:
+            if alias.name != "*":
+                name = alias.asname or alias.name
+                module.imports[name] = f"{target}.{alias.name}".lstrip(".")
+
+
+@dataclass
+class _Scope:
+    file_path: str
+    module: _Module
+    # qualified name of the scope and the qualname prefix of its children
+    prefix: str
+    qualprefix: str
+    klass: Optional[str] = None
+    function: Optional[int] = None
+
+
+class SymbolTable:
+    """
+    The modules, classes, functions and import bindings of some files and
+    the calls their functions make, not resolved yet.
+
+    Tables of other files can be merged in as the files are parsed, so a
+    project's table grows file by file without keeping one table per file.
+    """
+
+    def __init__(self) -> None:
+        # the files added, in order
+        self.files: Dict[str, None] = {}
+        self.symbols: List[FunctionSymbol] = []
+        self.functions: Dict[str, int] = {}
+        self.classes: Dict[str, _Class] = {}
+        self.modules: Dict[str, _Module] = {}
+        # (qualified name, module, enclosing class) of every function
+        self.bodies: List[Tuple[str, _Module, Optional[str]]] = []
+        # the (dotted name, line) of the calls every function makes
+        self.calls: List[List[Tuple[str, int]]] = []
+
+    def add_file(self, file_path: str, project_path: str) -> None:
+        source_map = get_source_map(file_path)
+        tree = ast.parse(source_map.source, filename=file_path)
+        self.add_tree(tree, file_path, project_path)
+
+    def add_tree(self, tree: ast.Module, file_path: str, project_path: str) -> None:
+        self.files[file_path] = None
+        name, is_package = module_name(file_path, project_path)
+        module = _Module(name=name, is_package=is_package)
+        self.modules[name] = module
+        self._visit_children(tree, _Scope(file_path, module, name, ""))
+
+    def merge(self, other: "SymbolTable") -> None:
+        # adding the files of another table as if they were added to this one
+        offset = len(self.symbols)
+        self.files.update(other.files)
+        self.symbols.extend(other.symbols)
+        for qualified, function in other.functions.items():
+            self.functions.setdefault(qualified, function + offset)
+        self.classes.update(other.classes)
+        self.modules.update(other.modules)
+        self.bodies.extend(other.bodies)
+        self.calls.extend(other.calls)
+
+    def _visit_children(self, node: ast.AST, scope: _Scope) -> None:
+        for child in ast.iter_child_nodes(node):
+            self._visit(child, scope)
+
+    def _visit(self, node: ast.AST, scope: _Scope) -> None:
+        # collecting definitions, imports and calls in a single pass over the tree
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            for decorator in node.decorator_list:
+                self._visit(decorator, scope)
+
+            qualified = f"{scope.prefix}.{node.name}".lstrip(".")
+            function = len(self.symbols)
+            self.functions.setdefault(qualified, function)
+            qualname = scope.qualprefix + node.name
+            self.symbols.append(
+                FunctionSymbol(
+                    scope.file_path, node.lineno, qualname, *_node_signature(node)
+                )
+            )
+            self.bodies.append((qualified, scope.module, scope.klass))
+            self.calls.append([])
+            body_scope = _Scope(
+                file_path=scope.file_path,
+                module=scope.module,
+                prefix=qualified,
+                qualprefix=f"{scope.qualprefix}{node.name}.",
+                function=function,
+            )
+            for statement in node.body:
+                self._visit(statement, body_scope)
+
+        elif isinstance(node, ast.ClassDef):
+            qualified = f"{scope.prefix}.{node.name}".lstrip(".")
+            bases = [_dotted_name(base) for base in node.bases]
+            self.classes[qualified] = _Class(
+                module=scope.module, bases=[base for base in bases if base is not None]
+            )
+            class_scope = _Scope(
+                file_path=scope.file_path,
+                module=scope.module,
+                prefix=qualified,
+                qualprefix=f"{scope.qualprefix}{node.name}.",
+                klass=qualified,
+            )
+            for statement in node.body:
+                self._visit(statement, class_scope)
+
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            _add_imports(scope.module, node)
+
+        elif isinstance(node, ast.expr) and scope.function is None:
+            # expressions outside functions hold no definitions or calls we keep
+            return
+
+        else:
+            if isinstance(node, ast.Call):
+                name = _dotted_name(node.func)
+                if name is not None:
+                    self.calls[scope.function].append((name, node.lineno))
+            self._visit_children(node, scope)
+
+    def _split_module(self, qualified: str) -> Tuple[Optional[_Module], str]:
+        # the longest known module the qualified name starts with
+        parts = qualified.split(".")
+        for end in range(len(parts), -1, -1):
+            module = self.modules.get(".".join(parts[:end]))
+            if module is not None:
+                return module, ".".join(parts[end:])
+        return None, qualified
+
+    def resolve(self, qualified: str, depth: int = 0) -> Optional[int]:
+        if qualified in self.functions:
+            return self.functions[qualified]
+        if qualified in self.classes:
+            return self.resolve_method(qualified, "__init__")
+
+        # following names a module imports from elsewhere
+        module, rest = self._split_module(qualified)
+        if module is None or not rest or depth >= MAX_IMPORT_DEPTH:
+            return None
+        head, _, tail = rest.partition(".")
+        if head not in module.imports:
+            return None
+        target = module.imports[head] + (f".{tail}" if tail else "")
+        return self.resolve(target, depth + 1)
+
+    def resolve_method(self, klass: str, method: str, depth: int = 0) -> Optional[int]:
+        qualified = f"{klass}.{method}"
+        if qualified in self.functions:
+            return self.functions[qualified]
+        if depth >= MAX_IMPORT_DEPTH:
+            return None
+
+        # looking the method up in the base classes, depth first
+        for base_name in self.classes[klass].bases:
+            base_class = self.resolve_class(self.classes[klass].module, base_name)
+            if base_class is not None:
+                target = self.resolve_method(base_class, method, depth + 1)
+                if target is not None:
+                    return target
+        return None
+
+    def resolve_class(self, module: _Module, name: str) -> Optional[str]:
+        qualified = self.qualify(module, name)
+        for _ in range(MAX_IMPORT_DEPTH):
+            if qualified is None or qualified in self.classes:
+                return qualified
+            owner, rest = self._split_module(qualified)
+            head, _, tail = rest.partition(".")
+            if owner is None or head not in owner.imports:
+                return None
+            qualified = owner.imports[head] + (f".{tail}" if tail else "")
+        return None
+
+    def qualify(self, module: _Module, name: str) -> Optional[str]:
+        head, _, tail = name.partition(".")
+        if head in module.imports:
+            prefix = module.imports[head]
+        else:
+            prefix = f"{module.name}.{head}".lstrip(".")
+        return prefix + (f".{tail}" if tail else "")
+
+
+def _resolve_call(
+    table: SymbolTable,
+    name: str,
+    qualified: str,
+    module: _Module,
+    klass: Optional[str],
+) -> Optional[int]:
+    head, _, rest = name.partition(".")
+
+    # methods called on the instance or class
+    if klass is not None and head in ("self", "cls") and rest and "." not in rest:
+        return table.resolve_method(klass, rest)
+
+    # functions defined inside the calling function
+    if not rest and f"{qualified}.{head}" in table.functions:
+        return table.functions[f"{qualified}.{head}"]
+
+    target = table.qualify(module, name)
+    return table.resolve(target) if target else None
+
+
+def collect_symbols(tree: ast.Module, file_path: str, project_path: str) -> SymbolTable:
+    """
+    The symbol table of one parsed file, for building the call graph without
+    parsing the file again.
+    """
+    table = SymbolTable()
+    table.add_tree(tree, file_path, project_path)
+    return table
+
+
+def build_call_graph(
+    file_paths: Iterable[str],
+    project_path: str,
+    symbols: Optional[SymbolTable] = None,
+) -> Tuple[List[FunctionSymbol], CallGraph]:
+    """
+    Resolve the calls between the functions of the given files statically.
+
+    A symbol table of every module, class, function and import binding is
+    built in a single pass over every file, then the calls collected on
+    the way are resolved against it. Calls to plain names, imported names, module
+    attributes, classes (as their `__init__`) and methods on `self`/`cls`
+    (through the base classes) are resolved, anything else is left out.
+
+    Given `symbols`, the table collected while the files were compiled, only
+    the files missing from it are parsed and added to it, after the files
+    it already holds.
+    """
+    table = symbols if symbols is not None else SymbolTable()
+    for file_path in file_paths:
+        if file_path not in table.files:
+            table.add_file(file_path, project_path)
+
+    sources, targets, line_numbers = [], [], []
+    for source, (qualified, module, klass) in enumerate(table.bodies):
+        seen = set()
+        for name, line_number in table.calls[source]:
+            target = _resolve_call(table, name, qualified, module, klass)
+            if target is None or (target, line_number) in seen:
+                continue
+            seen.add((target, line_number))
+            sources.append(source)
+            targets.append(target)
+            line_numbers.append(line_number)
+
+    graph = _make_call_graph(
+        np.array(sources, dtype=np.int64),
+        np.array(targets, dtype=np.int64),
+        np.array(line_numbers, dtype=np.int64),
+        len(table.symbols),
+    )
+    return table.symbols, graph
+
+
+def save_call_graph(path: str, graph: CallGraph) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            indptr=graph.indptr,
+            targets=graph.targets,
+            line_numbers=graph.line_numbers,
+        )
+    os.replace(tmp_path, path)
+
+
+def load_call_graph(path: str) -> CallGraph:
+    with np.load(path) as data:
+        return CallGraph(
+            indptr=data["indptr"],
+            targets=data["targets"],
+            line_numbers=data["line_numbers"],
+        )
+
+
+def _node_signature(node: ast.AST) -> Tuple[str, str]:
+    # the arguments and return annotation of a function node
+    returns = ast.unparse(node.returns) if node.returns else ""
+    return ast.unparse(node.args), returns
+
+
+def _signature(definition: str) -> Tuple[str, str]:
+    # the arguments and return annotation of a function definition
+    lines = definition.splitlines()
+    indent = len(lines[0]) - len(lines[0].lstrip()) if lines else 0
+    try:
+        node = ast.parse("\n".join(line[indent:] for line in lines)).body[0]
+    except (SyntaxError, IndexError):
+        return "", ""
+    if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return "", ""
+    return _node_signature(node)
+
+
+def relationship_frame(
+    metadata: pd.DataFrame,
+    graph: CallGraph,
+    signatures: Optional[Dict[int, Tuple[str, str]]] = None,
+) -> pd.DataFrame:
+    """
+    The call graph of an index as a relationship table, one row per call
+    with the signature of the called function. Called rows missing from
+    `signatures` have theirs parsed from their definition.
+    """
+    signatures = signatures or {}
+    sources = np.repeat(np.arange(graph.num_functions), np.diff(graph.indptr))
+    ids = metadata["id"].astype(str).to_numpy()
+    definitions = metadata["definition"]
+    signatures = {
+        target: signatures.get(target) or _signature(definitions.iloc[target])
+        for target in np.unique(graph.targets).tolist()
+    }
+    source_ids, target_ids = ids[sources], ids[graph.targets]
+    return pd.DataFrame(
+        {
+            "id": [
+                str(uuid.uuid5(uuid.NAMESPACE_OID, f"{source}:{target}:{line}"))
+                for source, target, line in zip(
+                    source_ids, target_ids, graph.line_numbers.tolist()
+                )
+            ],
+            "source_id": source_ids,
+            "target_id": target_ids,
+            "line_number": graph.line_numbers,
+            "arguments": [signatures[t][0] for t in graph.targets.tolist()],
+            "returns": [signatures[t][1] for t in graph.targets.tolist()],
+        }
+    )
+
+
+def save_relationship_frame(path: str, relationship: pd.DataFrame) -> None:
+    tmp_path = f"{path}.tmp"
+    relationship.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
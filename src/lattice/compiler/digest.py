@@ -1,24 +1,27 @@
-from typing import Iterator
+from typing import Iterator, List, Optional, Tuple
 
 import ast
-from os import walk, path
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
 
 import jedi
 
+from .callgraph import SymbolTable, collect_symbols
+from .session import DigestSession
+from .source import SourceMap, get_source_map
 from .types import Function
+from .walk import WalkStats, iterate_over_project_files
 
+COMPILE_CHUNK_SIZE = 64
 
-def read_from_script(script_path: str, start_line: int, end_line: int) -> str:
-    with open(script_path) as f:
-        source = f.read()
 
-    return read_from_source(source, start_line, end_line)
+def read_from_script(script_path: str, start_line: int, end_line: int) -> str:
+    return get_source_map(script_path).read(start_line, end_line)
 
 
 def read_from_source(source: str, start_line: int, end_line: int) -> str:
-    lines = source.splitlines()[start_line - 1 : end_line]
-
-    return "\n".join(lines)
+    return SourceMap(source).read(start_line, end_line)
 
 
 def extract_definition(script: jedi.Script, name: str) -> str:
@@ -45,83 +48,114 @@ def expand_definition(function_source: str) -> Iterator:
             yield child.func.id
 
 
-def analyze_function(file_path, function_name):
-    # Load the script from the file
-    with open(file_path, "r") as f:
-        source = f.read()
-
-    # Use Jedi to parse the source code
-    script = jedi.Script(source, path=file_path)
-
-    # Find the specified function definition
-    function_definitions = [name for name in script.search(function_name)]
-
-    if not function_definitions:
-        raise ValueError(f"Function '{function_name}' not found in {file_path}")
-
-    function_definition = function_definitions[0]
-
-    # Get the full definition of the function
-    start_line = function_definition.line
-    end_line = function_definition.get_definition_end_position()[0]
+def analyze_function(
+    file_path, function_name, session: Optional[DigestSession] = None
+):
+    # resolving through a shared session when one is given
+    if session is None:
+        session = DigestSession()
+    return session.analyze_function(file_path, function_name)
 
-    function_lines = source.splitlines()[start_line - 1 : end_line]
-    function_source = "\n".join(function_lines)
-
-    # Analyze function calls within the function
-    function_calls = []
-    for usage in function_definition.usages():
-        if usage.type == "function":
-            call_site = usage.parent()
-            if call_site:
-                definition = call_site.goto()
-                if definition:
-                    function_calls.append(
-                        {
-                            "name": usage.name,
-                            "path": (
-                                definition[0].module_path
-                                if definition[0].module_path
-                                else file_path
-                            ),
-                        }
-                    )
-
-    return function_source, function_calls
 
+def compile_script(
+    file_path: str, project_path: Optional[str] = None
+) -> Tuple[List[Function], Optional[SymbolTable]]:
+    # parsing a file once for its functions and, given the project path, the
+    # symbols of its call graph
+    source_map = get_source_map(file_path)
+    tree = ast.parse(source_map.source, filename=file_path)
 
-def iterate_over_functions_script(file_path: str) -> Iterator[Function]:
-    with open(file_path, "r") as file:
-        source = file.read()
-
-    tree = ast.parse(source, filename=file_path)
-
+    functions = []
     for node in ast.walk(tree):
         if isinstance(node, ast.FunctionDef) or isinstance(node, ast.AsyncFunctionDef):
-            yield Function(
-                name=node.name,
-                definition=read_from_source(source, node.lineno, node.end_lineno),
+            functions.append(
+                Function(
+                    name=node.name,
+                    definition=source_map.read(node.lineno, node.end_lineno),
+                    path=file_path,
+                    lineno=node.lineno,
+                )
             )
+    if project_path is None:
+        return functions, None
+    return functions, collect_symbols(tree, file_path, project_path)
+
+
+def iterate_over_functions_script(file_path: str) -> Iterator[Function]:
+    yield from compile_script(file_path)[0]
+
+
+def compile_scripts(
+    file_paths: List[str], project_path: Optional[str] = None
+) -> Tuple[List[List[Function]], Optional[SymbolTable]]:
+    # a work unit of the parallel compiler, it has to be a module level function
+    # so that it can be pickled into the worker processes, returning the
+    # functions of every file and, given the project path, one symbol table
+    # of the chunk
+    functions, chunk_symbols = [], None
+    for file_path in file_paths:
+        file_functions, symbols = compile_script(file_path, project_path)
+        functions.append(file_functions)
+        if symbols is not None:
+            if chunk_symbols is None:
+                chunk_symbols = symbols
+            else:
+                chunk_symbols.merge(symbols)
+    return functions, chunk_symbols
 
 
 def iterate_over_functions_project(
-    directory: str, deep=True, exclude=[]
+    directory: str,
+    deep=True,
+    exclude=[],
+    workers=1,
+    chunk_size=COMPILE_CHUNK_SIZE,
+    stats: Optional[WalkStats] = None,
+    call_symbols: Optional[SymbolTable] = None,
 ) -> Iterator[Function]:
-    _, directories, files = next(walk(directory))
-    for file in files:
-        if file.split(".")[-1] == "py":
-            file_path = path.join(directory, file)
-            for f in iterate_over_functions_script(file_path):
-                yield f
-    if not deep:
+    """
+    Yield the functions of every Python file in the project, see
+    `iterate_over_project_files` for the files that are left out. With
+    `workers` above one, files are parsed in chunks of `chunk_size` by a
+    process pool, and the functions are still yielded in the same order as
+    sequentially.
+
+    Given `call_symbols`, the call graph symbols of every file are collected
+    from the same parse and merged into it, a file or a chunk of files at a
+    time, before the functions of the file are yielded.
+    """
+    file_paths = iterate_over_project_files(
+        directory, deep=deep, exclude=exclude, stats=stats
+    )
+    project_path = directory if call_symbols is not None else None
+    if workers <= 1:
+        for file_path in file_paths:
+            functions, symbols = compile_script(file_path, project_path)
+            _merge_symbols(call_symbols, symbols)
+            yield from functions
         return
 
-    for child_directory in directories:
-        if child_directory in exclude:
-            continue
-        dir_path = path.join(directory, child_directory)
-        for f in iterate_over_functions_project(dir_path, exclude=exclude):
-            yield f
+    chunks = iter(lambda: list(islice(file_paths, chunk_size)), [])
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+
+        def submit(chunk: List[str]) -> Future:
+            return executor.submit(compile_scripts, chunk, project_path)
+
+        # keeping a bounded window of chunks in flight, consumed in submission order
+        pending = deque(submit(chunk) for chunk in islice(chunks, 2 * workers))
+        while pending:
+            functions, symbols = pending.popleft().result()
+            pending.extend(submit(next_chunk) for next_chunk in islice(chunks, 1))
+            _merge_symbols(call_symbols, symbols)
+            for file_functions in functions:
+                yield from file_functions
+
+
+def _merge_symbols(
+    call_symbols: Optional[SymbolTable], symbols: Optional[SymbolTable]
+) -> None:
+    if call_symbols is not None and symbols is not None:
+        call_symbols.merge(symbols)
 
 
 # # Example usage
@@ -0,0 +1,154 @@
+import os
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import jedi
+
+from .source import SourceMap, get_source_map
+from .types import Function
+
+SCRIPT_CACHE_SIZE = 128
+
+
+@dataclass
+class _FileNames:
+    script: jedi.Script
+    source_map: SourceMap
+    # function definitions by name, in source order
+    definitions: Dict[str, List] = field(default_factory=dict)
+    # names followed by a call, sorted by position
+    calls: List = field(default_factory=list)
+    call_positions: List[Tuple[int, int]] = field(default_factory=list)
+    # resolved call targets by (line, column)
+    targets: Dict[Tuple[int, int], Optional[Dict]] = field(default_factory=dict)
+
+
+class DigestSession:
+    """
+    Shares one `jedi.Project` between all digest lookups of a project and
+    caches the parsed script, the names and the resolved calls of every file
+    until its modification time or size changes.
+    """
+
+    def __init__(
+        self, project_path: Optional[str] = None, max_scripts: int = SCRIPT_CACHE_SIZE
+    ) -> None:
+        self.project = jedi.Project(project_path) if project_path else None
+        self.max_scripts = max_scripts
+        self._files: "OrderedDict[str, Tuple[Tuple[int, int], _FileNames]]" = (
+            OrderedDict()
+        )
+
+    def _file(self, file_path: str) -> _FileNames:
+        stat = os.stat(file_path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        path = os.path.abspath(file_path)
+        cached = self._files.get(path)
+        if cached is not None and cached[0] == key:
+            self._files.move_to_end(path)
+            return cached[1]
+
+        source_map = get_source_map(file_path)
+        script = jedi.Script(source_map.source, path=file_path, project=self.project)
+        names = _FileNames(script=script, source_map=source_map)
+
+        # collecting every definition and call of the file in one pass
+        all_names = script.get_names(all_scopes=True, definitions=True, references=True)
+        for name in all_names:
+            if name.is_definition():
+                if name.type == "function":
+                    names.definitions.setdefault(name.name, []).append(name)
+            elif _is_call(source_map, name):
+                names.calls.append(name)
+        names.calls.sort(key=lambda name: (name.line, name.column))
+        names.call_positions = [(name.line, name.column) for name in names.calls]
+
+        self._files[path] = (key, names)
+        while len(self._files) > self.max_scripts:
+            self._files.popitem(last=False)
+        return names
+
+    def script(self, file_path: str) -> jedi.Script:
+        return self._file(file_path).script
+
+    def find_definition(self, file_path: str, function_name: str):
+        definitions = self._file(file_path).definitions.get(function_name)
+        if not definitions:
+            raise ValueError(f"Function '{function_name}' not found in {file_path}")
+        return definitions[0]
+
+    def extract_definition(self, file_path: str, function_name: str) -> str:
+        definition = self.find_definition(file_path, function_name)
+        start_line = definition.get_definition_start_position()[0]
+        end_line = definition.get_definition_end_position()[0]
+        return self._file(file_path).source_map.read(start_line, end_line)
+
+    def analyze_function(
+        self, file_path: str, function_name: str
+    ) -> Tuple[str, List[Dict]]:
+        return self.analyze_functions(file_path, [function_name])[function_name]
+
+    def analyze_functions(
+        self, file_path: str, function_names: Iterable[str]
+    ) -> Dict[str, Tuple[str, List[Dict]]]:
+        """
+        Return the source and the resolved calls of many functions of one
+        file, reusing the names collected for the file.
+        """
+        names = self._file(file_path)
+        results = {}
+        for function_name in function_names:
+            definition = self.find_definition(file_path, function_name)
+            start_line = definition.line
+            end_line = definition.get_definition_end_position()[0]
+            function_source = names.source_map.read(start_line, end_line)
+
+            # the calls within the lines of the function
+            first = bisect_left(names.call_positions, (start_line, 0))
+            last = bisect_right(names.call_positions, (end_line, float("inf")))
+            function_calls = []
+            for call in names.calls[first:last]:
+                position = (call.line, call.column)
+                if position not in names.targets:
+                    names.targets[position] = _resolve_call(call, file_path)
+                if names.targets[position] is not None:
+                    function_calls.append(names.targets[position])
+            results[function_name] = (function_source, function_calls)
+        return results
+
+    def analyze_project(
+        self, functions: Iterable[Function]
+    ) -> Dict[Tuple[str, str], Tuple[str, List[Dict]]]:
+        """
+        Analyze compiled functions file by file, keyed by (path, name).
+        """
+        by_file = defaultdict(list)
+        for function in functions:
+            by_file[function.path].append(function.name)
+
+        results = {}
+        for file_path, function_names in by_file.items():
+            analyzed = self.analyze_functions(file_path, dict.fromkeys(function_names))
+            for function_name, result in analyzed.items():
+                results[(file_path, function_name)] = result
+        return results
+
+
+def _is_call(source_map: SourceMap, name) -> bool:
+    # a reference directly followed by an opening parenthesis
+    line = source_map.read(name.line, name.line)
+    rest = line[name.column + len(name.name) :].lstrip()
+    return rest.startswith("(")
+
+
+def _resolve_call(name, file_path: str) -> Optional[Dict]:
+    definitions = name.goto(follow_imports=True)
+    if not definitions or definitions[0].type not in ("function", "class"):
+        return None
+    module_path = definitions[0].module_path
+    return {
+        "name": name.name,
+        "path": str(module_path) if module_path else file_path,
+    }
@@ -0,0 +1,45 @@
+import os
+from functools import lru_cache
+from itertools import accumulate
+from typing import List
+
+SOURCE_CACHE_SIZE = 256
+
+
+class SourceMap:
+    """
+    The source of a file together with the offset of every line in it, so a
+    range of lines is sliced without splitting the whole file again.
+    """
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        # offsets[i] is where line i + 1 starts, the last one is the end of the file
+        lengths = (len(line) for line in source.splitlines(keepends=True))
+        self.offsets: List[int] = [0, *accumulate(lengths)]
+
+    @property
+    def num_lines(self) -> int:
+        return len(self.offsets) - 1
+
+    def read(self, start_line: int, end_line: int) -> str:
+        # same result as joining source.splitlines()[start_line - 1 : end_line]
+        start_line = min(max(start_line, 1), self.num_lines + 1)
+        end_line = min(max(end_line, start_line - 1), self.num_lines)
+        text = self.source[self.offsets[start_line - 1] : self.offsets[end_line]]
+        return "\n".join(text.splitlines())
+
+
+@lru_cache(maxsize=SOURCE_CACHE_SIZE)
+def _load_source_map(path: str, mtime: int, size: int) -> SourceMap:
+    with open(path) as f:
+        return SourceMap(f.read())
+
+
+def get_source_map(path: str) -> SourceMap:
+    """
+    Return the source map of a file, read once and kept until the file's
+    modification time or size changes.
+    """
+    stat = os.stat(path)
+    return _load_source_map(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
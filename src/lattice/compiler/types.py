@@ -1,7 +1,10 @@
 from dataclasses import dataclass
+from typing import Optional
 
 
 @dataclass
 class Function:
     name: str
     definition: str
+    path: Optional[str] = None
+    lineno: Optional[int] = None
@@ -0,0 +1,216 @@
+import os
+import re
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Pattern, Tuple
+
+IGNORE_FILES = [".gitignore", ".latticeignore"]
+# directories that never hold project sources
+PRUNED_DIRECTORIES = {
+    ".git",
+    ".hg",
+    ".svn",
+    ".lattice",
+    ".tox",
+    ".mypy_cache",
+    ".pytest_cache",
+    "__pycache__",
+    "node_modules",
+}
+# every virtual environment has this file at its root, whatever it is called
+VENV_MARKER = "pyvenv.cfg"
+
+
+@dataclass
+class WalkStats:
+    """
+    Counts of what the project walk left out. Skipped files and bytes are
+    those of files seen in visited directories that were not compiled, and
+    pruned directories were not entered at all, so their contents are not
+    counted.
+    """
+
+    files: int = 0
+    skipped_files: int = 0
+    skipped_bytes: int = 0
+    pruned_directories: int = 0
+
+
+@dataclass
+class IgnoreRule:
+    regex: Pattern
+    negate: bool = False
+    directory_only: bool = False
+
+
+def translate_pattern(pattern: str) -> str:
+    """
+    Translate a gitignore glob into a regular expression matched against
+    paths relative to the directory of the ignore file.
+    """
+    # a slash anywhere but at the end anchors the pattern to that directory
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i) and (i == 0 or pattern[i - 1] == "/"):
+            regex += "(?:.*/)?"
+            i += 3
+            continue
+        if pattern.startswith("**", i) and (i == 0 or pattern[i - 1] == "/"):
+            regex += ".*"
+            i += 2
+            continue
+
+        if c == "*":
+            regex += "[^/]*"
+        elif c == "?":
+            regex += "[^/]"
+        elif c == "\\" and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        elif c == "[" and "]" in pattern[i + 2 :]:
+            end = pattern.index("]", i + 2)
+            content = pattern[i + 1 : end].replace("\\", "\\\\")
+            if content.startswith("!"):
+                content = "^" + content[1:]
+            regex += f"[{content}]"
+            i = end
+        else:
+            regex += re.escape(c)
+        i += 1
+
+    if not anchored:
+        regex = "(?:.*/)?" + regex
+    return regex
+
+
+def parse_ignore_lines(lines: List[str]) -> List[IgnoreRule]:
+    rules = []
+    for line in lines:
+        line = line.rstrip("\n").rstrip(" ")
+        if not line or line.startswith("#"):
+            continue
+
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        elif line.startswith("\\"):
+            line = line[1:]
+
+        directory_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            continue
+
+        rules.append(
+            IgnoreRule(
+                regex=re.compile(translate_pattern(line)),
+                negate=negate,
+                directory_only=directory_only,
+            )
+        )
+    return rules
+
+
+def load_ignore_rules(directory: str) -> List[IgnoreRule]:
+    rules = []
+    for name in IGNORE_FILES:
+        try:
+            with open(os.path.join(directory, name)) as f:
+                rules.extend(parse_ignore_lines(f.readlines()))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+    return rules
+
+
+def is_ignored(
+    rule_sets: List[Tuple[str, List[IgnoreRule]]], relative_path: str, is_dir: bool
+) -> bool:
+    # rules of deeper ignore files come later and the last matching rule wins
+    ignored = False
+    for base, rules in rule_sets:
+        if not relative_path.startswith(base):
+            continue
+        path = relative_path[len(base) :]
+        for rule in rules:
+            if rule.directory_only and not is_dir:
+                continue
+            if rule.regex.fullmatch(path):
+                ignored = not rule.negate
+    return ignored
+
+
+def iterate_over_project_files(
+    directory: str,
+    deep=True,
+    exclude=[],
+    stats: Optional[WalkStats] = None,
+) -> Iterator[str]:
+    """
+    Yield the Python files of a project, files of a directory before its
+    subdirectories and both in name order.
+
+    Directories named in `exclude`, a name or a list of names, or in
+    `PRUNED_DIRECTORIES`, virtual environments and anything matched by
+    `.gitignore` or `.latticeignore` rules are pruned without being entered.
+    Counts of what was left out are added to `stats`.
+    """
+    if stats is None:
+        stats = WalkStats()
+    if isinstance(exclude, str):
+        exclude = [exclude]
+    yield from _walk(directory, "", [], deep, set(exclude), stats)
+
+
+def _walk(
+    directory: str,
+    relative_directory: str,
+    rule_sets: List[Tuple[str, List[IgnoreRule]]],
+    deep: bool,
+    exclude: set,
+    stats: WalkStats,
+) -> Iterator[str]:
+    rules = load_ignore_rules(directory)
+    if rules:
+        rule_sets = rule_sets + [(relative_directory, rules)]
+
+    with os.scandir(directory) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+
+    directories = []
+    for entry in entries:
+        relative_path = relative_directory + entry.name
+        if entry.is_dir():
+            directories.append((entry, relative_path))
+            continue
+        if not entry.is_file():
+            continue
+
+        if entry.name.endswith(".py") and not is_ignored(
+            rule_sets, relative_path, is_dir=False
+        ):
+            stats.files += 1
+            yield entry.path
+        else:
+            stats.skipped_files += 1
+            stats.skipped_bytes += entry.stat().st_size
+
+    if not deep:
+        return
+
+    for entry, relative_path in directories:
+        if (
+            entry.name in exclude
+            or entry.name in PRUNED_DIRECTORIES
+            or entry.is_symlink()
+            or os.path.isfile(os.path.join(entry.path, VENV_MARKER))
+            or is_ignored(rule_sets, relative_path, is_dir=True)
+        ):
+            stats.pruned_directories += 1
+            continue
+        yield from _walk(
+            entry.path, relative_path + "/", rule_sets, deep, exclude, stats
+        )
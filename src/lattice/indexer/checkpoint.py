@@ -0,0 +1,134 @@
+import os
+import re
+import json
+import shutil
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ..logger import logger
+from ..storage import RaggedEmbeddings
+from .manifest import hash_text
+
+CHECKPOINT_DIRECTORY = "checkpoint"
+SETTINGS_FILE = "settings.json"
+PART_PATTERN = re.compile(r"part-(\d+)\.npy")
+
+
+def _fsync_replace(tmp_path: str, path: str) -> None:
+    with open(tmp_path, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Checkpoint:
+    """
+    Enriched rows of an index run, saved under `.lattice/checkpoint` one part
+    per batch as soon as the batch is done, so an interrupted run can be
+    resumed without enriching them again.
+
+    A part is a parquet metadata file and `.npy` files of its ragged
+    embeddings. They are written next to their final names and the keyword
+    offsets, which name the part, are swapped in last, so a part only exists
+    once it is complete.
+
+    The `settings` of the run, such as its models and prompts, are saved with
+    the parts, and resuming with other settings starts over.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        resume: bool = False,
+        settings: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.path = os.path.join(directory, CHECKPOINT_DIRECTORY)
+        self.settings = settings or {}
+        if resume and self._load_settings() != self.settings:
+            logger.info("index settings changed, discarding the checkpoint")
+            resume = False
+        if not resume:
+            shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+        self._save_settings()
+
+        self.parts: Dict[int, Tuple[pd.DataFrame, RaggedEmbeddings]] = {}
+        # (part, row) of every checkpointed definition by its hash
+        self.rows: Dict[str, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+        for name in sorted(os.listdir(self.path)):
+            match = PART_PATTERN.fullmatch(name)
+            if match:
+                self._load_part(int(match.group(1)))
+        self._next_part = max(self.parts, default=-1) + 1
+        if self.rows:
+            logger.info(f"resuming with {len(self.rows)} checkpointed functions")
+
+    def _load_settings(self) -> Optional[Dict[str, str]]:
+        try:
+            with open(os.path.join(self.path, SETTINGS_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_settings(self) -> None:
+        path = os.path.join(self.path, SETTINGS_FILE)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(self.settings, f, indent=1)
+        _fsync_replace(f"{path}.tmp", path)
+
+    def _part_paths(self, part: int) -> Tuple[str, str, str, str, str]:
+        name = os.path.join(self.path, f"part-{part:06d}")
+        return (
+            f"{name}.parquet",
+            f"{name}.base.npy",
+            f"{name}.keywords.npy",
+            f"{name}.keyword_ids.npy",
+            f"{name}.npy",
+        )
+
+    def _load_part(self, part: int) -> None:
+        metadata_path, *embedding_paths = self._part_paths(part)
+        metadata = pd.read_parquet(metadata_path)
+        base, keywords, keyword_ids, offsets = [
+            np.load(path, mmap_mode="r") if os.path.isfile(path) else None
+            for path in embedding_paths
+        ]
+        # parts saved without keyword ids hold one keyword vector per keyword
+        embeddings = RaggedEmbeddings(
+            base=base, keywords=keywords, offsets=offsets, keyword_ids=keyword_ids
+        )
+        self.parts[part] = (metadata, embeddings)
+        for row, definition in enumerate(metadata["definition"]):
+            self.rows.setdefault(hash_text(definition), (part, row))
+
+    def lookup(self, definition_hash: str) -> Optional[Tuple[int, int]]:
+        return self.rows.get(definition_hash)
+
+    def part(self, part: int) -> Tuple[pd.DataFrame, RaggedEmbeddings]:
+        return self.parts[part]
+
+    def save(self, metadata: pd.DataFrame, embeddings: RaggedEmbeddings) -> None:
+        with self._lock:
+            part = self._next_part
+            self._next_part += 1
+
+        metadata_path, *embedding_paths = self._part_paths(part)
+        metadata.astype({"id": str}).to_parquet(f"{metadata_path}.tmp", index=False)
+        arrays = [
+            embeddings.base.astype(np.float32, copy=False),
+            embeddings.keywords.astype(np.float32, copy=False),
+            embeddings.keyword_ids,
+            embeddings.offsets,
+        ]
+        for path, array in zip(embedding_paths, arrays):
+            with open(f"{path}.tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+        for path in [metadata_path, *embedding_paths]:
+            _fsync_replace(f"{path}.tmp", path)
+
+    def clear(self) -> None:
+        self.parts, self.rows = {}, {}
+        shutil.rmtree(self.path, ignore_errors=True)
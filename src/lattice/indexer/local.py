@@ -2,163 +2,1062 @@ from typing import Iterator
 
 import os
 import json
+import asyncio
+import functools
 import configparser
-from typing import Tuple, Union
+import queue
+import threading
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
 import uuid
 
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 from together import Together
 from openai import OpenAI
 
-from ..llm.together import get_together_chat_response, get_together_embedding
+from ..llm.together import (
+    EMBEDDING_BATCH_SIZE,
+    discard_together_chat_response,
+    get_together_chat_response,
+    get_together_embeddings,
+)
+from ..compiler.callgraph import (
+    CALL_GRAPH_FILE,
+    RELATIONSHIP_FILE,
+    CallGraph,
+    SymbolTable,
+    build_call_graph,
+    relationship_frame,
+    save_call_graph,
+    save_relationship_frame,
+)
 from ..compiler.types import Function
+from .checkpoint import Checkpoint
+from .manifest import (
+    empty_manifest,
+    file_fingerprint,
+    hash_text,
+    load_manifest,
+    save_manifest,
+)
+from ..llm.parsing import LLMResponseError, extract_json_object
 from ..logger import logger
 from ..retrieve import prompts
+from ..retrieve.ann import ANN_FILE, build_ivf_index, save_ivf_index
+from ..retrieve.utils import docstring_summary, strip_docstring
+from ..retrieve.bm25 import (
+    BM25_FILE,
+    build_bm25_index,
+    save_bm25_index,
+    tokenize_entity,
+)
+from ..storage import (
+    IndexWriter,
+    KeywordVocabulary,
+    RaggedEmbeddings,
+    has_index,
+    load_index,
+    load_keyword_vocabulary,
+    split_entity,
+)
 
+# batches of new functions enriched or waiting to be, beyond the one being filled
+PIPELINE_DEPTH = 2
+# reused rows are appended in runs of up to this many
+WRITE_RUN_SIZE = 4096
+REUSED = -1
+CHECKPOINTED = "checkpointed"
 
-def index(
-    entity: pd.DataFrame,
+
+def docstring_fast_path(
+    function_name: str, definition: str, docstring_min_words: int
+) -> Tuple[Optional[str], str]:
+    """
+    Return the description built from the docstring of a function if its
+    summary has at least `docstring_min_words` words, or None otherwise,
+    together with the definition to prompt with, which has the docstring
+    stripped either way.
+    """
+    docstring, code = strip_docstring(definition)
+    if not docstring:
+        return None, code
+    if len(docstring_summary(docstring).split()) < docstring_min_words:
+        return None, code
+    return prompts.docstring_description.format(
+        function_name=function_name, docstring=docstring
+    ), code
+
+
+def extract_keywords(
+    function_name: str,
+    description: str,
+    code: str,
+    keyword_extraction_prompt_template: str,
+    together_llm_client: Union[Together],
+    together_llm_model_name: str,
+) -> List[str]:
+    logger.debug(f"generating {function_name} keywords")
+    # extracting keywords for the current row of entity
+    keyword_extraction_prompt = keyword_extraction_prompt_template.format(
+        description=description, code=code
+    )
+    llm_response = get_together_chat_response(
+        prompt=keyword_extraction_prompt,
+        together_llm_client=together_llm_client,
+        together_llm_model_name=together_llm_model_name,
+    )
+    return json.loads(llm_response)["description_keywords"]
+
+
+def describe_function(
+    function_name: str,
+    definition: str,
     description_extraction_prompt_template: str,
     keyword_extraction_prompt_template: str,
     together_llm_client: Union[Together],
     together_llm_model_name: str,
-    together_embedding_client: Union[OpenAI],
-    together_embedding_model_name: str,
-) -> pd.DataFrame:
-    # processing entity rows
-    for idx, row in entity.iterrows():
-        function_name = row["function_name"]
-        definition = row["definition"]
-
-        logger.debug(f"embedding {function_name} name")
-        # embedding function_name
-        function_name_emb = get_together_embedding(
-            text=function_name,
-            together_embedding_client=together_embedding_client,
-            together_model_name=together_embedding_model_name,
-            normalize_embedding=True,
-        )
-        entity.loc[idx, "function_name_embedding"] = str(function_name_emb)
-        logger.debug(f"embedding {function_name} definition")
-        # embedding definition
-        definition_emb = get_together_embedding(
-            text=definition,
-            together_embedding_client=together_embedding_client,
-            together_model_name=together_embedding_model_name,
-            normalize_embedding=True,
+    docstring_min_words: int = 0,
+) -> Tuple[str, List[str], int]:
+    """
+    Describe a function with two LLM requests, one for its description and
+    one for its keywords. Also returns the number of requests saved by
+    describing it by its docstring.
+    """
+    description, num_saved_calls = None, 0
+    if docstring_min_words > 0:
+        description, definition = docstring_fast_path(
+            function_name, definition, docstring_min_words
         )
-        entity.loc[idx, "definition_embedding"] = str(definition_emb)
 
+    if description is None:
         logger.debug(f"extracting {function_name} description")
         # extracting description for current row of entity
         description_extraction_prompt = description_extraction_prompt_template.format(
             definition=definition
         )
-
         llm_response = get_together_chat_response(
             prompt=description_extraction_prompt,
             together_llm_client=together_llm_client,
             together_llm_model_name=together_llm_model_name,
         )
         description = json.loads(llm_response)["description"]
-        entity.loc[idx, "description"] = description
+    else:
+        num_saved_calls = 1
+
+    keywords = extract_keywords(
+        function_name=function_name,
+        description=description,
+        code=definition,
+        keyword_extraction_prompt_template=keyword_extraction_prompt_template,
+        together_llm_client=together_llm_client,
+        together_llm_model_name=together_llm_model_name,
+    )
+    return description, keywords, num_saved_calls
+
+
+def get_json_chat_response(
+    prompt: str,
+    keys: List[str],
+    together_llm_client: Union[Together],
+    together_llm_model_name: str,
+    repair_prompt_template: str = prompts.json_repair,
+) -> Dict:
+    """
+    Request a JSON object with `keys`, asking the model once to repair its
+    reply if it can't be parsed. Unusable replies are dropped from the
+    response cache so a later run requests them again.
+    """
+    llm_response = get_together_chat_response(
+        prompt=prompt,
+        together_llm_client=together_llm_client,
+        together_llm_model_name=together_llm_model_name,
+    )
+    try:
+        return extract_json_object(llm_response, keys)
+    except LLMResponseError:
+        discard_together_chat_response(prompt, together_llm_model_name)
+
+    logger.debug("repairing an unparsable LLM response")
+    repair_prompt = repair_prompt_template.format(
+        keys=", ".join(f'"{key}"' for key in keys), response=llm_response
+    )
+    repaired_response = get_together_chat_response(
+        prompt=repair_prompt,
+        together_llm_client=together_llm_client,
+        together_llm_model_name=together_llm_model_name,
+    )
+    try:
+        return extract_json_object(repaired_response, keys)
+    except LLMResponseError:
+        discard_together_chat_response(repair_prompt, together_llm_model_name)
+        raise
+
+
+def describe_function_single_call(
+    function_name: str,
+    definition: str,
+    description_and_keyword_extraction_prompt_template: str,
+    keyword_extraction_prompt_template: str,
+    together_llm_client: Union[Together],
+    together_llm_model_name: str,
+    docstring_min_words: int = 0,
+) -> Tuple[str, List[str], int]:
+    """
+    Describe a function with one LLM request for its description and
+    keywords. A function described by its docstring still takes a request
+    for its keywords, so no request is saved.
+    """
+    if docstring_min_words > 0:
+        description, definition = docstring_fast_path(
+            function_name, definition, docstring_min_words
+        )
+        if description is not None:
+            # only the keywords are left to extract
+            keywords = extract_keywords(
+                function_name=function_name,
+                description=description,
+                code=definition,
+                keyword_extraction_prompt_template=keyword_extraction_prompt_template,
+                together_llm_client=together_llm_client,
+                together_llm_model_name=together_llm_model_name,
+            )
+            return description, keywords, 0
+
+    logger.debug(f"extracting {function_name} description and keywords")
+    # extracting description and keywords of the current row in one request
+    response = get_json_chat_response(
+        prompt=description_and_keyword_extraction_prompt_template.format(
+            definition=definition
+        ),
+        keys=["description", "description_keywords"],
+        together_llm_client=together_llm_client,
+        together_llm_model_name=together_llm_model_name,
+    )
+    description, keywords = response["description"], response["description_keywords"]
+    if isinstance(keywords, str):
+        keywords = [keywords]
+    return str(description), [str(keyword) for keyword in keywords], 0
+
 
-        logger.debug(f"embedding {function_name} description")
-        # embedding description
-        description_emb = get_together_embedding(
-            text=description,
+def _describe_kwargs(
+    description_extraction_prompt_template: str,
+    keyword_extraction_prompt_template: str,
+    description_and_keyword_extraction_prompt_template: Optional[str],
+    together_llm_client: Union[Together],
+    together_llm_model_name: str,
+    docstring_min_words: int,
+) -> Tuple[Callable, Dict]:
+    kwargs = dict(
+        keyword_extraction_prompt_template=keyword_extraction_prompt_template,
+        together_llm_client=together_llm_client,
+        together_llm_model_name=together_llm_model_name,
+        docstring_min_words=docstring_min_words,
+    )
+    # the single call mode is used whenever its prompt is given
+    if description_and_keyword_extraction_prompt_template is not None:
+        return describe_function_single_call, dict(
+            description_and_keyword_extraction_prompt_template=(
+                description_and_keyword_extraction_prompt_template
+            ),
+            **kwargs,
+        )
+    return describe_function, dict(
+        description_extraction_prompt_template=description_extraction_prompt_template,
+        **kwargs,
+    )
+
+
+def _keywords_to_embed(
+    keywords: List[List[str]], keyword_vocabulary: Optional[KeywordVocabulary]
+) -> List[str]:
+    # every keyword once, leaving out those the vocabulary already embedded
+    unique_keywords = dict.fromkeys(keyword for row in keywords for keyword in row)
+    if keyword_vocabulary is not None:
+        return [
+            keyword for keyword in unique_keywords if keyword not in keyword_vocabulary
+        ]
+    return list(unique_keywords)
+
+
+def _group_keyword_embeddings(
+    keywords: List[List[str]],
+    embedded_keywords: List[str],
+    keyword_embs: List[List[float]],
+    keyword_vocabulary: Optional[KeywordVocabulary],
+) -> List[List[List[float]]]:
+    # the keyword embeddings of every entity row, the keywords that weren't
+    # embedded coming from the vocabulary
+    embeddings = dict(zip(embedded_keywords, keyword_embs))
+    for row in keywords:
+        for keyword in row:
+            if keyword not in embeddings:
+                embeddings[keyword] = keyword_vocabulary.vector(keyword).tolist()
+    return [[embeddings[keyword] for keyword in row] for row in keywords]
+
+
+def _count_saved_calls(
+    described: List[Tuple[str, List[str], int]], stats: Optional[Dict[str, int]]
+) -> None:
+    if stats is not None:
+        stats["llm_calls_saved"] = stats.get("llm_calls_saved", 0) + sum(
+            num_saved_calls for _, _, num_saved_calls in described
+        )
+
+
+def _make_records(
+    function_name_embs: List[List[float]],
+    definition_embs: List[List[float]],
+    descriptions: List[str],
+    description_embs: List[List[float]],
+    keywords: List[List[str]],
+    keyword_embs: List[List[List[float]]],
+) -> List[Dict]:
+    return [
+        {
+            "function_name_embedding": function_name_emb,
+            "definition_embedding": definition_emb,
+            "description": description,
+            "description_embedding": description_emb,
+            "keywords": row_keywords,
+            "keyword_embeddings": row_keyword_embs,
+        }
+        for (
+            function_name_emb,
+            definition_emb,
+            description,
+            description_emb,
+            row_keywords,
+            row_keyword_embs,
+        ) in zip(
+            function_name_embs,
+            definition_embs,
+            descriptions,
+            description_embs,
+            keywords,
+            keyword_embs,
+        )
+    ]
+
+
+def _order_columns(entity: pd.DataFrame, with_embeddings: bool = True) -> pd.DataFrame:
+    num_keywords = 0
+    while f"keyword_{num_keywords}" in entity.columns:
+        num_keywords += 1
+
+    # reordering columns of entity
+    keywords_columns = [f"keyword_{i}" for i in range(num_keywords)]
+    columns = ["id", "function_name", "namespace", "definition", "description"]
+    # split entities keep their keywords in one list column
+    if "keywords" in entity.columns:
+        columns.append("keywords")
+    columns += keywords_columns
+    if with_embeddings:
+        columns += [
+            "definition_embedding",
+            "function_name_embedding",
+            "description_embedding",
+        ]
+        columns += [f"keyword_{i}_embedding" for i in range(num_keywords)]
+    return entity[columns]
+
+
+def _assemble_entity(entity: pd.DataFrame, records: List[Dict]) -> pd.DataFrame:
+    entity = entity.copy()
+
+    def column(values: List) -> pd.Series:
+        return pd.Series(values, index=entity.index, dtype=object)
+
+    entity["function_name_embedding"] = column(
+        [record["function_name_embedding"] for record in records]
+    )
+    entity["definition_embedding"] = column(
+        [record["definition_embedding"] for record in records]
+    )
+    entity["description"] = column([record["description"] for record in records])
+    entity["description_embedding"] = column(
+        [record["description_embedding"] for record in records]
+    )
+
+    num_keywords = max((len(record["keywords"]) for record in records), default=0)
+    for keyword_idx in range(num_keywords):
+        entity[f"keyword_{keyword_idx}"] = column(
+            [
+                (
+                    record["keywords"][keyword_idx]
+                    if keyword_idx < len(record["keywords"])
+                    else np.nan
+                )
+                for record in records
+            ]
+        )
+        entity[f"keyword_{keyword_idx}_embedding"] = column(
+            [
+                (
+                    record["keyword_embeddings"][keyword_idx]
+                    if keyword_idx < len(record["keywords"])
+                    else np.nan
+                )
+                for record in records
+            ]
+        )
+    return _order_columns(entity)
+
+
+def index(
+    entity: pd.DataFrame,
+    description_extraction_prompt_template: str,
+    keyword_extraction_prompt_template: str,
+    together_llm_client: Union[Together],
+    together_llm_model_name: str,
+    together_embedding_client: Union[OpenAI],
+    together_embedding_model_name: str,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    description_and_keyword_extraction_prompt_template: Optional[str] = None,
+    docstring_min_words: int = 0,
+    keyword_vocabulary: Optional[KeywordVocabulary] = None,
+    stats: Optional[Dict[str, int]] = None,
+) -> pd.DataFrame:
+    """
+    Index the entity rows. Every distinct keyword is embedded once, and not
+    at all if `keyword_vocabulary` already holds it.
+
+    The number of LLM requests saved by docstrings is added to the
+    `llm_calls_saved` entry of `stats`.
+    """
+    describe, describe_kwargs = _describe_kwargs(
+        description_extraction_prompt_template,
+        keyword_extraction_prompt_template,
+        description_and_keyword_extraction_prompt_template,
+        together_llm_client,
+        together_llm_model_name,
+        docstring_min_words,
+    )
+
+    def embed(texts: List[str]) -> List[List[float]]:
+        return get_together_embeddings(
+            texts=texts,
             together_embedding_client=together_embedding_client,
             together_model_name=together_embedding_model_name,
             normalize_embedding=True,
+            batch_size=batch_size,
         )
-        entity.loc[idx, "description_embedding"] = str(description_emb)
 
-        logger.debug(f"generating {function_name} keywords")
-        # extracting keywords for the current row of entity
-        keyword_extraction_prompt = keyword_extraction_prompt_template.format(
-            description=description, code=definition
+    function_names = entity["function_name"].tolist()
+    definitions = entity["definition"].tolist()
+
+    logger.debug(f"embedding {len(function_names)} function names and definitions")
+    # embedding function_name and definition
+    function_name_embs = embed(function_names)
+    definition_embs = embed(definitions)
+
+    # extracting description and keywords of entity rows
+    described = [
+        describe(function_name=function_name, definition=definition, **describe_kwargs)
+        for function_name, definition in zip(function_names, definitions)
+    ]
+    descriptions = [description for description, _, _ in described]
+    keywords = [row_keywords for _, row_keywords, _ in described]
+    _count_saved_calls(described, stats)
+
+    logger.debug(f"embedding {len(descriptions)} descriptions and keywords")
+    # embedding description and keywords
+    description_embs = embed(descriptions)
+    embedded_keywords = _keywords_to_embed(keywords, keyword_vocabulary)
+    keyword_embs = embed(embedded_keywords)
+
+    records = _make_records(
+        function_name_embs,
+        definition_embs,
+        descriptions,
+        description_embs,
+        keywords,
+        _group_keyword_embeddings(
+            keywords, embedded_keywords, keyword_embs, keyword_vocabulary
+        ),
+    )
+    return _assemble_entity(entity, records)
+
+
+async def index_async(
+    entity: pd.DataFrame,
+    description_extraction_prompt_template: str,
+    keyword_extraction_prompt_template: str,
+    together_llm_client: Union[Together],
+    together_llm_model_name: str,
+    together_embedding_client: Union[OpenAI],
+    together_embedding_model_name: str,
+    concurrency: int = 8,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    description_and_keyword_extraction_prompt_template: Optional[str] = None,
+    docstring_min_words: int = 0,
+    keyword_vocabulary: Optional[KeywordVocabulary] = None,
+    stats: Optional[Dict[str, int]] = None,
+) -> pd.DataFrame:
+    """
+    Index the entity rows concurrently, keeping at most `concurrency` API
+    requests in flight. The name and definition embeddings run alongside the
+    description requests, and the result is identical to `index`.
+    """
+    describe, describe_kwargs = _describe_kwargs(
+        description_extraction_prompt_template,
+        keyword_extraction_prompt_template,
+        description_and_keyword_extraction_prompt_template,
+        together_llm_client,
+        together_llm_model_name,
+        docstring_min_words,
+    )
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        async def call(func: Callable, **kwargs):
+            async with semaphore:
+                return await loop.run_in_executor(
+                    executor, functools.partial(func, **kwargs)
+                )
+
+        async def embed(texts: List[str]) -> List[List[float]]:
+            # one request per batch so the batches themselves run concurrently
+            batches = await asyncio.gather(
+                *(
+                    call(
+                        get_together_embeddings,
+                        texts=texts[start : start + batch_size],
+                        together_embedding_client=together_embedding_client,
+                        together_model_name=together_embedding_model_name,
+                        normalize_embedding=True,
+                        batch_size=batch_size,
+                    )
+                    for start in range(0, len(texts), batch_size)
+                )
+            )
+            return [emb for batch in batches for emb in batch]
+
+        function_names = entity["function_name"].tolist()
+        definitions = entity["definition"].tolist()
+
+        logger.debug(f"embedding {len(function_names)} function names and definitions")
+        # embedding function_name and definition in the background
+        function_name_task = asyncio.ensure_future(embed(function_names))
+        definition_task = asyncio.ensure_future(embed(definitions))
+
+        # extracting description and keywords of entity rows
+        described = await asyncio.gather(
+            *(
+                call(
+                    describe,
+                    function_name=function_name,
+                    definition=definition,
+                    **describe_kwargs,
+                )
+                for function_name, definition in zip(function_names, definitions)
+            )
         )
-        llm_response = get_together_chat_response(
-            prompt=keyword_extraction_prompt,
-            together_llm_client=together_llm_client,
-            together_llm_model_name=together_llm_model_name,
+        descriptions = [description for description, _, _ in described]
+        keywords = [row_keywords for _, row_keywords, _ in described]
+        _count_saved_calls(described, stats)
+
+        logger.debug(f"embedding {len(descriptions)} descriptions and keywords")
+        # embedding description and keywords
+        embedded_keywords = _keywords_to_embed(keywords, keyword_vocabulary)
+        description_embs, keyword_embs = await asyncio.gather(
+            embed(descriptions), embed(embedded_keywords)
+        )
+        function_name_embs = await function_name_task
+        definition_embs = await definition_task
+
+    records = _make_records(
+        function_name_embs,
+        definition_embs,
+        descriptions,
+        description_embs,
+        keywords,
+        _group_keyword_embeddings(
+            keywords, embedded_keywords, keyword_embs, keyword_vocabulary
+        ),
+    )
+    return _assemble_entity(entity, records)
+
+
+def build_project_call_graph(
+    project_path: str,
+    file_paths: List[str],
+    locations: List,
+    call_symbols: Optional[SymbolTable] = None,
+) -> Tuple[CallGraph, Dict[int, Tuple[str, str]]]:
+    """
+    Build the call graph of the project files with one row per indexed
+    function, `locations` holding the (path, line) of each of them, and
+    return it with the (arguments, returns) signature of every row found.
+    Files whose symbols were collected while compiling aren't parsed again,
+    and files without functions still bind names other files import.
+    """
+    symbols, graph = build_call_graph(file_paths, project_path, call_symbols)
+    rows = {location: row for row, location in enumerate(locations)}
+    symbol_rows = np.array(
+        [rows.get((symbol.path, symbol.lineno), -1) for symbol in symbols],
+        dtype=np.int64,
+    )
+    signatures = {
+        row: (symbol.arguments, symbol.returns)
+        for row, symbol in zip(symbol_rows.tolist(), symbols)
+        if row >= 0
+    }
+    graph = graph.remap(symbol_rows, len(locations))
+    logger.info(f"resolved {graph.num_edges} calls between {len(locations)} functions")
+    return graph, signatures
+
+
+def _empty_rows() -> Dict[str, List]:
+    return {"id": [], "function_name": [], "namespace": [], "definition": []}
+
+
+def _put_until_stopped(items: queue.Queue, stop: threading.Event, item) -> bool:
+    # waiting for room in the queue for as long as the consumer runs
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce(iterable: Iterable, items: queue.Queue, stop: threading.Event) -> None:
+    # items are queued as (True, item), the end as (False, None) or (False, error)
+    try:
+        for item in iterable:
+            if not _put_until_stopped(items, stop, (True, item)):
+                return
+        _put_until_stopped(items, stop, (False, None))
+    except BaseException as e:
+        _put_until_stopped(items, stop, (False, e))
+
+
+def _prefetch(iterable: Iterable, maxsize: int) -> Iterator:
+    """
+    Run an iterator in a background thread, handing its items over through a
+    queue of at most `maxsize` items so the producer never runs far ahead.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=_produce, args=(iterable, items, stop), daemon=True
+    )
+    thread.start()
+    try:
+        while True:
+            has_item, item = items.get()
+            if not has_item:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+@dataclass
+class _PreviousIndex:
+    """
+    The index of the previous run, which is only reusable together with its
+    manifest.
+    """
+
+    manifest: Dict
+    metadata: Optional[pd.DataFrame] = None
+    embeddings: Optional[RaggedEmbeddings] = None
+    positions: Dict[str, int] = field(default_factory=dict)
+    keyword_vocabulary: Optional[KeywordVocabulary] = None
+
+
+def _load_previous_index(directory_path: str, manifest_path: str) -> _PreviousIndex:
+    manifest = load_manifest(manifest_path)
+    if not manifest["files"] or not has_index(directory_path):
+        return _PreviousIndex(manifest=empty_manifest())
+
+    metadata, embeddings = load_index(directory_path)
+    return _PreviousIndex(
+        manifest=manifest,
+        metadata=metadata,
+        embeddings=embeddings,
+        positions={
+            entity_id: position for position, entity_id in enumerate(metadata["id"])
+        },
+        # keywords of new functions that are already in the index aren't embedded
+        keyword_vocabulary=load_keyword_vocabulary(directory_path, embeddings),
+    )
+
+
+class _ManifestMatcher:
+    """
+    Matches the functions of a project against the manifest of the previous
+    run, building the manifest of this one.
+    """
+
+    def __init__(self, project_path: str, previous_manifest: Dict) -> None:
+        self.project_path = project_path
+        self.previous_manifest = previous_manifest
+        self.manifest = empty_manifest()
+        self.occurrences = Counter()
+
+    def match(self, item: Function) -> Tuple[str, str, Optional[Dict]]:
+        """
+        Return the id and definition hash of a function, with its entry in
+        the previous manifest if it has one.
+        """
+        file_key = os.path.relpath(item.path, self.project_path) if item.path else ""
+        previous_file = self.previous_manifest["files"].get(file_key, {})
+        if file_key not in self.manifest["files"]:
+            fingerprint = {}
+            if item.path:
+                fingerprint = file_fingerprint(item.path, previous=previous_file)
+            self.manifest["files"][file_key] = {**fingerprint, "functions": {}}
+
+        # functions are keyed by name and occurrence within their file
+        function_key = f"{item.name}#{self.occurrences[(file_key, item.name)]}"
+        self.occurrences[(file_key, item.name)] += 1
+        definition_hash = hash_text(item.definition)
+        previous_function = previous_file.get("functions", {}).get(function_key)
+
+        if previous_function is not None:
+            entity_id = previous_function["id"]
+        else:
+            entity_id = str(uuid.uuid4())
+        self.manifest["files"][file_key]["functions"][function_key] = {
+            "id": entity_id,
+            "hash": definition_hash,
+        }
+        return entity_id, definition_hash, previous_function
+
+
+def _enrich_batch(
+    entity: pd.DataFrame, checkpoint: Checkpoint, concurrency: int, index_kwargs: Dict
+) -> Tuple[pd.DataFrame, RaggedEmbeddings, int]:
+    stats = {"llm_calls_saved": 0}
+    if concurrency > 1:
+        entity = asyncio.run(
+            index_async(
+                entity=entity, **index_kwargs, concurrency=concurrency, stats=stats
+            )
         )
-        keywords = json.loads(llm_response)
-        keywords = keywords["description_keywords"]
-
-        logger.debug(f"embedding {function_name} keywords")
-        # embedding keywords
-        keywords_columns = []
-        keywords_embedding_columns = []
-        for keyword_idx, keyword in enumerate(keywords):
-            keyword_emb = get_together_embedding(
-                text=keyword,
-                together_embedding_client=together_embedding_client,
-                together_model_name=together_embedding_model_name,
-                normalize_embedding=True,
+    else:
+        entity = index(entity=entity, **index_kwargs, stats=stats)
+    metadata, embeddings = split_entity(entity)
+    checkpoint.save(metadata, embeddings)
+    return metadata, embeddings, stats["llm_calls_saved"]
+
+
+class _IndexPipeline:
+    """
+    Enriches new functions in batches on a background thread and appends
+    every row to the index writer in project order, as soon as the rows
+    before it are available.
+
+    New functions are sent for enrichment right away while no batch is being
+    enriched, and otherwise once `batch_size` of them are waiting, with at
+    most `PIPELINE_DEPTH` batches queued. `num_saved_calls` counts the LLM
+    requests saved by docstrings in the batches written.
+    """
+
+    def __init__(
+        self,
+        writer: IndexWriter,
+        checkpoint: Checkpoint,
+        previous: _PreviousIndex,
+        enrich: Callable[[pd.DataFrame], Tuple[pd.DataFrame, RaggedEmbeddings, int]],
+        batch_size: int,
+    ) -> None:
+        self.writer = writer
+        self.checkpoint = checkpoint
+        self.previous = previous
+        self.enrich = enrich
+        self.batch_size = batch_size
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # rows in project order, as (batch number, row), (REUSED, previous
+        # position) or ((CHECKPOINTED, part), (row, entity id))
+        self.pending = deque()
+        self.batches: Dict[int, Future] = {}
+        self.remaining = Counter()
+        self.num_batches = 0
+        self.num_saved_calls = 0
+        self.new_rows = _empty_rows()
+
+    def add_reused(self, position: int) -> None:
+        self.pending.append((REUSED, position))
+        if len(self.pending) >= WRITE_RUN_SIZE:
+            # a partial batch would hold up every reused row behind it
+            if self.new_rows["id"]:
+                self.submit()
+            self.write_ready()
+            if len(self.pending) >= WRITE_RUN_SIZE:
+                self.wait_for_batches(0)
+
+    def add_checkpointed(self, part: int, row: int, entity_id: str) -> None:
+        # enriched by an earlier run that didn't finish
+        self.pending.append(((CHECKPOINTED, part), (row, entity_id)))
+
+    def add_new(self, entity_id: str, item: Function) -> None:
+        self.pending.append((self.num_batches, len(self.new_rows["id"])))
+        self.new_rows["id"].append(entity_id)
+        self.new_rows["function_name"].append(item.name)
+        self.new_rows["namespace"].append("project.default")
+        self.new_rows["definition"].append(item.definition)
+        if len(self.new_rows["id"]) >= self.batch_size or self._idle():
+            self.submit()
+            self.write_ready()
+            self.wait_for_batches(PIPELINE_DEPTH)
+
+    def _idle(self) -> bool:
+        return all(batch.done() for batch in self.batches.values())
+
+    def submit(self) -> None:
+        self.batches[self.num_batches] = self.executor.submit(
+            self.enrich, pd.DataFrame(self.new_rows)
+        )
+        self.remaining[self.num_batches] = len(self.new_rows["id"])
+        self.num_batches += 1
+        self.new_rows = _empty_rows()
+
+    def _append(self, source, rows: List) -> None:
+        # appending a run of rows that come from the same place
+        if source == REUSED:
+            self.writer.append(
+                self.previous.metadata.iloc[rows], self.previous.embeddings[rows]
             )
+        elif isinstance(source, tuple):
+            metadata, embeddings = self.checkpoint.part(source[1])
+            positions = [row for row, _ in rows]
+            metadata = metadata.iloc[positions].assign(
+                id=[entity_id for _, entity_id in rows]
+            )
+            self.writer.append(metadata, embeddings[positions])
+        else:
+            metadata, embeddings, num_saved_calls = self.batches[source].result()
+            self.writer.append(metadata.iloc[rows], embeddings[rows])
+            self.remaining[source] -= len(rows)
+            if self.remaining[source] == 0:
+                self.num_saved_calls += num_saved_calls
+                del self.batches[source], self.remaining[source]
 
-            entity.loc[idx, f"keyword_{keyword_idx}"] = keyword
-            entity.loc[idx, f"keyword_{keyword_idx}_embedding"] = str(keyword_emb)
-            keywords_columns.append(f"keyword_{keyword_idx}")
-            keywords_embedding_columns.append(f"keyword_{keyword_idx}_embedding")
-
-        # reordering columns of entity
-        entity = entity[
-            ["id", "function_name", "namespace", "definition", "description"]
-            + keywords_columns
-            + [
-                "definition_embedding",
-                "function_name_embedding",
-                "description_embedding",
-            ]
-            + keywords_embedding_columns
-        ]
-    return entity
+    def _ready(self, source) -> bool:
+        if source == REUSED or isinstance(source, tuple):
+            return True
+        return source in self.batches and self.batches[source].done()
 
+    def write_ready(self) -> None:
+        # appending the leading rows whose data is available, in runs
+        run_source, run_rows = None, []
+        while self.pending and self._ready(self.pending[0][0]):
+            source, row = self.pending.popleft()
+            if source != run_source:
+                if run_rows:
+                    self._append(run_source, run_rows)
+                run_source, run_rows = source, []
+            run_rows.append(row)
+        if run_rows:
+            self._append(run_source, run_rows)
 
-def index_project(
-    compiler_iter: Iterator[Function], project_path: str, clients: dict
+    def wait_for_batches(self, max_batches: int) -> None:
+        # the oldest batch holds up writing, waiting for it frees its slot
+        while len(self.batches) > max_batches:
+            self.batches[min(self.batches)].result()
+            self.write_ready()
+
+    def finish(self) -> Tuple[pd.DataFrame, RaggedEmbeddings]:
+        if self.new_rows["id"]:
+            self.submit()
+        self.wait_for_batches(0)
+        self.write_ready()
+        return self.writer.finalize()
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _stage_search_indexes(
+    writer: IndexWriter,
+    metadata: pd.DataFrame,
+    embeddings: RaggedEmbeddings,
+    graph: CallGraph,
+    signatures: Dict[int, Tuple[str, str]],
+    ann_lists: int,
 ) -> None:
-    together_llm_client = clients["llm"]["client"]
-    together_embedding_client = clients["embedding"]["client"]
-    together_llm_model_name = clients["llm"]["model"]
-    together_embedding_model_name = clients["embedding"]["model"]
-
-    # reading prompt templates
-    keyword_extraction_prompt_template = prompts.keyword_extraction
-    description_extraction_prompt_template = prompts.description_extraction
-
-    # reading raw data and creating dataframes
-    entity_dict = {
-        "id": [],
-        "function_name": [],
-        "namespace": [],
-        "definition": [],
-    }
-    for item in compiler_iter:
-        logger.debug(f"reading {item.name}")
-        entity_dict["id"].append(uuid.uuid4())
-        entity_dict["function_name"].append(item.name)
-        entity_dict["namespace"].append("project.default")
-        entity_dict["definition"].append(item.definition)
-    entity = pd.DataFrame.from_dict(data=entity_dict)
-
-    # indexing the entity and relationship dataframes
-    entity = index(
-        entity=entity,
-        description_extraction_prompt_template=description_extraction_prompt_template,
-        keyword_extraction_prompt_template=keyword_extraction_prompt_template,
-        together_llm_client=together_llm_client,
-        together_llm_model_name=together_llm_model_name,
-        together_embedding_client=together_embedding_client,
-        together_embedding_model_name=together_embedding_model_name,
+    # the indexes built from the rows are staged and swapped in with the
+    # index, so the index is never paired with indexes of other rows
+    save_bm25_index(
+        writer.staged_path(BM25_FILE), build_bm25_index(tokenize_entity(metadata))
     )
+    save_call_graph(writer.staged_path(CALL_GRAPH_FILE), graph)
+    save_relationship_frame(
+        writer.staged_path(RELATIONSHIP_FILE),
+        relationship_frame(metadata, graph, signatures),
+    )
+    if ann_lists > 0 and len(embeddings):
+        logger.info(f"building ANN index with {ann_lists} lists")
+        save_ivf_index(
+            writer.staged_path(ANN_FILE), build_ivf_index(embeddings, n_lists=ann_lists)
+        )
+    else:
+        # the current index is still valid without its ANN index
+        ann_path = os.path.join(writer.directory, ANN_FILE)
+        if os.path.isfile(ann_path):
+            os.remove(ann_path)
+
+
+def _checkpoint_settings(index_kwargs: Dict) -> Dict[str, str]:
+    # the settings the enriched rows depend on, prompts by their hash
+    settings = {}
+    for name, value in index_kwargs.items():
+        if name.endswith("_prompt_template"):
+            settings[name] = "" if value is None else hash_text(value)
+        elif name.endswith("_model_name") or name == "docstring_min_words":
+            settings[name] = str(value)
+    return settings
+
 
+def index_project(
+    compiler_iter: Iterator[Function],
+    project_path: str,
+    clients: dict,
+    concurrency: int = 1,
+    ann_lists: int = 0,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    resume: bool = False,
+    single_call: bool = False,
+    docstring_min_words: int = 0,
+    call_symbols: Optional[SymbolTable] = None,
+) -> Dict[str, int]:
+    """
+    Index the functions of a project, reusing the rows of functions that
+    didn't change since the previous run.
+
+    Compilation, enrichment and writing run as a pipeline: functions are
+    compiled in a background thread into a bounded queue, new functions are
+    enriched in batches by `_IndexPipeline`, starting with the first one
+    found, and finished rows are appended to the index in project order.
+
+    Every enriched batch is checkpointed, and with `resume` the functions
+    checkpointed by an earlier run that didn't finish are not enriched again.
+
+    With `single_call` the description and keywords of a function come from
+    one LLM request instead of two. With `docstring_min_words` functions
+    whose docstring summary has at least that many words are described by
+    their docstring without asking the LLM, and the docstrings of the others
+    are left out of the prompts.
+
+    The call graph is stored both as a CSR file and as a relationship table
+    of the calls between index ids. `call_symbols` is the symbol table the
+    compiler collected while compiling, see `iterate_over_functions_project`.
+    """
     # Create the directory (and any necessary parent directories)
     directory_path = os.path.join(project_path, ".lattice")
     os.makedirs(directory_path, exist_ok=True)
+    manifest_path = os.path.join(directory_path, "manifest.json")
+    previous = _load_previous_index(directory_path, manifest_path)
 
-    # saving processed dataframes
-    entity.to_csv(os.path.join(directory_path, "entity.csv"), index=False)
+    index_kwargs = dict(
+        description_extraction_prompt_template=prompts.description_extraction,
+        keyword_extraction_prompt_template=prompts.keyword_extraction,
+        together_llm_client=clients["llm"]["client"],
+        together_llm_model_name=clients["llm"]["model"],
+        together_embedding_client=clients["embedding"]["client"],
+        together_embedding_model_name=clients["embedding"]["model"],
+        description_and_keyword_extraction_prompt_template=(
+            prompts.description_and_keyword_extraction if single_call else None
+        ),
+        docstring_min_words=docstring_min_words,
+        keyword_vocabulary=previous.keyword_vocabulary,
+    )
+    checkpoint = Checkpoint(
+        directory_path, resume=resume, settings=_checkpoint_settings(index_kwargs)
+    )
+    writer = IndexWriter(
+        directory_path, columns=[*_empty_rows(), "description", "keywords"]
+    )
+    pipeline = _IndexPipeline(
+        writer,
+        checkpoint,
+        previous,
+        functools.partial(
+            _enrich_batch,
+            checkpoint=checkpoint,
+            concurrency=concurrency,
+            index_kwargs=index_kwargs,
+        ),
+        batch_size,
+    )
+
+    # reading raw data and matching it against the manifest
+    matcher = _ManifestMatcher(project_path, previous.manifest)
+    entity_ids, reused_ids, resumed_ids = [], [], []
+    # where each function is defined, for matching them against the call graph
+    locations, file_paths = [], {}
+    try:
+        for item in _prefetch(compiler_iter, maxsize=batch_size * PIPELINE_DEPTH):
+            logger.debug(f"reading {item.name}")
+            entity_id, definition_hash, previous_function = matcher.match(item)
+            entity_ids.append(entity_id)
+            locations.append((item.path, item.lineno) if item.path else None)
+            if item.path:
+                file_paths.setdefault(item.path, None)
+
+            if (
+                previous_function is not None
+                and previous_function["hash"] == definition_hash
+                and entity_id in previous.positions
+            ):
+                reused_ids.append(entity_id)
+                pipeline.add_reused(previous.positions[entity_id])
+                continue
+
+            checkpointed = checkpoint.lookup(definition_hash)
+            if checkpointed is not None:
+                resumed_ids.append(entity_id)
+                pipeline.add_checkpointed(*checkpointed, entity_id)
+                continue
+
+            pipeline.add_new(entity_id, item)
+        metadata, embeddings = pipeline.finish()
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        pipeline.close()
+
+    num_indexed = len(entity_ids) - len(reused_ids) - len(resumed_ids)
+    num_removed = len(set(previous.positions) - set(entity_ids))
+    logger.info(
+        f"indexed {num_indexed} functions, reused {len(reused_ids)}, "
+        f"resumed {len(resumed_ids)}, removed {num_removed}"
+    )
+    metadata = _order_columns(metadata, with_embeddings=False)
+
+    # saving processed data
+    try:
+        graph, signatures = build_project_call_graph(
+            project_path, list(file_paths), locations, call_symbols
+        )
+        _stage_search_indexes(
+            writer, metadata, embeddings, graph, signatures, ann_lists
+        )
+        del embeddings
+        writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+    save_manifest(manifest_path, matcher.manifest)
+    checkpoint.clear()
+
+    return {
+        "indexed": num_indexed,
+        "reused": len(reused_ids),
+        "resumed": len(resumed_ids),
+        "removed": num_removed,
+        "llm_calls_saved": pipeline.num_saved_calls,
+    }
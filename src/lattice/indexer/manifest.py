@@ -0,0 +1,59 @@
+import os
+import json
+import hashlib
+from typing import Dict, Optional
+
+MANIFEST_VERSION = 1
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def hash_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_fingerprint(file_path: str, previous: Optional[Dict] = None) -> Dict:
+    """
+    Fingerprint a file by its modification time, size and content hash.
+
+    The content hash of `previous` is reused without reading the file when
+    its modification time and size haven't changed.
+    """
+    stat = os.stat(file_path)
+    if (
+        previous is not None
+        and previous.get("mtime") == stat.st_mtime_ns
+        and previous.get("size") == stat.st_size
+    ):
+        content_hash = previous["hash"]
+    else:
+        content_hash = hash_file(file_path)
+    return {"mtime": stat.st_mtime_ns, "size": stat.st_size, "hash": content_hash}
+
+
+def empty_manifest() -> Dict:
+    return {"version": MANIFEST_VERSION, "files": {}}
+
+
+def load_manifest(manifest_path: str) -> Dict:
+    if not os.path.isfile(manifest_path):
+        return empty_manifest()
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return empty_manifest()
+    return manifest
+
+
+def save_manifest(manifest_path: str, manifest: Dict) -> None:
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, manifest_path)
@@ -0,0 +1,113 @@
+import os
+import json
+import hashlib
+import threading
+from collections import Counter
+from typing import Any, Dict, Optional
+
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of LLM and embedding responses.
+
+    Every response is stored in its own file named after the hash of the
+    request kind, model name and prompt (or text). Reading an entry refreshes
+    its modification time, and once the cache grows past `max_size` bytes the
+    least recently used entries are evicted.
+    """
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_CACHE_SIZE) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(os.path.getsize(path) for path in self._entries())
+
+    @staticmethod
+    def make_key(kind: str, model_name: str, text: str) -> str:
+        return hashlib.sha256(f"{kind}\0{model_name}\0{text}".encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for file in files:
+                if file.endswith(".json"):
+                    yield os.path.join(root, file)
+
+    def get(self, kind: str, model_name: str, text: str) -> Optional[Any]:
+        path = self._path(self.make_key(kind, model_name, text))
+        try:
+            with open(path) as f:
+                value = json.load(f)
+            # refreshing the entry for the LRU eviction
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            with self._lock:
+                self.misses[kind] += 1
+            return None
+
+        with self._lock:
+            self.hits[kind] += 1
+        return value
+
+    def set(self, kind: str, model_name: str, text: str, value: Any) -> None:
+        path = self._path(self.make_key(kind, model_name, text))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # writing to a temporary file first so readers never see partial entries
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(value, f)
+        size = os.path.getsize(tmp_path)
+        previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._size += size - previous_size
+            if self._size > self.max_size:
+                self._evict()
+
+    def delete(self, kind: str, model_name: str, text: str) -> None:
+        path = self._path(self.make_key(kind, model_name, text))
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._size -= size
+
+    def _evict(self) -> None:
+        # evicting down to 90% of the cap so eviction doesn't run on every write
+        target_size = int(self.max_size * 0.9)
+        entries = []
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self._size <= target_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {
+                kind: {"hits": self.hits[kind], "misses": self.misses[kind]}
+                for kind in sorted(set(self.hits) | set(self.misses))
+            }
@@ -0,0 +1,255 @@
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Deque, List, Optional
+
+import openai
+import together
+
+from ..logger import logger
+
+# seconds before a request is abandoned, set on the API clients
+REQUEST_TIMEOUT = 60.0
+MAX_RETRIES = 5
+# requests and tokens are budgeted over a sliding window of this many seconds
+BUDGET_WINDOW = 60.0
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+# status codes that mean the provider is overloaded rather than flaky
+THROTTLE_STATUS_CODES = {429, 503}
+CONNECTION_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    openai.APIConnectionError,
+    together.error.APIConnectionError,
+    together.error.Timeout,
+)
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    # openai errors carry `status_code`, together errors `http_status`
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(error, "http_status", None)
+    if status_code is None and isinstance(error, together.error.RateLimitError):
+        status_code = 429
+    if status_code is None and isinstance(
+        error, together.error.ServiceUnavailableError
+    ):
+        status_code = 503
+    return status_code
+
+
+def _headers(error: Exception) -> Optional[Any]:
+    headers = getattr(error, "headers", None)
+    if not headers:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers or not hasattr(headers, "get"):
+        return None
+    return headers
+
+
+def _parse_seconds(value: str) -> Optional[float]:
+    # a number of seconds or an HTTP date
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = _headers(error)
+    if headers is None:
+        return None
+
+    value = headers.get("retry-after-ms") or headers.get("Retry-After-Ms")
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if value is None:
+        return None
+    return _parse_seconds(value)
+
+
+def estimate_tokens(*texts: str) -> int:
+    # about four characters per token for English text and code
+    return sum(len(text) for text in texts) // 4 + 1
+
+
+class RequestGovernor:
+    """
+    Shared gate for API requests.
+
+    Every request waits for a concurrency slot and for the requests and
+    tokens per minute budgets, and failed requests are retried with jittered
+    exponential backoff, waiting at least as long as the provider's
+    `Retry-After` asks. The concurrency limit is tuned with AIMD: it grows by
+    one slot for every limit's worth of successful requests and halves when
+    the provider throttles, so it settles just below the real limit. Other
+    failures leave it as it is.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = MAX_RETRIES,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        initial_concurrency: int = 8,
+        min_concurrency: int = 1,
+        max_concurrency: int = 64,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        decrease_factor: float = 0.5,
+        sleep: Callable[[float], None] = time.sleep,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(
+            min(max(initial_concurrency, min_concurrency), max_concurrency)
+        )
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.decrease_factor = decrease_factor
+        self._sleep = sleep
+        self._clock = clock
+
+        self._condition = threading.Condition()
+        self.in_flight = 0
+        # [start time, tokens] of the requests within the budget window
+        self._window: Deque[List[float]] = deque()
+        self.retries = 0
+        self.throttled = 0
+
+    def _expire(self, now: float) -> None:
+        while self._window and self._window[0][0] <= now - BUDGET_WINDOW:
+            self._window.popleft()
+
+    def _budget_wait(self, tokens: int, now: float) -> float:
+        # seconds until the request fits both budgets, 0 if it fits now
+        self._expire(now)
+        wait = 0.0
+        if (
+            self.requests_per_minute
+            and len(self._window) >= self.requests_per_minute
+        ):
+            oldest = self._window[len(self._window) - self.requests_per_minute]
+            wait = max(wait, oldest[0] + BUDGET_WINDOW - now)
+        if self.tokens_per_minute:
+            used = sum(entry[1] for entry in self._window)
+            # a request bigger than the whole budget only waits for an empty window
+            excess = (
+                used + min(tokens, self.tokens_per_minute) - self.tokens_per_minute
+            )
+            for start, entry_tokens in self._window:
+                if excess <= 0:
+                    break
+                excess -= entry_tokens
+                wait = max(wait, start + BUDGET_WINDOW - now)
+        return wait
+
+    def _acquire(self, tokens: int) -> List[float]:
+        with self._condition:
+            while True:
+                if self.in_flight < int(self.concurrency):
+                    now = self._clock()
+                    wait = self._budget_wait(tokens, now)
+                    if wait <= 0:
+                        break
+                else:
+                    wait = None
+                # woken up by a released slot, or once the budget frees up
+                self._condition.wait(timeout=wait)
+            self.in_flight += 1
+            entry = [now, tokens]
+            self._window.append(entry)
+            return entry
+
+    def _release(self, error: Optional[Exception] = None) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            if error is None:
+                self.concurrency = min(
+                    self.concurrency + 1 / self.concurrency, self.max_concurrency
+                )
+            elif self.is_throttle(error):
+                self.throttled += 1
+                self.concurrency = max(
+                    self.concurrency * self.decrease_factor, self.min_concurrency
+                )
+                logger.debug(f"throttled, concurrency down to {self.concurrency:.1f}")
+            self._condition.notify_all()
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        # full jitter, but never sooner than the provider asked for
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    @staticmethod
+    def is_retryable(error: Exception) -> bool:
+        if isinstance(error, CONNECTION_ERRORS):
+            return True
+        return _status_code(error) in RETRYABLE_STATUS_CODES
+
+    @staticmethod
+    def is_throttle(error: Exception) -> bool:
+        if isinstance(
+            error, (TimeoutError, openai.APITimeoutError, together.error.Timeout)
+        ):
+            return True
+        return _status_code(error) in THROTTLE_STATUS_CODES
+
+    def call(self, func: Callable[..., Any], *args, tokens: int = 0, **kwargs) -> Any:
+        """
+        Run `func(*args, **kwargs)` within the limits, retrying transient
+        failures. `tokens` is the estimated size of the request, corrected
+        with the reported usage of the response if there is one.
+        """
+        attempt = 0
+        while True:
+            entry = self._acquire(tokens)
+            try:
+                response = func(*args, **kwargs)
+            except Exception as error:
+                self._release(error)
+                if attempt >= self.max_retries or not self.is_retryable(error):
+                    raise
+                delay = self._backoff(attempt, error)
+                logger.debug(
+                    f"retrying in {delay:.2f}s after {type(error).__name__}: {error}"
+                )
+                with self._condition:
+                    self.retries += 1
+                attempt += 1
+                self._sleep(delay)
+                continue
+
+            usage = getattr(response, "usage", None)
+            total_tokens = getattr(usage, "total_tokens", None)
+            if isinstance(total_tokens, int):
+                with self._condition:
+                    entry[1] = total_tokens
+            self._release()
+            return response
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "concurrency": int(self.concurrency),
+                "retries": self.retries,
+                "throttled": self.throttled,
+            }
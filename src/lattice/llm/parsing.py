@@ -0,0 +1,92 @@
+import ast
+import json
+import re
+from typing import Any, Dict, Iterable, Optional
+
+CODE_FENCE_PATTERN = re.compile(r"```(?:json|python)?\s*(.*?)```", re.DOTALL)
+TRAILING_COMMA_PATTERN = re.compile(r",\s*([}\]])")
+
+
+class LLMResponseError(ValueError):
+    """
+    An LLM reply that doesn't hold the expected JSON object.
+    """
+
+    def __init__(self, message: str, response: str) -> None:
+        super().__init__(message)
+        self.response = response
+
+
+def _string_end(text: str, start: int) -> int:
+    # the position after the string literal opened at `start`
+    quote, escaped = text[start], False
+    for position in range(start + 1, len(text)):
+        char = text[position]
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == quote:
+            return position + 1
+    return len(text)
+
+
+def _balanced_object(text: str) -> Optional[str]:
+    # the first {...} block, skipping braces inside strings
+    start = text.find("{")
+    if start == -1:
+        return None
+    depth, position = 0, start
+    while position < len(text):
+        char = text[position]
+        if char in "\"'":
+            position = _string_end(text, position)
+            continue
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start : position + 1]
+        position += 1
+    return None
+
+
+def _load_object(text: str) -> Optional[Any]:
+    for candidate in (text, TRAILING_COMMA_PATTERN.sub(r"\1", text)):
+        try:
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            pass
+        # the prompts ask for a Python dict, so single quotes are common
+        try:
+            return ast.literal_eval(candidate)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            pass
+    return None
+
+
+def extract_json_object(response: str, keys: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    Parse the JSON object of an LLM reply, tolerating code fences, text
+    around the object, single quotes and trailing commas. Raises
+    `LLMResponseError` if no object with all of `keys` is found.
+    """
+    keys = list(keys)
+    candidates = [response.strip()]
+    candidates += [block.strip() for block in CODE_FENCE_PATTERN.findall(response)]
+    candidates += [_balanced_object(response)]
+
+    missing = keys
+    for candidate in candidates:
+        if not candidate:
+            continue
+        value = _load_object(candidate)
+        if not isinstance(value, dict):
+            continue
+        missing = [key for key in keys if key not in value]
+        if not missing:
+            return value
+    raise LLMResponseError(
+        f"LLM response is not a JSON object with keys {missing}", response
+    )
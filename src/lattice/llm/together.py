@@ -1,9 +1,42 @@
-from typing import List
+from typing import Any, Callable, List, Optional
 
 import numpy as np
 from together import Together
 from openai import OpenAI
 
+from .cache import ResponseCache
+from .governor import RequestGovernor, estimate_tokens
+
+EMBEDDING_BATCH_SIZE = 64
+
+_response_cache: Optional[ResponseCache] = None
+_request_governor: Optional[RequestGovernor] = RequestGovernor()
+
+
+def set_response_cache(cache: Optional[ResponseCache]) -> None:
+    global _response_cache
+    _response_cache = cache
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    return _response_cache
+
+
+def set_request_governor(governor: Optional[RequestGovernor]) -> None:
+    global _request_governor
+    _request_governor = governor
+
+
+def get_request_governor() -> Optional[RequestGovernor]:
+    return _request_governor
+
+
+def _request(func: Callable[..., Any], tokens: int, **kwargs) -> Any:
+    governor = _request_governor
+    if governor is None:
+        return func(**kwargs)
+    return governor.call(func, tokens=tokens, **kwargs)
+
 
 def normalize_embeddings(x: np.ndarray) -> np.ndarray:
     norms = np.linalg.norm(x, axis=1, keepdims=True)
@@ -14,33 +47,73 @@ def normalize_embeddings(x: np.ndarray) -> np.ndarray:
 def get_together_chat_response(
     prompt: str, together_llm_client: Together, together_llm_model_name: str
 ) -> str:
-    response = together_llm_client.chat.completions.create(
+    cache = _response_cache
+    if cache is not None:
+        llm_response = cache.get("chat", together_llm_model_name, prompt)
+        if llm_response is not None:
+            return llm_response
+
+    response = _request(
+        together_llm_client.chat.completions.create,
+        tokens=estimate_tokens(prompt),
         model=together_llm_model_name,
         messages=[{"role": "user", "content": prompt}],
     )
     llm_response = response.choices[0].message.content
+    if cache is not None:
+        cache.set("chat", together_llm_model_name, prompt, llm_response)
     return llm_response
 
 
+def discard_together_chat_response(prompt: str, together_llm_model_name: str) -> None:
+    # dropping a cached reply that turned out unusable so it's requested again
+    if _response_cache is not None:
+        _response_cache.delete("chat", together_llm_model_name, prompt)
+
+
+def get_together_embeddings(
+    texts: List[str],
+    together_embedding_client: OpenAI,
+    together_model_name: str,
+    normalize_embedding: bool = False,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+) -> List[List[float]]:
+    texts = [text.replace("\n", " ") for text in texts]
+    cache = _response_cache
+    if cache is not None:
+        embs = [cache.get("embedding", together_model_name, text) for text in texts]
+    else:
+        embs = [None] * len(texts)
+
+    # packing several uncached texts into every request
+    missing = [idx for idx, emb in enumerate(embs) if emb is None]
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start : start + batch_size]
+        batch_texts = [texts[idx] for idx in batch]
+        response = _request(
+            together_embedding_client.embeddings.create,
+            tokens=estimate_tokens(*batch_texts),
+            input=batch_texts,
+            model=together_model_name,
+        )
+        for idx, item in zip(batch, response.data):
+            embs[idx] = item.embedding
+            if cache is not None:
+                cache.set("embedding", together_model_name, texts[idx], item.embedding)
+    if normalize_embedding and embs:
+        embs = normalize_embeddings(x=np.array(embs)).tolist()
+    return embs
+
+
 def get_together_embedding(
     text: str,
     together_embedding_client: OpenAI,
     together_model_name: str,
     normalize_embedding: bool = False,
 ) -> List[float]:
-    text = text.replace("\n", " ")
-    emb = (
-        together_embedding_client.embeddings.create(
-            input=[text], model=together_model_name
-        )
-        .data[0]
-        .embedding
-    )
-    if normalize_embedding:
-        emb = np.array(emb)
-        emb = np.expand_dims(emb, axis=0)
-        emb = normalize_embeddings(x=emb)
-        emb = emb.reshape(
-            -1,
-        ).tolist()
-    return emb
+    return get_together_embeddings(
+        texts=[text],
+        together_embedding_client=together_embedding_client,
+        together_model_name=together_model_name,
+        normalize_embedding=normalize_embedding,
+    )[0]
@@ -1 +1,5 @@
-from .retriever import get_db_data, retrieve
+from .retriever import get_db_data, retrieve, retrieve_batch
+from .bm25 import BM25Index, build_bm25_index, load_bm25_index, load_or_build_bm25_index
+from .ann import DEFAULT_N_PROBE, IVFIndex, build_ivf_index, load_ann_index
+from .embedding_cache import EntityEmbeddingCache, load_entity_embeddings
+from .query_cache import QueryCache, get_query_cache
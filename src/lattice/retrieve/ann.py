@@ -0,0 +1,216 @@
+import os
+from dataclasses import dataclass
+from typing import Optional, Union
+
+import numpy as np
+
+from ..storage.ragged import RaggedEmbeddings, as_ragged
+
+ANN_FILE = "ann.npz"
+# lists probed per query, see benchmarks/ann_benchmark.py
+DEFAULT_N_PROBE = 16
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.maximum(norms, np.finfo(x.dtype).tiny)
+
+
+def _assign(
+    vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 65536
+) -> np.ndarray:
+    # assigning in chunks to keep the (chunk, n_lists) similarity matrix small
+    return np.concatenate(
+        [
+            np.argmax(vectors[start : start + chunk_size] @ centroids.T, axis=1)
+            for start in range(0, len(vectors), chunk_size)
+        ]
+    )
+
+
+def kmeans(
+    vectors: np.ndarray,
+    n_clusters: int,
+    n_iter: int = 10,
+    max_points_per_cluster: int = 256,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Spherical k-means over normalized vectors, trained on a random sample of
+    at most `max_points_per_cluster * n_clusters` points. Empty clusters are
+    re-seeded from random training points.
+    """
+    rng = np.random.default_rng(seed)
+    n_train = min(len(vectors), n_clusters * max_points_per_cluster)
+    train = vectors[np.sort(rng.choice(len(vectors), size=n_train, replace=False))]
+    centroids = train[rng.choice(len(train), size=n_clusters, replace=False)]
+
+    for _ in range(n_iter):
+        assignments = _assign(train, centroids)
+        counts = np.bincount(assignments, minlength=n_clusters)
+
+        # summing the members of every non-empty cluster
+        order = np.argsort(assignments, kind="stable")
+        starts = np.cumsum(counts) - counts
+        sums = np.zeros_like(centroids)
+        non_empty = counts > 0
+        sums[non_empty] = np.add.reduceat(train[order], starts[non_empty], axis=0)
+
+        empty = ~non_empty
+        sums[empty] = train[rng.choice(len(train), size=int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+@dataclass
+class IVFIndex:
+    """
+    Inverted file index over the embedding vectors of the entities.
+
+    Every vector belongs to the list of its nearest centroid. The vectors of
+    list `l` are `vector_ids[indptr[l]:indptr[l + 1]]`, numbered in the flat
+    vector space of the ragged entity embeddings, and `owners` holds the
+    entity row of each of them.
+    """
+
+    centroids: np.ndarray
+    indptr: np.ndarray
+    vector_ids: np.ndarray
+    owners: np.ndarray
+    num_entities: int
+    vectors: Optional[RaggedEmbeddings] = None
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    def search(
+        self,
+        queries: np.ndarray,
+        n_probe: int = DEFAULT_N_PROBE,
+        num_candidates: int = 100,
+    ) -> np.ndarray:
+        """
+        Return up to `num_candidates` entity rows whose vectors in the
+        `n_probe` lists closest to any of the queries are most similar to any
+        query. `n_probe` is the number of lists probed in total, however many
+        query vectors there are. Larger `n_probe` and `num_candidates` trade
+        latency for recall.
+        """
+        queries = np.atleast_2d(queries)
+        n_probe = min(n_probe, self.n_lists)
+        similarities = (queries @ self.centroids.T).max(axis=0)
+        lists = np.sort(np.argpartition(-similarities, n_probe - 1)[:n_probe])
+
+        # gathering the vectors of all probed lists at once
+        starts = self.indptr[lists]
+        lengths = self.indptr[lists + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+        vector_ids = self.vector_ids[positions]
+        best = (self.vectors.vectors(vector_ids) @ queries.T).max(axis=1)
+
+        # keeping the best vector of every entity, most similar entities first
+        order = np.argsort(-best, kind="stable")
+        owners, first = np.unique(self.owners[positions][order], return_index=True)
+        return owners[np.argsort(first)][:num_candidates]
+
+
+def build_ivf_index(
+    entity_embeddings: Union[np.ndarray, RaggedEmbeddings],
+    n_lists: int,
+    n_iter: int = 10,
+    seed: int = 0,
+) -> IVFIndex:
+    embeddings = as_ragged(entity_embeddings)
+    # clustering every distinct vector once, the keywords of the entities
+    # then go to the list of their keyword vector
+    vectors = np.concatenate(
+        [
+            np.asarray(embeddings.base, dtype=np.float32).reshape(-1, embeddings.dim),
+            np.asarray(embeddings.keywords, dtype=np.float32),
+        ]
+    )
+    num_base = len(vectors) - len(embeddings.keywords)
+
+    # leaving out zero vectors
+    present = np.any(vectors != 0, axis=1)
+    vectors = vectors[present]
+
+    n_lists = max(1, min(n_lists, len(vectors)))
+    centroids = kmeans(vectors, n_lists, n_iter=n_iter, seed=seed)
+    distinct_assignments = np.full(len(present), -1, dtype=np.int64)
+    distinct_assignments[present] = _assign(vectors, centroids)
+    del vectors
+
+    # assignments in the flat vector space
+    assignments = np.concatenate(
+        [
+            distinct_assignments[:num_base],
+            distinct_assignments[num_base + embeddings.occurrence_ids()],
+        ]
+    )
+    vector_ids = np.flatnonzero(assignments >= 0)
+    assignments = assignments[vector_ids]
+    order = np.argsort(assignments, kind="stable")
+    indptr = np.zeros(n_lists + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignments, minlength=n_lists), out=indptr[1:])
+
+    return IVFIndex(
+        centroids=centroids.astype(np.float32),
+        indptr=indptr,
+        vector_ids=vector_ids[order].astype(np.int64),
+        owners=embeddings.vector_owners()[vector_ids[order]].astype(np.int64),
+        num_entities=len(embeddings),
+        vectors=embeddings,
+    )
+
+
+def save_ivf_index(path: str, ivf_index: IVFIndex) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            centroids=ivf_index.centroids,
+            indptr=ivf_index.indptr,
+            vector_ids=ivf_index.vector_ids,
+            owners=ivf_index.owners,
+            num_entities=ivf_index.num_entities,
+            num_vectors=ivf_index.vectors.num_vectors,
+        )
+    os.replace(tmp_path, path)
+
+
+def load_ivf_index(
+    path: str, entity_embeddings: Union[np.ndarray, RaggedEmbeddings]
+) -> Optional[IVFIndex]:
+    vectors = as_ragged(entity_embeddings)
+    with np.load(path) as data:
+        # indexes built before the ragged format number their vectors differently
+        if "num_vectors" not in data or int(data["num_vectors"]) != vectors.num_vectors:
+            return None
+        return IVFIndex(
+            centroids=data["centroids"],
+            indptr=data["indptr"],
+            vector_ids=data["vector_ids"],
+            owners=data["owners"],
+            num_entities=int(data["num_entities"]),
+            vectors=vectors,
+        )
+
+
+def load_ann_index(
+    directory: str, entity_embeddings: Union[np.ndarray, RaggedEmbeddings]
+) -> Optional[IVFIndex]:
+    """
+    Load the ANN index stored next to the entity data on top of the entity
+    embeddings it was built from, if it is current.
+    """
+    path = os.path.join(directory, ANN_FILE)
+    if not os.path.isfile(path):
+        return None
+
+    ivf_index = load_ivf_index(path, entity_embeddings)
+    if ivf_index is None or ivf_index.num_entities != len(entity_embeddings):
+        return None
+    return ivf_index
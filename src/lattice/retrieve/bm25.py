@@ -0,0 +1,181 @@
+import os
+import math
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+BM25_FILE = "bm25.npz"
+
+
+@dataclass
+class BM25Index:
+    """
+    Okapi BM25 statistics of a tokenized corpus, scored with the same
+    arithmetic as `rank_bm25.BM25Okapi` so the scores match it exactly.
+
+    The postings are stored as a term-major sparse matrix: the documents
+    containing term `t` and their term frequencies are
+    `doc_ids[indptr[t]:indptr[t + 1]]` and `term_freqs[indptr[t]:indptr[t + 1]]`.
+    """
+
+    vocabulary: Dict[str, int]
+    idf: np.ndarray
+    doc_len: np.ndarray
+    avgdl: float
+    indptr: np.ndarray
+    doc_ids: np.ndarray
+    term_freqs: np.ndarray
+    k1: float = 1.5
+    b: float = 0.75
+
+    @property
+    def corpus_size(self) -> int:
+        return len(self.doc_len)
+
+    def get_scores(self, query: List[str]) -> np.ndarray:
+        term_ids = [self.vocabulary[q] for q in query if q in self.vocabulary]
+        if not term_ids:
+            return np.zeros(self.corpus_size)
+
+        # gathering the postings of every query term, in query order
+        term_ids = np.array(term_ids)
+        starts = self.indptr[term_ids]
+        lengths = self.indptr[term_ids + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+        postings = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+
+        doc_ids = self.doc_ids[postings]
+        q_freq = self.term_freqs[postings]
+        doc_len = self.doc_len[doc_ids]
+        idf = np.repeat(self.idf[term_ids], lengths)
+        contributions = idf * (
+            q_freq
+            * (self.k1 + 1)
+            / (q_freq + self.k1 * (1 - self.b + self.b * doc_len / self.avgdl))
+        )
+        # bincount accumulates in input order, just like adding term by term
+        return np.bincount(doc_ids, weights=contributions, minlength=self.corpus_size)
+
+
+def tokenize_entity(entity: pd.DataFrame) -> List[List[str]]:
+    documents = (entity["description"] + "\n" + entity["definition"]).tolist()
+    return [doc.split() for doc in documents]
+
+
+def build_bm25_index(
+    corpus: List[List[str]], k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25
+) -> BM25Index:
+    vocabulary = {}
+    doc_freqs = []
+    posting_terms, posting_docs, posting_freqs = [], [], []
+    doc_len = np.array([len(document) for document in corpus], dtype=np.int64)
+
+    for doc_id, document in enumerate(corpus):
+        frequencies = {}
+        for word in document:
+            frequencies[word] = frequencies.get(word, 0) + 1
+        for word, freq in frequencies.items():
+            term_id = vocabulary.setdefault(word, len(vocabulary))
+            if term_id == len(doc_freqs):
+                doc_freqs.append(0)
+            doc_freqs[term_id] += 1
+            posting_terms.append(term_id)
+            posting_docs.append(doc_id)
+            posting_freqs.append(freq)
+
+    # idf with the floor rank_bm25 puts on terms found in most documents
+    corpus_size = len(corpus)
+    idf = np.zeros(len(vocabulary))
+    idf_sum = 0
+    for term_id, freq in enumerate(doc_freqs):
+        idf[term_id] = math.log(corpus_size - freq + 0.5) - math.log(freq + 0.5)
+        idf_sum += idf[term_id]
+    if len(vocabulary):
+        eps = epsilon * (idf_sum / len(vocabulary))
+        idf[idf < 0] = eps
+
+    # sorting the postings by term, documents stay in order within a term
+    posting_terms = np.array(posting_terms, dtype=np.int64)
+    order = np.argsort(posting_terms, kind="stable")
+    indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(posting_terms, minlength=len(vocabulary)), out=indptr[1:])
+
+    return BM25Index(
+        vocabulary=vocabulary,
+        idf=idf,
+        doc_len=doc_len,
+        avgdl=int(doc_len.sum()) / corpus_size if corpus_size else 0.0,
+        indptr=indptr,
+        doc_ids=np.array(posting_docs, dtype=np.int64)[order],
+        term_freqs=np.array(posting_freqs, dtype=np.int64)[order],
+        k1=k1,
+        b=b,
+    )
+
+
+def save_bm25_index(path: str, bm25_index: BM25Index) -> None:
+    # storing the vocabulary as one utf-8 buffer with term offsets
+    encoded = [term.encode() for term in bm25_index.vocabulary]
+    vocabulary_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(term) for term in encoded], out=vocabulary_offsets[1:])
+    vocabulary_data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            vocabulary_data=vocabulary_data,
+            vocabulary_offsets=vocabulary_offsets,
+            idf=bm25_index.idf,
+            doc_len=bm25_index.doc_len,
+            avgdl=bm25_index.avgdl,
+            indptr=bm25_index.indptr,
+            doc_ids=bm25_index.doc_ids,
+            term_freqs=bm25_index.term_freqs,
+            k1=bm25_index.k1,
+            b=bm25_index.b,
+        )
+    os.replace(tmp_path, path)
+
+
+def load_bm25_index(path: str) -> BM25Index:
+    with np.load(path) as data:
+        vocabulary_data = data["vocabulary_data"].tobytes()
+        vocabulary_offsets = data["vocabulary_offsets"]
+        vocabulary = {
+            vocabulary_data[start:end].decode(): term_id
+            for term_id, (start, end) in enumerate(
+                zip(vocabulary_offsets[:-1].tolist(), vocabulary_offsets[1:].tolist())
+            )
+        }
+        return BM25Index(
+            vocabulary=vocabulary,
+            idf=data["idf"],
+            doc_len=data["doc_len"],
+            avgdl=float(data["avgdl"]),
+            indptr=data["indptr"],
+            doc_ids=data["doc_ids"],
+            term_freqs=data["term_freqs"],
+            k1=float(data["k1"]),
+            b=float(data["b"]),
+        )
+
+
+def load_or_build_bm25_index(directory: str, entity: pd.DataFrame) -> BM25Index:
+    """
+    Load the BM25 index stored next to the entity data, building and storing
+    it when it is missing or doesn't match the entity rows.
+    """
+    path = os.path.join(directory, BM25_FILE)
+    bm25_index: Optional[BM25Index] = None
+    if os.path.isfile(path):
+        bm25_index = load_bm25_index(path)
+        if bm25_index.corpus_size != len(entity):
+            bm25_index = None
+
+    if bm25_index is None:
+        bm25_index = build_bm25_index(tokenize_entity(entity))
+        save_bm25_index(path, bm25_index)
+    return bm25_index
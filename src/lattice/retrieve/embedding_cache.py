@@ -0,0 +1,97 @@
+import glob
+import os
+import re
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ..indexer.manifest import file_fingerprint
+from ..logger import logger
+from .retriever import get_db_data, get_entity_embeddings
+
+
+SIDECAR_PATTERN = re.compile(r"\.([0-9a-f]{16})\.k\d+\.npy")
+
+
+def sidecar_path(entity_path: str, content_hash: str, num_keywords: int) -> str:
+    return f"{entity_path}.{content_hash[:16]}.k{num_keywords}.npy"
+
+
+def load_entity_embeddings(
+    entity_path: str,
+    num_keywords: int,
+    entity: Optional[pd.DataFrame] = None,
+    content_hash: Optional[str] = None,
+) -> np.ndarray:
+    """
+    Return the float32 embedding tensor of an `entity.csv` file, decoded
+    once and saved in a `.npy` sidecar file next to it that is named after
+    the hash of the CSV content, so later loads skip parsing entirely.
+    """
+    if content_hash is None:
+        content_hash = file_fingerprint(entity_path)["hash"]
+    path = sidecar_path(entity_path, content_hash, num_keywords)
+    if os.path.isfile(path):
+        return np.load(path, mmap_mode="r")
+
+    logger.info(f"decoding the embeddings of {entity_path}")
+    if entity is None:
+        entity, _ = get_db_data(entity_path)
+    embeddings = get_entity_embeddings(entity=entity, num_keywords=num_keywords)
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    # removing the sidecars of earlier contents of the file, keeping those of
+    # other keyword counts
+    for stale_path in glob.glob(f"{glob.escape(entity_path)}.*.k*.npy"):
+        match = SIDECAR_PATTERN.fullmatch(stale_path[len(entity_path) :])
+        if match and match.group(1) != content_hash[:16]:
+            os.remove(stale_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, embeddings)
+    os.replace(tmp_path, path)
+    return embeddings
+
+
+class EntityEmbeddingCache:
+    """
+    In-process cache of `entity.csv` files and their decoded embeddings,
+    held by library callers between queries. A file is only read again once
+    its modification time or size changes.
+
+    The CLI and the server don't need it: they load the columnar index,
+    whose embeddings are already memory mapped `.npy` files, and
+    `load_index` migrates an `entity.csv` index to it once.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, int], Tuple[Dict, pd.DataFrame, np.ndarray]] = {}
+
+    def load(
+        self, entity_path: str, num_keywords: int
+    ) -> Tuple[pd.DataFrame, np.ndarray]:
+        key = (os.path.abspath(entity_path), num_keywords)
+        with self._lock:
+            cached = self._entries.get(key)
+        previous = cached[0] if cached is not None else None
+        fingerprint = file_fingerprint(entity_path, previous=previous)
+        if cached is not None and fingerprint == previous:
+            return cached[1], cached[2]
+
+        entity, _ = get_db_data(entity_path)
+        embeddings = load_entity_embeddings(
+            entity_path,
+            num_keywords,
+            entity=entity,
+            content_hash=fingerprint["hash"],
+        )
+        with self._lock:
+            self._entries[key] = (fingerprint, entity, embeddings)
+        return entity, embeddings
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -55,3 +55,43 @@ keyword_extraction = '''You are an AI assistant specialized in all fields of Pyt
                      IMPORTANT NOTE: DO NOT OUTPUT ANY OTHER EXPLANATIONS. ONLY RETURN THE PYTHON DICTIONARY.
                      IMPORTANT NOTE: MAKE SURE THERE ARE NO SYNTAX ERRORS IN THE PYTHON DICTIONARY.
                      OUTPUT:'''
+
+
+# the description of a function whose docstring is descriptive enough
+docstring_description = "{function_name}: {docstring}"
+
+description_and_keyword_extraction = '''You are an expert software engineer having deep knowledge about all parts of
+                                     software development, and you are indexing Python code in a RAG system so it
+                                     is retrieved if a user asks anything that might be solved with it.
+
+                                     Read the code below and do two tasks:
+
+                                     1. Give a thorough explanation of what the code does.
+                                     2. Extract 10 detailed keywords and entities from your explanation and the code,
+                                     such as any specific domain, use-cases, functions, actions, or objects.
+
+                                     NOTE: THE KEYWORDS MUST BE UNIQUE, SPECIFIC AND THE MOST IMPORTANT ONES.
+                                     NOTE: EVERY KEYWORD IS A SINGLE LOWER CASE WORD IN SINGULAR TERM.
+                                     NOTE: KEYWORDS DO NOT CONTAIN PYTHON TYPES SUCH AS LIST, TUPLE, ETC.
+                                     NOTE: KEYWORDS DO NOT CONTAIN PYTHON SYNTAX WORDS SUCH AS LEN, RANGE, ETC.
+
+                                     Return a single JSON object with the following keys and values:
+                                     {{
+                                     "description": <THOROUGH EXPLANATION OF THE CODE>,
+                                     "description_keywords": [Array of terms]
+                                     }}
+
+                                     CODE:
+                                     {definition}
+
+                                     IMPORTANT NOTE: DO NOT OUTPUT ANY OTHER EXPLANATIONS. ONLY RETURN THE JSON OBJECT.
+                                     OUTPUT:'''
+
+json_repair = '''The text below was supposed to be a single valid JSON object with the keys {keys},
+              but it can't be parsed. Rewrite it as that JSON object, keeping its content.
+
+              TEXT:
+              {response}
+
+              IMPORTANT NOTE: ONLY RETURN THE JSON OBJECT.
+              OUTPUT:'''
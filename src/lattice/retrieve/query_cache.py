@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ..logger import logger
+
+QUERY_CACHE_FILE = "query_cache.sqlite"
+DEFAULT_QUERY_CACHE_SIZE = 64 * 1024 * 1024
+# seconds a query stays cached, None keeps them until they are evicted
+DEFAULT_QUERY_CACHE_TTL = 30 * 24 * 3600.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS queries (
+    key TEXT PRIMARY KEY,
+    keywords TEXT NOT NULL,
+    embeddings BLOB NOT NULL,
+    dim INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS queries_accessed ON queries (accessed);
+"""
+
+
+def legacy_query_path(directory: str, query: str) -> str:
+    # the file of a query cached before the query cache existed
+    query_hash = hashlib.md5(query.encode()).hexdigest()
+    return os.path.join(directory, f"query_{query_hash}.csv")
+
+
+class QueryCache:
+    """
+    Keywords and keyword embeddings of past queries, in one SQLite file.
+
+    Entries are keyed by the query and the `kind` of its embeddings, those
+    of its extracted keywords or of a fast query, and embeddings are stored
+    as raw float32 bytes. Entries expire `ttl` seconds after they were
+    cached, and once the cache grows past `max_size` bytes the least recently
+    used entries are evicted. Everything is dropped when the cache is opened
+    with another embedding model than it was filled with.
+
+    Queries cached in the `query_{md5}.csv` files of earlier versions are
+    moved into the cache the first time they are looked up.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        embedding_model_name: str,
+        max_size: int = DEFAULT_QUERY_CACHE_SIZE,
+        ttl: Optional[float] = DEFAULT_QUERY_CACHE_TTL,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.directory = directory
+        self.path = os.path.join(directory, QUERY_CACHE_FILE)
+        self.embedding_model_name = embedding_model_name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        # one connection shared by the threads of a batch search, other
+        # processes wait on SQLite's own lock
+        self._connection = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT value FROM settings WHERE name = 'embedding_model'"
+            ).fetchone()
+            if row is None or row[0] != embedding_model_name:
+                if row is not None:
+                    logger.info(
+                        f"embedding model changed from {row[0]} to "
+                        f"{embedding_model_name}, clearing the query cache"
+                    )
+                self._connection.execute("DELETE FROM queries")
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO settings VALUES ('embedding_model', ?)",
+                    (embedding_model_name,),
+                )
+            self._size = self._connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM queries"
+            ).fetchone()[0]
+
+    def make_key(self, query: str, kind: str = "keywords") -> str:
+        # keyed by the model too, in case another process switched models
+        return hashlib.sha256(
+            f"{kind}\0{self.embedding_model_name}\0{query}".encode()
+        ).hexdigest()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and created <= now - self.ttl
+
+    def get(
+        self, query: str, kind: str = "keywords"
+    ) -> Optional[Tuple[List[str], np.ndarray]]:
+        """
+        The keywords of a cached query and their `(K, D)` embeddings, or None.
+        """
+        key, now = self.make_key(query, kind), self._clock()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT keywords, embeddings, dim, created FROM queries WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is not None and self._expired(row[3], now):
+                self._delete(key)
+                row = None
+            if row is not None:
+                # refreshing the entry for the LRU eviction
+                self._connection.execute(
+                    "UPDATE queries SET accessed = ? WHERE key = ?", (now, key)
+                )
+        if row is None and kind == "keywords":
+            row = self._import_legacy(query)
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        keywords, embeddings, dim = row[:3]
+        embeddings = np.frombuffer(embeddings, dtype=np.float32).reshape(-1, dim)
+        return json.loads(keywords), embeddings
+
+    def set(
+        self,
+        query: str,
+        keywords: List[str],
+        embeddings: np.ndarray,
+        kind: str = "keywords",
+    ) -> None:
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        keywords_json = json.dumps(list(keywords))
+        blob = embeddings.tobytes()
+        size = len(blob) + len(keywords_json)
+        key, now = self.make_key(query, kind), self._clock()
+        with self._lock, self._connection:
+            self._delete(key)
+            self._connection.execute(
+                "INSERT INTO queries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, keywords_json, blob, embeddings.shape[-1], size, now, now),
+            )
+            self._size += size
+            if self._size > self.max_size:
+                self._evict(now)
+
+    def _delete(self, key: str) -> None:
+        row = self._connection.execute(
+            "SELECT size FROM queries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            self._connection.execute("DELETE FROM queries WHERE key = ?", (key,))
+            self._size -= row[0]
+
+    def _evict(self, now: float) -> None:
+        # dropping expired entries, then the least recently used ones down to
+        # 90% of the cap so eviction doesn't run on every write
+        if self.ttl is not None:
+            self._connection.execute(
+                "DELETE FROM queries WHERE created <= ?", (now - self.ttl,)
+            )
+        target_size = int(self.max_size * 0.9)
+        size = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM queries"
+        ).fetchone()[0]
+        if size > target_size:
+            rows = self._connection.execute(
+                "SELECT key, size FROM queries ORDER BY accessed, key"
+            ).fetchall()
+            evicted = []
+            for key, entry_size in rows:
+                if size <= target_size:
+                    break
+                evicted.append((key,))
+                size -= entry_size
+            self._connection.executemany("DELETE FROM queries WHERE key = ?", evicted)
+        self._size = size
+
+    def _import_legacy(self, query: str) -> Optional[Tuple[str, bytes, int]]:
+        path = legacy_query_path(self.directory, query)
+        if not os.path.isfile(path):
+            return None
+        try:
+            query_data = pd.read_csv(path)
+            embeddings = np.array(
+                [json.loads(emb) for emb in query_data["embedding"]], dtype=np.float32
+            )
+        except (OSError, ValueError, KeyError):
+            logger.debug(f"ignoring unreadable cached query {path}")
+            return None
+
+        keywords = [str(keyword) for keyword in query_data["keyword"]]
+        self.set(query, keywords, embeddings)
+        os.remove(path)
+        return json.dumps(keywords), embeddings.tobytes(), embeddings.shape[-1]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": self._size}
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+_query_caches: Dict[Tuple[str, str], QueryCache] = {}
+_query_caches_lock = threading.Lock()
+
+
+def get_query_cache(directory: str, embedding_model_name: str) -> QueryCache:
+    """
+    The query cache of an index directory, opened once per process.
+    """
+    key = (os.path.abspath(directory), embedding_model_name)
+    with _query_caches_lock:
+        if key not in _query_caches:
+            _query_caches[key] = QueryCache(directory, embedding_model_name)
+        return _query_caches[key]
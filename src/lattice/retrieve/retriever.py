@@ -1,9 +1,11 @@
 import os
 import ast
-import hashlib
 import configparser
 import json
-from typing import Tuple, Dict, Union
+import itertools
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Dict, Iterable, Iterator, List, Optional, Sequence, Union
 
 from dotenv import load_dotenv
 import numpy as np
@@ -12,7 +14,18 @@ from together import Together
 from openai import OpenAI
 from rank_bm25 import BM25Okapi
 
-from ..llm.together import get_together_chat_response, get_together_embedding
+from ..llm.together import get_together_chat_response, get_together_embeddings
+from ..storage.ragged import NUM_BASE_VECTORS, RaggedEmbeddings, segment_top2
+from ..storage.vocabulary import KeywordVocabulary
+from .ann import DEFAULT_N_PROBE, IVFIndex
+from .bm25 import BM25Index, build_bm25_index, tokenize_entity
+from .query_cache import QueryCache, get_query_cache
+
+NUM_BM25_CANDIDATES = 9
+QUERY_WORD_PATTERN = re.compile(r"\w+")
+# the function name and description vectors, fast queries aren't matched
+# against code
+FAST_BASE_VECTORS = (0, 2)
 
 
 def get_db_data(
@@ -45,15 +58,16 @@ def get_entity_embeddings(entity: pd.DataFrame, num_keywords: int) -> np.ndarray
     )
     description_embeddings = np.expand_dims(description_embeddings, axis=1)
 
-    # loading keyword embeddings
-    keyword_embeddings = []
+    # loading keyword embeddings, missing keywords are zero vectors
+    dim = function_name_embeddings.shape[-1]
+    keyword_embeddings = np.zeros((len(entity), num_keywords, dim))
     for idx in range(num_keywords):
-        keyword_idx_embeddings = np.stack(
-            entity[f"keyword_{idx}_embedding"].apply(ast.literal_eval)
-        )
-        keyword_idx_embeddings = np.expand_dims(keyword_idx_embeddings, axis=1)
-        keyword_embeddings.append(keyword_idx_embeddings)
-    keyword_embeddings = np.concat(keyword_embeddings, axis=1)
+        column = f"keyword_{idx}_embedding"
+        if column not in entity.columns:
+            continue
+        for row, emb in enumerate(entity[column]):
+            if isinstance(emb, str):
+                keyword_embeddings[row, idx] = ast.literal_eval(emb)
 
     # packing all embeddings together
     entity_embeddings = np.concat(
@@ -68,15 +82,166 @@ def get_entity_embeddings(entity: pd.DataFrame, num_keywords: int) -> np.ndarray
     return entity_embeddings
 
 
-def bm25_search(query: str, entity: pd.DataFrame) -> np.ndarray:
-    documents = (entity["description"] + "\n" + entity["definition"]).tolist()
+def _top2(scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # the highest and second highest value along the last axis
+    if scores.shape[-1] < 2:
+        return scores[..., 0], np.full(scores.shape[:-1], -np.inf, scores.dtype)
+    partitioned = np.partition(scores, -2, axis=-1)
+    return partitioned[..., -1], partitioned[..., -2]
+
+
+def _excluded_vectors(base_vectors: Optional[Sequence[int]]) -> List[int]:
+    if base_vectors is None:
+        return []
+    return [idx for idx in range(NUM_BASE_VECTORS) if idx not in base_vectors]
+
+
+def _score_ragged(
+    entity_embeddings: RaggedEmbeddings,
+    stacked: np.ndarray,
+    padding: np.ndarray,
+    base_vectors: Optional[Sequence[int]] = None,
+) -> np.ndarray:
+    """
+    Score ragged entity embeddings against the stacked keyword embeddings of
+    several queries, `padding` marking the padded `(query, keyword)` slots.
+    Returns the `(num_queries, N)` means of the two highest scores.
+    """
+    num_queries, num_query_keywords = padding.shape
+    num_entities, dim = len(entity_embeddings), entity_embeddings.dim
+
+    # the two highest scores of the name, definition and description vectors
+    base_scores = entity_embeddings.base.reshape(-1, dim) @ stacked.T
+    base_scores = base_scores.reshape(
+        num_entities, -1, num_queries, num_query_keywords
+    )
+    base_scores[:, :, padding] = -np.inf
+    base_scores[:, _excluded_vectors(base_vectors)] = -np.inf
+    base_scores = base_scores.transpose(0, 2, 1, 3).reshape(
+        num_entities, num_queries, -1
+    )
+    base_first, base_second = _top2(base_scores)
 
-    # Convert the document-term matrix to a list of lists (sparse matrix to dense)
-    tokenized_docs = [doc.split() for doc in documents]
+    # the two highest scores of every distinct keyword the entities use, then
+    # of the keywords of every entity
+    used, occurrences = np.unique(
+        entity_embeddings.occurrence_ids(), return_inverse=True
+    )
+    keyword_scores = (entity_embeddings.keywords[used] @ stacked.T).reshape(
+        len(used), num_queries, num_query_keywords
+    )
+    keyword_scores[:, padding] = -np.inf
+    keyword_first, keyword_second = _top2(keyword_scores)
+    keyword_first, keyword_second = segment_top2(
+        keyword_first[occurrences],
+        keyword_second[occurrences],
+        entity_embeddings.offsets,
+    )
 
-    # Tokenize the query in the same way
+    # averaging the two highest scores for each entity
+    candidates = np.stack(
+        [base_first, base_second, keyword_first, keyword_second], axis=-1
+    )
+    return np.partition(candidates, -2, axis=-1)[..., -2:].mean(-1).T
+
+
+def score_entities(
+    entity_embeddings: Union[np.ndarray, RaggedEmbeddings],
+    query_embeddings: np.ndarray,
+    base_vectors: Optional[Sequence[int]] = None,
+) -> np.ndarray:
+    # computing the similarity score between entity embeddings and query embeddings,
+    # in the precision of the entity embeddings so they are never upcast, and
+    # only against the `base_vectors` of the name, definition and description
+    # vectors if given
+    query_embeddings = query_embeddings.astype(entity_embeddings.dtype, copy=False)
+    if isinstance(entity_embeddings, RaggedEmbeddings):
+        padding = np.zeros((1, len(query_embeddings)), dtype=bool)
+        return _score_ragged(
+            entity_embeddings, query_embeddings, padding, base_vectors
+        )[0]
+
+    emb_scores = entity_embeddings @ query_embeddings.T
+    emb_scores[:, _excluded_vectors(base_vectors)] = -np.inf
+
+    # flattening the score query scores for each entity
+    emb_scores = emb_scores.reshape(emb_scores.shape[0], -1)
+    # averaging the two highest scores for each entity
+    return np.partition(emb_scores, -2, axis=1)[:, -2:].mean(1)
+
+
+def score_entities_batch(
+    entity_embeddings: Union[np.ndarray, RaggedEmbeddings],
+    queries: List[np.ndarray],
+    max_block_size: int = 2**25,
+    base_vectors: Optional[Sequence[int]] = None,
+) -> np.ndarray:
+    """
+    Score every entity against several queries at once, returning a
+    `(len(queries), N)` matrix whose rows match `score_entities` per query.
+
+    The keyword embeddings of all queries are stacked (padded to the longest
+    query) so every block of entities is scored with a single matmul, and
+    blocks are sized to keep the score tensor under `max_block_size` values.
+    """
+    ragged = isinstance(entity_embeddings, RaggedEmbeddings)
+    num_entities = len(entity_embeddings)
+    if ragged:
+        dim = entity_embeddings.dim
+        num_vectors = entity_embeddings.num_vectors
+        vectors_per_entity = max(1, num_vectors // max(num_entities, 1))
+    else:
+        _, vectors_per_entity, dim = entity_embeddings.shape
+    num_queries = len(queries)
+    num_keywords = max(len(query) for query in queries)
+
+    # padding queries with fewer keywords, the padding never makes the top two
+    stacked = np.zeros((num_queries, num_keywords, dim), dtype=entity_embeddings.dtype)
+    padding = np.ones((num_queries, num_keywords), dtype=bool)
+    for row, query in enumerate(queries):
+        stacked[row, : len(query)] = query
+        padding[row, : len(query)] = False
+    stacked = stacked.reshape(-1, dim)
+
+    scores = np.empty((num_queries, num_entities), dtype=entity_embeddings.dtype)
+    block_size = max(1, max_block_size // (vectors_per_entity * len(stacked)))
+    for start in range(0, num_entities, block_size):
+        block = entity_embeddings[start : start + block_size]
+        if ragged:
+            scores[:, start : start + len(block)] = _score_ragged(
+                block, stacked, padding, base_vectors
+            )
+            continue
+
+        emb_scores = block.reshape(-1, dim) @ stacked.T
+        emb_scores = emb_scores.reshape(len(block), vectors_per_entity, num_queries, -1)
+        emb_scores[:, :, padding] = -np.inf
+        emb_scores[:, _excluded_vectors(base_vectors)] = -np.inf
+
+        # flattening the scores of each query for each entity
+        emb_scores = emb_scores.transpose(2, 0, 1, 3).reshape(
+            num_queries, len(block), -1
+        )
+        # averaging the two highest scores for each entity and query
+        scores[:, start : start + len(block)] = np.partition(
+            emb_scores, -2, axis=2
+        )[:, :, -2:].mean(2)
+    return scores
+
+
+def bm25_search(
+    query: str, entity: pd.DataFrame, bm25_index: Optional[BM25Index] = None
+) -> np.ndarray:
+    # Tokenize the query in the same way as the documents
     tokenized_query = query.split()
 
+    # scoring against the prebuilt statistics when they are available
+    if bm25_index is not None:
+        return bm25_index.get_scores(tokenized_query)
+
+    # Convert the document-term matrix to a list of lists (sparse matrix to dense)
+    tokenized_docs = tokenize_entity(entity)
+
     # Initialize BM25 with the tokenized documents
     bm25 = BM25Okapi(tokenized_docs)
 
@@ -85,6 +250,182 @@ def bm25_search(query: str, entity: pd.DataFrame) -> np.ndarray:
     return scores
 
 
+def _check_score_type(score_type: str) -> None:
+    assert score_type in [
+        "normalized_inner_product_score",
+        "normalized_l2_score",
+    ], "The argument score_type must be either 'normalized_inner_product_score' or 'normalized_l2_score'."
+
+
+def get_query_embeddings(
+    query: str,
+    keyword_extraction_prompt_template: str,
+    together_llm_client: Union[Together],
+    together_llm_model_name: str,
+    together_embedding_client: Union[OpenAI],
+    together_embedding_model_name: str,
+    project_path: str,
+    keyword_vocabulary: Optional[KeywordVocabulary] = None,
+    query_cache: Optional[QueryCache] = None,
+) -> np.ndarray:
+    """
+    Extract the keywords of a query and embed them, once per query. Keywords
+    that `keyword_vocabulary` holds reuse its vectors instead of being
+    embedded. Queries are cached in `query_cache`, by default the query
+    cache of the project's `.lattice` directory.
+    """
+    if query_cache is None:
+        query_cache = get_query_cache(
+            os.path.join(project_path, ".lattice"), together_embedding_model_name
+        )
+    cached = query_cache.get(query)
+    if cached is not None:
+        # loading query embeddings
+        return cached[1]
+
+    # extracting keywords of the query
+    query_prompt = keyword_extraction_prompt_template.format(
+        description=query, code=""
+    )
+    query_keywords = get_together_chat_response(
+        prompt=query_prompt,
+        together_llm_client=together_llm_client,
+        together_llm_model_name=together_llm_model_name,
+    )
+    query_keywords = json.loads(query_keywords)
+    query_keywords = query_keywords["description_keywords"]
+
+    # embedding keywords of the query that aren't in the index vocabulary
+    known = {}
+    if keyword_vocabulary is not None:
+        known = {
+            keyword: keyword_vocabulary.vector(keyword).tolist()
+            for keyword in query_keywords
+            if keyword in keyword_vocabulary
+        }
+    missing = [keyword for keyword in query_keywords if keyword not in known]
+    missing = list(dict.fromkeys(missing))
+    if missing:
+        known.update(
+            zip(
+                missing,
+                get_together_embeddings(
+                    texts=missing,
+                    together_embedding_client=together_embedding_client,
+                    together_model_name=together_embedding_model_name,
+                    normalize_embedding=True,
+                ),
+            )
+        )
+    query_keyword_embs = np.array(
+        [known[keyword] for keyword in query_keywords], dtype=np.float32
+    )
+    query_cache.set(query, query_keywords, query_keyword_embs)
+    return query_keyword_embs
+
+
+def tokenize_query(query: str) -> List[str]:
+    # the lowercase words of a query, without repeats
+    return list(dict.fromkeys(QUERY_WORD_PATTERN.findall(query.lower())))
+
+
+def get_fast_query_embeddings(
+    query: str,
+    together_embedding_client: Union[OpenAI],
+    together_embedding_model_name: str,
+    project_path: str,
+    keyword_vocabulary: Optional[KeywordVocabulary] = None,
+    query_cache: Optional[QueryCache] = None,
+) -> np.ndarray:
+    """
+    Embed a query without asking the LLM for its keywords. The query itself
+    is embedded, and its words that are keywords of the index add their
+    vocabulary vectors, so an uncached query takes a single embedding request.
+    Cached queries are keyed by the vocabulary too, since its vectors are part
+    of their embeddings.
+    """
+    if query_cache is None:
+        query_cache = get_query_cache(
+            os.path.join(project_path, ".lattice"), together_embedding_model_name
+        )
+    kind = "fast"
+    if keyword_vocabulary is not None:
+        kind = f"fast\0{keyword_vocabulary.fingerprint()}"
+    cached = query_cache.get(query, kind=kind)
+    if cached is not None:
+        return cached[1]
+
+    words = []
+    if keyword_vocabulary is not None:
+        words = [word for word in tokenize_query(query) if word in keyword_vocabulary]
+    query_embs = get_together_embeddings(
+        texts=[query],
+        together_embedding_client=together_embedding_client,
+        together_model_name=together_embedding_model_name,
+        normalize_embedding=True,
+    )
+    query_embs += [keyword_vocabulary.vector(word).tolist() for word in words]
+    query_embs = np.array(query_embs, dtype=np.float32)
+    query_cache.set(query, [query, *words], query_embs, kind=kind)
+    return query_embs
+
+
+def rank_entities(
+    entity: pd.DataFrame,
+    entity_embeddings: np.ndarray,
+    query: str,
+    query_embeddings: np.ndarray,
+    bm25_index: Optional[BM25Index] = None,
+    ann_index: Optional[IVFIndex] = None,
+    n_probe: int = DEFAULT_N_PROBE,
+    top_k: int = 1,
+    num_bm25_candidates: int = NUM_BM25_CANDIDATES,
+    emb_scores: Optional[np.ndarray] = None,
+    base_vectors: Optional[Sequence[int]] = None,
+) -> List[Dict]:
+    """
+    Rank the entities for one query by their embedding scores among the top
+    BM25 candidates. With `ann_index` the entities the ANN index finds for the
+    query embeddings are candidates too, so entities sharing no words with
+    the query can still be returned. `emb_scores` skips the embedding scoring
+    when the scores of every entity were already computed for this query.
+    """
+    # computing the BM25 search scores
+    bm25_scores = bm25_search(query=query, entity=entity, bm25_index=bm25_index)
+
+    # first getting the top BM25 search scores
+    width = min(max(num_bm25_candidates, top_k), len(entity))
+    if width == 0:
+        return []
+    candidates = np.argpartition(-bm25_scores, width - 1)[:width]
+
+    # ============== computing the retrieved entity ==============
+    if emb_scores is not None:
+        candidate_scores = emb_scores[candidates]
+    else:
+        if ann_index is not None:
+            candidates = np.union1d(
+                ann_index.search(query_embeddings, n_probe=n_probe), candidates
+            )
+        # scoring only the candidates the results are picked from
+        candidate_scores = score_entities(
+            entity_embeddings[candidates], query_embeddings, base_vectors
+        )
+
+    order = np.argsort(-candidate_scores, kind="stable")[:top_k]
+    results = []
+    for result_idx, emb_score in zip(candidates[order], candidate_scores[order]):
+        result = entity.iloc[result_idx][
+            ["id", "function_name", "description", "definition"]
+        ].to_dict()
+        result["scores"] = {
+            "bm25": float(bm25_scores[result_idx]),
+            "embedding": float(emb_score),
+        }
+        results.append(result)
+    return results
+
+
 def retrieve(
     entity: pd.DataFrame,
     query: str,
@@ -96,84 +437,154 @@ def retrieve(
     together_embedding_model_name: str,
     project_path: str,
     score_type: str = "normalized_inner_product_score",
-) -> Dict:
-    assert score_type in [
-        "normalized_inner_product_score",
-        "normalized_l2_score",
-    ], "The argument score_type must be either 'normalized_inner_product_score' or 'normalized_l2_score'."
+    entity_embeddings: Optional[np.ndarray] = None,
+    bm25_index: Optional[BM25Index] = None,
+    ann_index: Optional[IVFIndex] = None,
+    n_probe: int = DEFAULT_N_PROBE,
+    top_k: int = 1,
+    num_bm25_candidates: int = NUM_BM25_CANDIDATES,
+    keyword_vocabulary: Optional[KeywordVocabulary] = None,
+    fast: bool = False,
+) -> List[Dict]:
+    """
+    Retrieve the entities best matching a query. With `fast` the query is
+    embedded as is instead of by its LLM extracted keywords, and matched
+    against the name, description and keyword vectors of the entities.
+    """
+    _check_score_type(score_type)
 
     # loading entity and relation data
     # entity, relationship = get_db_data()
 
-    # Loading the embeddings of data
-    entity_embeddings = get_entity_embeddings(entity=entity, num_keywords=num_keywords)
+    # Loading the embeddings of data unless they come from a columnar index,
+    # callers querying an entity.csv repeatedly pass EntityEmbeddingCache's
+    if entity_embeddings is None:
+        entity_embeddings = get_entity_embeddings(
+            entity=entity, num_keywords=num_keywords
+        )
 
     # query processing
-    query_hash_object = hashlib.md5(query.encode())
-    query_hash = query_hash_object.hexdigest()
-    query_path = os.path.join(project_path, ".lattice", f"query_{query_hash}.csv")
-    if os.path.isfile(query_path):
-        # loading query embeddings and keywords
-        query_data = pd.read_csv(query_path)
-
-    else:
-        # extracting keywords of the query
-        query_prompt = keyword_extraction_prompt_template.format(
-            description=query, code=""
+    if fast:
+        query_embeddings = get_fast_query_embeddings(
+            query=query,
+            together_embedding_client=together_embedding_client,
+            together_embedding_model_name=together_embedding_model_name,
+            project_path=project_path,
+            keyword_vocabulary=keyword_vocabulary,
         )
-        query_keywords = get_together_chat_response(
-            prompt=query_prompt,
+    else:
+        query_embeddings = get_query_embeddings(
+            query=query,
+            keyword_extraction_prompt_template=keyword_extraction_prompt_template,
             together_llm_client=together_llm_client,
             together_llm_model_name=together_llm_model_name,
+            together_embedding_client=together_embedding_client,
+            together_embedding_model_name=together_embedding_model_name,
+            project_path=project_path,
+            keyword_vocabulary=keyword_vocabulary,
         )
-        query_keywords = json.loads(query_keywords)
-        query_keywords = query_keywords["description_keywords"]
-
-        # embedding keywords of the query
-        query_data = {"keyword": [], "embedding": []}
-        for query_keyword_idx, query_keyword in enumerate(query_keywords):
-            query_keyword_emb = get_together_embedding(
-                text=query_keyword,
-                together_embedding_client=together_embedding_client,
-                together_model_name=together_embedding_model_name,
-                normalize_embedding=True,
-            )
-            query_data["keyword"].append(query_keyword)
-            query_data["embedding"].append(str(query_keyword_emb))
-        query_data = pd.DataFrame.from_dict(data=query_data)
-        query_data.to_csv(query_path, index=False)
 
-    # loading query keyword embeddings
-    query_embeddings = np.stack(query_data["embedding"].apply(ast.literal_eval))
+    return rank_entities(
+        entity=entity,
+        entity_embeddings=entity_embeddings,
+        query=query,
+        query_embeddings=query_embeddings,
+        bm25_index=bm25_index,
+        ann_index=ann_index,
+        n_probe=n_probe,
+        top_k=top_k,
+        num_bm25_candidates=num_bm25_candidates,
+        base_vectors=FAST_BASE_VECTORS if fast else None,
+    )
 
-    # computing the similarity score between entity embeddings and query embeddings
-    emb_scores = entity_embeddings @ query_embeddings.T
 
-    # ============== computing the retrieved entity ==============
-    # flattening the score query scores for each entity
-    emb_scores = emb_scores.reshape(emb_scores.shape[0], -1)
-    # averaging the two highest scores for each entity
-    emb_scores = np.sort(emb_scores, axis=1)[:, -2:].mean(1)
+def retrieve_batch(
+    entity: pd.DataFrame,
+    queries: Iterable[str],
+    num_keywords: int,
+    keyword_extraction_prompt_template: str,
+    together_llm_client: Union[Together],
+    together_llm_model_name: str,
+    together_embedding_client: Union[OpenAI],
+    together_embedding_model_name: str,
+    project_path: str,
+    score_type: str = "normalized_inner_product_score",
+    entity_embeddings: Optional[np.ndarray] = None,
+    bm25_index: Optional[BM25Index] = None,
+    top_k: int = 1,
+    num_bm25_candidates: int = NUM_BM25_CANDIDATES,
+    concurrency: int = 8,
+    chunk_size: int = 256,
+    keyword_vocabulary: Optional[KeywordVocabulary] = None,
+    fast: bool = False,
+) -> Iterator[Tuple[str, List[Dict]]]:
+    """
+    Retrieve the results of many queries, yielding `(query, results)` pairs
+    in input order as soon as each chunk of `chunk_size` queries is scored.
+
+    The keywords of a chunk are extracted and embedded with up to
+    `concurrency` queries in flight, then every query of the chunk is scored
+    against all entities at once. Scoring is exact, so no ANN index is used.
+    `fast` skips the keyword extraction as in `retrieve`.
+    """
+    _check_score_type(score_type)
+
+    if entity_embeddings is None:
+        entity_embeddings = get_entity_embeddings(
+            entity=entity, num_keywords=num_keywords
+        )
+    if bm25_index is None:
+        bm25_index = build_bm25_index(tokenize_entity(entity))
 
-    # computing the BM25 search scores
-    bm25_scores = bm25_search(query=query, entity=entity)
+    base_vectors = FAST_BASE_VECTORS if fast else None
 
-    # constructing score dataframe
-    score = pd.DataFrame.from_dict(
-        data={"embedding": emb_scores.tolist(), "bm25": bm25_scores}
-    ).reset_index()
+    def fetch(query: str) -> np.ndarray:
+        if fast:
+            return get_fast_query_embeddings(
+                query=query,
+                together_embedding_client=together_embedding_client,
+                together_embedding_model_name=together_embedding_model_name,
+                project_path=project_path,
+                keyword_vocabulary=keyword_vocabulary,
+            )
+        return get_query_embeddings(
+            query=query,
+            keyword_extraction_prompt_template=keyword_extraction_prompt_template,
+            together_llm_client=together_llm_client,
+            together_llm_model_name=together_llm_model_name,
+            together_embedding_client=together_embedding_client,
+            together_embedding_model_name=together_embedding_model_name,
+            project_path=project_path,
+            keyword_vocabulary=keyword_vocabulary,
+        )
 
-    # first getting the top-5 BM25 search scores, then return the top embedding scores among those top-5 scores
-    result_idx = int(
-        score.sort_values(by="bm25", ascending=False)
-        .iloc[:9]
-        .sort_values(by="embedding", ascending=False)
-        .iloc[0]["index"]
-    )
-    result = entity.iloc[result_idx][
-        ["id", "function_name", "description", "definition"]
-    ].to_dict()
-    return result
+    queries = iter(queries)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            chunk = list(itertools.islice(queries, chunk_size))
+            if not chunk:
+                break
+
+            # repeated queries share one keyword extraction and one score row
+            unique_queries = list(dict.fromkeys(chunk))
+            rows = {query: row for row, query in enumerate(unique_queries)}
+            query_embeddings = list(executor.map(fetch, unique_queries))
+            emb_scores = score_entities_batch(
+                entity_embeddings, query_embeddings, base_vectors=base_vectors
+            )
+
+            for query in chunk:
+                yield query, rank_entities(
+                    entity=entity,
+                    entity_embeddings=entity_embeddings,
+                    query=query,
+                    query_embeddings=query_embeddings[rows[query]],
+                    bm25_index=bm25_index,
+                    top_k=top_k,
+                    num_bm25_candidates=num_bm25_candidates,
+                    emb_scores=emb_scores[rows[query]],
+                    base_vectors=base_vectors,
+                )
 
 
 def main():
@@ -187,14 +598,15 @@ def main():
     together_llm_model_name = "meta-llama/Llama-3-70b-chat-hf"
     together_embedding_model_name = "togethercomputer/m2-bert-80M-32k-retrieval"
 
+    # the embedding cache imports this module
+    from .embedding_cache import EntityEmbeddingCache
+
     entity_path = os.path.join(
         ROOT_PROJECT_PATH, "src", "lattice", "retrieve", "entity.csv"
     )
-    relationship_path = os.path.join(
-        ROOT_PROJECT_PATH, "src", "lattice", "retrieve", "relationship.csv"
-    )
-
-    entity, relationship = get_db_data(entity_path, relationship_path)
+    num_keywords = 10
+    # decoding the CSV embeddings once, later runs read them from a sidecar
+    entity, entity_embeddings = EntityEmbeddingCache().load(entity_path, num_keywords)
 
     # reading prompt templates
     config = configparser.ConfigParser()
@@ -205,10 +617,8 @@ def main():
 
     # calling the retrieve function
     query = "I want a function that visualizes a histogram."
-    num_keywords = 10
-    result = retrieve(
+    results = retrieve(
         entity=entity,
-        relationship=relationship,
         query=query,
         num_keywords=num_keywords,
         keyword_extraction_prompt_template=keyword_extraction_prompt_template,
@@ -218,11 +628,12 @@ def main():
         together_embedding_model_name=together_embedding_model_name,
         project_path="./",
         score_type="normalized_l2_score",
+        entity_embeddings=entity_embeddings,
     )
     print("Input Query:")
     print(query)
     print("Result:")
-    print(json.dumps(result, indent=4))
+    print(json.dumps(results, indent=4))
 
 
 if __name__ == "__main__":
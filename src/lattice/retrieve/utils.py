@@ -1,9 +1,16 @@
 import ast
+import re
 from textwrap import dedent
-from typing import Tuple
+from typing import Optional, Tuple
 
 import numpy as np
 
+# numpy and google style section headers, where the summary of a docstring ends
+DOCSTRING_SECTION_PATTERN = re.compile(
+    r"^\s*(Parameters|Returns|Yields|Raises|Args|Arguments|Attributes|Examples?|"
+    r"Notes|See Also)\s*:?\s*$"
+)
+
 
 def separate_docstring_and_code(source_code: str) -> Tuple[str, str]:
     """
@@ -47,3 +54,46 @@ def separate_docstring_and_code(source_code: str) -> Tuple[str, str]:
         code_without_docstring = source_code.strip()
 
     return docstring, code_without_docstring
+
+
+def strip_docstring(source_code: str) -> Tuple[Optional[str], str]:
+    """
+    Return the docstring of a function and its source without the docstring
+    lines, keeping the signature and the original indentation. The source is
+    returned unchanged if it can't be parsed or the docstring shares a line
+    with code.
+    """
+    dedented = dedent(source_code)
+    try:
+        function_node = ast.parse(dedented).body[0]
+    except (SyntaxError, IndexError):
+        return None, source_code
+    if not isinstance(function_node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return None, source_code
+
+    docstring = ast.get_docstring(function_node)
+    if not docstring:
+        return None, source_code
+
+    docstring_node = function_node.body[0]
+    start, end = docstring_node.lineno, docstring_node.end_lineno
+    # the offsets are within the dedented lines, which are numbered the same
+    dedented_lines = dedented.splitlines()
+    before = dedented_lines[start - 1][: docstring_node.col_offset]
+    after = dedented_lines[end - 1][docstring_node.end_col_offset :]
+    if before.strip() or after.strip():
+        return docstring, source_code
+    lines = source_code.splitlines()
+    return docstring, "\n".join(lines[: start - 1] + lines[end:])
+
+
+def docstring_summary(docstring: str) -> str:
+    """
+    The prose part of a docstring, before its first section header.
+    """
+    summary = []
+    for line in docstring.splitlines():
+        if DOCSTRING_SECTION_PATTERN.match(line):
+            break
+        summary.append(line)
+    return " ".join(" ".join(summary).split())
@@ -0,0 +1 @@
+from .app import IndexState, create_app
@@ -0,0 +1,135 @@
+import os
+import time
+import threading
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+from fastapi import FastAPI, Query
+
+from ..logger import logger
+from ..retrieve import (
+    DEFAULT_N_PROBE,
+    BM25Index,
+    IVFIndex,
+    load_ann_index,
+    load_or_build_bm25_index,
+    retrieve,
+    prompts,
+)
+from ..storage import (
+    KeywordVocabulary,
+    RaggedEmbeddings,
+    load_index,
+    load_keyword_vocabulary,
+)
+from ..storage.columnar import INFO_FILE, LEGACY_ENTITY_FILE
+
+
+class IndexState:
+    """
+    Keeps the index of a project loaded in memory and reloads it whenever
+    the index files in `.lattice` change on disk.
+    """
+
+    def __init__(self, project_path: str) -> None:
+        self.project_path = project_path
+        self.directory = os.path.join(project_path, ".lattice")
+        self.entity: Optional[pd.DataFrame] = None
+        self.entity_embeddings: Optional[RaggedEmbeddings] = None
+        self.bm25_index: Optional[BM25Index] = None
+        self.ann_index: Optional[IVFIndex] = None
+        self.keyword_vocabulary: Optional[KeywordVocabulary] = None
+        self._signature = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def _current_signature(self) -> Tuple:
+        # the info file is written last, so it changes once a new index is complete
+        signature = []
+        for name in [INFO_FILE, LEGACY_ENTITY_FILE]:
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            signature.append((name, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def refresh(self) -> bool:
+        with self._lock:
+            signature = self._current_signature()
+            if signature == self._signature:
+                return False
+
+            logger.info(f"loading index from {self.directory}")
+            self.entity, self.entity_embeddings = load_index(self.directory, mmap=False)
+            self.bm25_index = load_or_build_bm25_index(self.directory, self.entity)
+            self.ann_index = load_ann_index(self.directory, self.entity_embeddings)
+            self.keyword_vocabulary = load_keyword_vocabulary(
+                self.directory, self.entity_embeddings
+            )
+            # migrating a legacy index replaces the files we just looked at
+            self._signature = self._current_signature()
+            return True
+
+    def snapshot(
+        self,
+    ) -> Tuple[
+        pd.DataFrame,
+        RaggedEmbeddings,
+        BM25Index,
+        Optional[IVFIndex],
+        KeywordVocabulary,
+    ]:
+        self.refresh()
+        with self._lock:
+            return (
+                self.entity,
+                self.entity_embeddings,
+                self.bm25_index,
+                self.ann_index,
+                self.keyword_vocabulary,
+            )
+
+
+def create_app(project_path: str, clients: Dict) -> FastAPI:
+    state = IndexState(project_path)
+    app = FastAPI(title="Lattice")
+
+    @app.get("/search")
+    def search(
+        query: str,
+        top_k: int = Query(1, ge=1),
+        n_probe: int = Query(DEFAULT_N_PROBE, ge=1),
+        fast: bool = False,
+    ) -> Dict:
+        start = time.perf_counter()
+        (
+            entity,
+            entity_embeddings,
+            bm25_index,
+            ann_index,
+            keyword_vocabulary,
+        ) = state.snapshot()
+        results = retrieve(
+            entity=entity,
+            query=query,
+            num_keywords=10,
+            keyword_extraction_prompt_template=prompts.keyword_extraction,
+            together_llm_client=clients["llm"]["client"],
+            together_llm_model_name=clients["llm"]["model"],
+            together_embedding_client=clients["embedding"]["client"],
+            together_embedding_model_name=clients["embedding"]["model"],
+            project_path=project_path,
+            score_type="normalized_l2_score",
+            entity_embeddings=entity_embeddings,
+            bm25_index=bm25_index,
+            ann_index=ann_index,
+            n_probe=n_probe,
+            top_k=top_k,
+            keyword_vocabulary=keyword_vocabulary,
+            fast=fast,
+        )
+        latency_ms = (time.perf_counter() - start) * 1000
+        return {"query": query, "results": results, "latency_ms": latency_ms}
+
+    return app
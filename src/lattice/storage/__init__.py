@@ -0,0 +1,11 @@
+from .columnar import (
+    has_index,
+    load_index,
+    load_keyword_vocabulary,
+    migrate_csv_index,
+    save_index,
+    split_entity,
+)
+from .ragged import RaggedEmbeddings, as_ragged
+from .vocabulary import KeywordVocabulary
+from .writer import IndexWriter
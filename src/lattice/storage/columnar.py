@@ -0,0 +1,316 @@
+import os
+import ast
+import json
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from ..logger import logger
+from .ragged import RaggedEmbeddings, as_ragged
+from .vocabulary import KeywordVocabulary, deduplicate_keywords
+
+FORMAT_VERSION = 3
+
+INFO_FILE = "index.json"
+METADATA_FILE = "entity.parquet"
+BASE_EMBEDDINGS_FILE = "base.npy"
+KEYWORD_EMBEDDINGS_FILE = "keywords.npy"
+KEYWORD_IDS_FILE = "keyword_ids.npy"
+KEYWORD_OFFSETS_FILE = "keyword_offsets.npy"
+# the text of every distinct keyword, in keyword id order
+VOCABULARY_FILE = "keyword_vocabulary.parquet"
+# the dense (N, 3 + K, D) embedding tensor of format version 1
+LEGACY_EMBEDDINGS_FILE = "embeddings.npy"
+LEGACY_ENTITY_FILE = "entity.csv"
+
+EMBEDDING_COLUMNS = [
+    "function_name_embedding",
+    "definition_embedding",
+    "description_embedding",
+]
+# the embedding files in the order they are swapped in
+EMBEDDING_FILES = [
+    BASE_EMBEDDINGS_FILE,
+    KEYWORD_EMBEDDINGS_FILE,
+    KEYWORD_IDS_FILE,
+    KEYWORD_OFFSETS_FILE,
+]
+# the embedding files of format version 2, with one keyword vector per entity
+# keyword
+RAGGED_EMBEDDING_FILES = [
+    BASE_EMBEDDINGS_FILE,
+    KEYWORD_EMBEDDINGS_FILE,
+    KEYWORD_OFFSETS_FILE,
+]
+
+
+def _num_keywords(entity: pd.DataFrame) -> int:
+    num_keywords = 0
+    while f"keyword_{num_keywords}_embedding" in entity.columns:
+        num_keywords += 1
+    return num_keywords
+
+
+def _parse_embedding(emb) -> Optional[List[float]]:
+    # embeddings are lists in memory and stringified lists in legacy CSV
+    # files, missing keywords are None or NaN
+    if isinstance(emb, str):
+        emb = ast.literal_eval(emb)
+    if isinstance(emb, (list, tuple, np.ndarray)):
+        return emb
+    return None
+
+
+def _column_embeddings(column: pd.Series, dim: int) -> np.ndarray:
+    embeddings = np.zeros((len(column), dim), dtype=np.float32)
+    for row_idx, emb in enumerate(column):
+        emb = _parse_embedding(emb)
+        if emb is not None:
+            embeddings[row_idx] = emb
+    return embeddings
+
+
+def _embedding_dim(entity: pd.DataFrame) -> int:
+    return len(_parse_embedding(entity["function_name_embedding"].iloc[0]))
+
+
+def _collapse_keywords(
+    metadata: pd.DataFrame, counts: Optional[np.ndarray] = None
+) -> pd.DataFrame:
+    # replacing the keyword_{i} columns with one list column, keeping the
+    # first `counts` keywords of every row if given
+    columns = []
+    while f"keyword_{len(columns)}" in metadata.columns:
+        columns.append(f"keyword_{len(columns)}")
+    if "keywords" in metadata.columns and not columns:
+        return metadata
+
+    rows = metadata[columns].itertuples(index=False, name=None)
+    keywords = [
+        [keyword for keyword in row if isinstance(keyword, str)] for row in rows
+    ]
+    if counts is not None:
+        keywords = [row[:count] for row, count in zip(keywords, counts)]
+    metadata = metadata.drop(columns=columns)
+    metadata["keywords"] = pd.Series(keywords, index=metadata.index, dtype=object)
+    return metadata
+
+
+def split_entity(entity: pd.DataFrame) -> Tuple[pd.DataFrame, RaggedEmbeddings]:
+    """
+    Split an entity dataframe with embedding columns into its metadata table
+    and its ragged float32 embeddings.
+
+    The `keyword_{i}` and `keyword_{i}_embedding` columns may be missing
+    values where an entity has fewer keywords. The keywords of every entity
+    are kept in a `keywords` list column of the metadata, aligned with its
+    keyword embeddings, and keywords shared by several entities are stored
+    once.
+    """
+    num_keywords = _num_keywords(entity)
+    keyword_columns = [f"keyword_{i}_embedding" for i in range(num_keywords)]
+    metadata = entity.drop(columns=EMBEDDING_COLUMNS + keyword_columns)
+    metadata = metadata.reset_index(drop=True)
+    text_columns = [f"keyword_{i}" for i in range(num_keywords)]
+    text_columns = [column for column in text_columns if column in entity.columns]
+    metadata = metadata.drop(columns=text_columns)
+
+    if entity.empty:
+        metadata["keywords"] = pd.Series([], dtype=object)
+        return metadata, RaggedEmbeddings.empty()
+
+    dim = _embedding_dim(entity)
+    base = np.stack(
+        [_column_embeddings(entity[column], dim) for column in EMBEDDING_COLUMNS],
+        axis=1,
+    )
+
+    # collecting the keywords that exist, in column order
+    keyword_embs, keywords, counts = [], [], []
+    texts = entity.reindex(
+        columns=[f"keyword_{i}" for i in range(num_keywords)]
+    ).itertuples(index=False, name=None)
+    embs = entity[keyword_columns].itertuples(index=False, name=None)
+    for row_texts, row_embs in zip(texts, embs):
+        row_keywords = []
+        for text, emb in zip(row_texts, row_embs):
+            emb = _parse_embedding(emb)
+            if emb is not None:
+                keyword_embs.append(emb)
+                row_keywords.append(text if isinstance(text, str) else "")
+        keywords.append(row_keywords)
+        counts.append(len(row_keywords))
+
+    metadata["keywords"] = pd.Series(keywords, dtype=object)
+    embeddings = RaggedEmbeddings(
+        base=base,
+        keywords=np.array(keyword_embs, dtype=np.float32).reshape(-1, dim),
+        offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+    )
+    embeddings, _ = deduplicate_keywords(metadata, embeddings)
+    return metadata, embeddings
+
+
+def has_index(directory: str) -> bool:
+    return os.path.isfile(os.path.join(directory, INFO_FILE)) or os.path.isfile(
+        os.path.join(directory, LEGACY_ENTITY_FILE)
+    )
+
+
+def commit_index(
+    directory: str,
+    metadata: Optional[pd.DataFrame],
+    info: Dict,
+    vocabulary: KeywordVocabulary,
+    staged_files: Sequence[str] = (),
+) -> None:
+    # the embedding files and the `staged_files` built from the rows are
+    # already written next to their final names, as is the metadata file when
+    # `metadata` is None, the other files are written the same way before
+    # swapping everything in, the info file last since it marks the index as
+    # complete
+    info = {"format_version": FORMAT_VERSION, **info}
+    metadata_path = os.path.join(directory, METADATA_FILE)
+    if metadata is not None:
+        metadata.astype({"id": str}).to_parquet(f"{metadata_path}.tmp", index=False)
+    vocabulary_path = os.path.join(directory, VOCABULARY_FILE)
+    pd.DataFrame({"keyword": pd.Series(vocabulary.keywords, dtype=object)}).to_parquet(
+        f"{vocabulary_path}.tmp", index=False
+    )
+    info_path = os.path.join(directory, INFO_FILE)
+    with open(f"{info_path}.tmp", "w") as f:
+        json.dump(info, f, indent=1)
+
+    for name in [*EMBEDDING_FILES, *staged_files]:
+        path = os.path.join(directory, name)
+        os.replace(f"{path}.tmp", path)
+    os.replace(f"{vocabulary_path}.tmp", vocabulary_path)
+    os.replace(f"{metadata_path}.tmp", metadata_path)
+    os.replace(f"{info_path}.tmp", info_path)
+
+    legacy_path = os.path.join(directory, LEGACY_EMBEDDINGS_FILE)
+    if os.path.isfile(legacy_path):
+        os.remove(legacy_path)
+
+
+def index_info(embeddings: RaggedEmbeddings) -> Dict:
+    return {
+        "num_entities": len(embeddings),
+        "num_keywords": int(embeddings.offsets[-1] - embeddings.offsets[0]),
+        "vocabulary_size": len(embeddings.keywords),
+        "dim": int(embeddings.dim),
+    }
+
+
+def save_index(
+    directory: str,
+    metadata: pd.DataFrame,
+    embeddings: Union[np.ndarray, RaggedEmbeddings],
+) -> None:
+    os.makedirs(directory, exist_ok=True)
+    metadata = _collapse_keywords(metadata)
+    embeddings, vocabulary = deduplicate_keywords(metadata, as_ragged(embeddings))
+    arrays = [
+        embeddings.base,
+        embeddings.keywords,
+        embeddings.keyword_ids,
+        embeddings.offsets,
+    ]
+    for name, array in zip(EMBEDDING_FILES, arrays):
+        dtype = np.float32 if array.dtype.kind == "f" else np.int64
+        with open(os.path.join(directory, f"{name}.tmp"), "wb") as f:
+            np.save(f, np.ascontiguousarray(array, dtype=dtype))
+    commit_index(directory, metadata, index_info(embeddings), vocabulary)
+
+
+def read_index_info(directory: str) -> Dict:
+    with open(os.path.join(directory, INFO_FILE)) as f:
+        return json.load(f)
+
+
+def migrate_csv_index(directory: str) -> None:
+    """
+    Convert a legacy `entity.csv` index with stringified embeddings into the
+    columnar format. The CSV file is kept as `entity.csv.bak`.
+    """
+    csv_path = os.path.join(directory, LEGACY_ENTITY_FILE)
+    logger.info(f"migrating {csv_path} to the columnar index format")
+
+    metadata, embeddings = split_entity(pd.read_csv(csv_path))
+    save_index(directory, metadata, embeddings)
+    os.replace(csv_path, f"{csv_path}.bak")
+
+
+def migrate_dense_index(directory: str) -> None:
+    """
+    Convert an index of format version 1, with a dense embedding tensor and
+    `keyword_{i}` metadata columns, into the ragged format.
+    """
+    logger.info(f"migrating {directory} to the ragged index format")
+    metadata = pd.read_parquet(os.path.join(directory, METADATA_FILE))
+    dense = np.load(os.path.join(directory, LEGACY_EMBEDDINGS_FILE), mmap_mode="r")
+    embeddings = RaggedEmbeddings.from_dense(dense)
+    metadata = _collapse_keywords(metadata, counts=embeddings.counts)
+    save_index(directory, metadata, embeddings)
+
+
+def migrate_ragged_index(directory: str) -> None:
+    """
+    Convert an index of format version 2, with one keyword vector per entity
+    keyword, into an index storing every distinct keyword once.
+    """
+    logger.info(f"migrating {directory} to the keyword vocabulary index format")
+    metadata = pd.read_parquet(os.path.join(directory, METADATA_FILE))
+    base, keywords, offsets = [
+        np.load(os.path.join(directory, name)) for name in RAGGED_EMBEDDING_FILES
+    ]
+    embeddings = RaggedEmbeddings(base=base, keywords=keywords, offsets=offsets)
+    save_index(directory, metadata, embeddings)
+
+
+def load_index(
+    directory: str, mmap: bool = True
+) -> Tuple[pd.DataFrame, RaggedEmbeddings]:
+    """
+    Load the metadata table and the ragged embeddings of an index, migrating
+    a legacy CSV index or an index of an older format first if needed. With
+    `mmap` the embedding arrays are memory mapped read-only instead of read
+    into memory.
+    """
+    if not os.path.isfile(os.path.join(directory, INFO_FILE)):
+        migrate_csv_index(directory)
+
+    info = read_index_info(directory)
+    if info["format_version"] == 1:
+        migrate_dense_index(directory)
+        info = read_index_info(directory)
+    if info["format_version"] == 2:
+        migrate_ragged_index(directory)
+        info = read_index_info(directory)
+    if info["format_version"] != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported index format version {info['format_version']} in {directory}"
+        )
+
+    metadata = pd.read_parquet(
+        os.path.join(directory, METADATA_FILE), memory_map=mmap
+    )
+    base, keywords, keyword_ids, offsets = [
+        np.load(os.path.join(directory, name), mmap_mode="r" if mmap else None)
+        for name in EMBEDDING_FILES
+    ]
+    return metadata, RaggedEmbeddings(
+        base=base, keywords=keywords, offsets=offsets, keyword_ids=keyword_ids
+    )
+
+
+def load_keyword_vocabulary(
+    directory: str, embeddings: RaggedEmbeddings
+) -> KeywordVocabulary:
+    """
+    Load the keyword vocabulary of an index over the keyword vectors of its
+    loaded embeddings, so keywords can be looked up without embedding them.
+    """
+    keywords = pd.read_parquet(os.path.join(directory, VOCABULARY_FILE))["keyword"]
+    return KeywordVocabulary(keywords.tolist(), vectors=embeddings.keywords)
@@ -0,0 +1,260 @@
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+
+# the name, definition and description vectors every entity has
+NUM_BASE_VECTORS = 3
+
+
+def keyword_counts(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Keyword counts of a dense `(N, 3 + K, D)` tensor, whose keywords fill
+    the slots after the first three from the left and missing ones are zero
+    vectors.
+    """
+    present = np.any(embeddings[:, NUM_BASE_VECTORS:] != 0, axis=2)
+    num_slots = present.shape[1]
+    last = num_slots - np.argmax(present[:, ::-1], axis=1)
+    return np.where(present.any(axis=1), last, 0).astype(np.int64)
+
+
+@dataclass
+class RaggedEmbeddings:
+    """
+    Embeddings of the entities with a variable number of keywords each.
+
+    `base` holds the `(N, 3, D)` function name, definition and description
+    vectors. `keywords` holds one `(V, D)` vector per distinct keyword and
+    entities refer to them by id: the keywords of entity `i` are
+    `keywords[keyword_ids[offsets[i]:offsets[i + 1]]]`. Memory grows with
+    the distinct keywords that exist, with no fixed keyword count. Without
+    `keyword_ids` every keyword vector belongs to one entity, in order.
+
+    Vectors are numbered in one flat space, the `3 * N` base vectors first
+    and the keyword vectors of the entities after them, a keyword used by
+    several entities numbered once per entity.
+    """
+
+    base: np.ndarray
+    keywords: np.ndarray
+    offsets: np.ndarray
+    keyword_ids: Optional[np.ndarray] = None
+
+    def __post_init__(self) -> None:
+        if self.keyword_ids is None:
+            self.keyword_ids = np.arange(len(self.keywords), dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.base)
+
+    @property
+    def dim(self) -> int:
+        return self.base.shape[2]
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.base.dtype
+
+    @property
+    def counts(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    @property
+    def num_vectors(self) -> int:
+        return self.base.shape[0] * self.base.shape[1] + int(
+            self.offsets[-1] - self.offsets[0]
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.base.nbytes
+            + self.keywords.nbytes
+            + self.offsets.nbytes
+            + self.keyword_ids.nbytes
+        )
+
+    @classmethod
+    def empty(cls, dim: int = 0, dtype=np.float32) -> "RaggedEmbeddings":
+        return cls(
+            base=np.zeros((0, NUM_BASE_VECTORS, dim), dtype=dtype),
+            keywords=np.zeros((0, dim), dtype=dtype),
+            offsets=np.zeros(1, dtype=np.int64),
+            keyword_ids=np.zeros(0, dtype=np.int64),
+        )
+
+    @classmethod
+    def from_dense(cls, embeddings: np.ndarray) -> "RaggedEmbeddings":
+        counts = keyword_counts(embeddings)
+        slots = np.arange(embeddings.shape[1] - NUM_BASE_VECTORS) < counts[:, None]
+        return cls(
+            base=np.ascontiguousarray(embeddings[:, :NUM_BASE_VECTORS]),
+            keywords=np.ascontiguousarray(embeddings[:, NUM_BASE_VECTORS:][slots]),
+            offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        )
+
+    @classmethod
+    def concatenate(cls, parts: Sequence["RaggedEmbeddings"]) -> "RaggedEmbeddings":
+        if not parts:
+            return cls.empty()
+        offsets = [np.zeros(1, dtype=np.int64)]
+        keyword_ids, num_keywords = [], 0
+        for part in parts:
+            offsets.append(part.offsets[1:] - part.offsets[0] + offsets[-1][-1])
+            keyword_ids.append(part.occurrence_ids() + num_keywords)
+            num_keywords += len(part.keywords)
+        return cls(
+            base=np.concatenate([part.base for part in parts]),
+            keywords=np.concatenate([part.keywords for part in parts]),
+            offsets=np.concatenate(offsets),
+            keyword_ids=np.concatenate(keyword_ids),
+        )
+
+    def to_dense(self, num_keywords: Optional[int] = None) -> np.ndarray:
+        """
+        The `(N, 3 + num_keywords, D)` tensor with missing keywords as zero
+        vectors, `num_keywords` defaulting to the most keywords of an entity.
+        """
+        counts = self.counts
+        if num_keywords is None:
+            num_keywords = int(counts.max(initial=0))
+        dense = np.zeros(
+            (len(self), NUM_BASE_VECTORS + num_keywords, self.dim), dtype=self.dtype
+        )
+        dense[:, :NUM_BASE_VECTORS] = self.base
+        kept = np.minimum(counts, num_keywords)
+        rows = np.repeat(np.arange(len(self)), kept)
+        slots = np.arange(len(rows)) - np.repeat(np.cumsum(kept) - kept, kept)
+        dense[rows, NUM_BASE_VECTORS + slots] = self.keywords[
+            self.keyword_ids[np.repeat(self.offsets[:-1], kept) + slots]
+        ]
+        return dense
+
+    def occurrence_ids(self) -> np.ndarray:
+        # the keyword id of every keyword of the entities, in order
+        return self.keyword_ids[self.offsets[0] : self.offsets[-1]]
+
+    def keyword_vectors(self) -> np.ndarray:
+        # one vector per keyword of the entities, repeating shared keywords
+        return self.keywords[self.occurrence_ids()]
+
+    def keyword_owners(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self)), self.counts)
+
+    def vectors(self, vector_ids: np.ndarray) -> np.ndarray:
+        """
+        Gather vectors by their number in the flat vector space.
+        """
+        vector_ids = np.asarray(vector_ids, dtype=np.int64)
+        num_base = self.base.shape[0] * self.base.shape[1]
+        vectors = np.empty((len(vector_ids), self.dim), dtype=self.dtype)
+        is_base = vector_ids < num_base
+        base_ids = vector_ids[is_base]
+        vectors[is_base] = self.base[
+            base_ids // NUM_BASE_VECTORS, base_ids % NUM_BASE_VECTORS
+        ]
+        vectors[~is_base] = self.keywords[
+            self.keyword_ids[self.offsets[0] + vector_ids[~is_base] - num_base]
+        ]
+        return vectors
+
+    def vector_owners(self) -> np.ndarray:
+        # the entity row of every vector of the flat vector space
+        return np.concatenate(
+            [
+                np.repeat(np.arange(len(self)), NUM_BASE_VECTORS),
+                self.keyword_owners(),
+            ]
+        )
+
+    def __getitem__(
+        self, rows: Union[int, slice, Sequence[int], np.ndarray]
+    ) -> "RaggedEmbeddings":
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(len(self))
+            if step == 1:
+                stop = max(start, stop)
+                return RaggedEmbeddings(
+                    base=self.base[start:stop],
+                    keywords=self.keywords,
+                    offsets=self.offsets[start : stop + 1] - self.offsets[start],
+                    keyword_ids=self.keyword_ids[
+                        self.offsets[start] : self.offsets[stop]
+                    ],
+                )
+            rows = np.arange(start, stop, step)
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        rows = np.where(rows < 0, rows + len(self), rows)
+
+        # gathering the keyword id segments of the rows at once, the keyword
+        # vectors are shared
+        starts, ends = self.offsets[rows], self.offsets[rows + 1]
+        lengths = ends - starts
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return RaggedEmbeddings(
+            base=self.base[rows],
+            keywords=self.keywords,
+            offsets=offsets,
+            keyword_ids=self.keyword_ids[positions],
+        )
+
+    def astype(self, dtype, copy: bool = True) -> "RaggedEmbeddings":
+        return RaggedEmbeddings(
+            base=self.base.astype(dtype, copy=copy),
+            keywords=self.keywords.astype(dtype, copy=copy),
+            offsets=self.offsets,
+            keyword_ids=self.keyword_ids,
+        )
+
+    def equals(self, other: "RaggedEmbeddings") -> bool:
+        return (
+            np.array_equal(self.base, other.base)
+            and np.array_equal(self.counts, other.counts)
+            and np.array_equal(self.keyword_vectors(), other.keyword_vectors())
+        )
+
+
+def as_ragged(embeddings: Union[np.ndarray, RaggedEmbeddings]) -> RaggedEmbeddings:
+    if isinstance(embeddings, RaggedEmbeddings):
+        return embeddings
+    return RaggedEmbeddings.from_dense(np.asarray(embeddings))
+
+
+def segment_top2(
+    first: np.ndarray, second: np.ndarray, offsets: np.ndarray
+) -> List[np.ndarray]:
+    """
+    The two highest values of every segment of rows, given the highest and
+    second highest value of every row as `(M, C)` arrays. Segment `i` is the
+    rows `offsets[i] - offsets[0]` up to `offsets[i + 1] - offsets[0]`, and
+    both results are `(len(offsets) - 1, C)` with -inf for empty segments.
+    """
+    num_segments, num_columns = len(offsets) - 1, first.shape[1]
+    top1 = np.full((num_segments, num_columns), -np.inf, dtype=first.dtype)
+    top2 = np.full((num_segments, num_columns), -np.inf, dtype=first.dtype)
+    counts = np.diff(offsets)
+    non_empty = counts > 0
+    if not non_empty.any():
+        return [top1, top2]
+
+    starts = offsets[:-1][non_empty] - offsets[0]
+    best = np.maximum.reduceat(first, starts, axis=0)
+
+    # dropping the first occurrence of every segment's best value, what is
+    # left holds the segment's second best value
+    rows = np.arange(len(first))[:, None]
+    is_best = first == np.repeat(best, counts[non_empty], axis=0)
+    best_rows = np.minimum.reduceat(
+        np.where(is_best, rows, len(first)), starts, axis=0
+    )
+    rest = first.copy()
+    rest[best_rows, np.arange(num_columns)] = -np.inf
+
+    top1[non_empty] = best
+    top2[non_empty] = np.maximum(
+        np.maximum.reduceat(rest, starts, axis=0),
+        np.maximum.reduceat(second, starts, axis=0),
+    )
+    return [top1, top2]
@@ -0,0 +1,127 @@
+import hashlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .ragged import RaggedEmbeddings
+
+
+class KeywordVocabulary:
+    """
+    The distinct keywords of an index, numbered in the order they are first
+    seen. Keyword `i` has the vector `vectors[i]`, the keyword rows of the
+    index's ragged embeddings.
+
+    Keywords are told apart by their text. Keywords without text, as in
+    indexes migrated from files that lost it, are told apart by their vector.
+    """
+
+    def __init__(
+        self,
+        keywords: Sequence[Optional[str]] = (),
+        vectors: Optional[np.ndarray] = None,
+    ) -> None:
+        self.keywords: List[Optional[str]] = []
+        self.vectors = vectors
+        self.ids: Dict[str, int] = {}
+        # ids of keywords without text by the bytes of their vector
+        self._unnamed: Dict[bytes, int] = {}
+        self._fingerprint: Optional[str] = None
+        for keyword in keywords:
+            if keyword:
+                self.ids.setdefault(keyword, len(self.keywords))
+            self.keywords.append(keyword or None)
+
+    def __len__(self) -> int:
+        return len(self.keywords)
+
+    def __contains__(self, keyword: str) -> bool:
+        return keyword in self.ids
+
+    def fingerprint(self) -> str:
+        """
+        Hash of the keywords in order, which changes whenever a keyword is
+        added or the index is rebuilt with other keywords.
+        """
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            for keyword in self.keywords:
+                digest.update(f"{keyword or ''}\0".encode())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def get(self, keyword: str) -> Optional[int]:
+        return self.ids.get(keyword)
+
+    def vector(self, keyword: str) -> Optional[np.ndarray]:
+        keyword_id = self.ids.get(keyword)
+        if keyword_id is None or self.vectors is None:
+            return None
+        return np.asarray(self.vectors[keyword_id], dtype=np.float32)
+
+    def add(
+        self, keywords: Sequence[Optional[str]], vectors: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Number keyword occurrences with the `(M, D)` float32 `vectors`,
+        adding the keywords not in the vocabulary yet. Returns the keyword id
+        of every occurrence and the positions of the occurrences that added
+        a keyword, whose vectors are the vocabulary's new rows.
+        """
+        keyword_ids = np.empty(len(keywords), dtype=np.int64)
+        added = []
+        self._fingerprint = None
+        for position, keyword in enumerate(keywords):
+            if keyword:
+                table, key = self.ids, keyword
+            else:
+                table, key = self._unnamed, vectors[position].tobytes()
+            keyword_id = table.get(key)
+            if keyword_id is None:
+                keyword_id = table[key] = len(self.keywords)
+                self.keywords.append(keyword or None)
+                added.append(position)
+            keyword_ids[position] = keyword_id
+        return keyword_ids, np.array(added, dtype=np.int64)
+
+
+def occurrence_keywords(
+    metadata: pd.DataFrame, counts: np.ndarray
+) -> List[Optional[str]]:
+    """
+    The text of every keyword occurrence from the `keywords` list column of
+    the metadata, None for rows whose list doesn't match their keyword count.
+    """
+    if "keywords" not in metadata.columns:
+        return [None] * int(np.sum(counts))
+    keywords = []
+    for row, count in zip(metadata["keywords"], counts):
+        if isinstance(row, (list, tuple, np.ndarray)) and len(row) == count:
+            keywords.extend(
+                keyword if isinstance(keyword, str) else None for keyword in row
+            )
+        else:
+            keywords.extend([None] * int(count))
+    return keywords
+
+
+def deduplicate_keywords(
+    metadata: pd.DataFrame, embeddings: RaggedEmbeddings
+) -> Tuple[RaggedEmbeddings, KeywordVocabulary]:
+    """
+    Store every distinct keyword of the rows once, returning the embeddings
+    over the distinct keyword vectors and their vocabulary.
+    """
+    vocabulary = KeywordVocabulary()
+    vectors = np.ascontiguousarray(embeddings.keyword_vectors(), dtype=np.float32)
+    keyword_ids, added = vocabulary.add(
+        occurrence_keywords(metadata, embeddings.counts), vectors
+    )
+    deduplicated = RaggedEmbeddings(
+        base=embeddings.base,
+        keywords=vectors[added].reshape(-1, embeddings.dim),
+        offsets=embeddings.offsets - embeddings.offsets[0],
+        keyword_ids=keyword_ids,
+    )
+    return deduplicated, vocabulary
@@ -0,0 +1,218 @@
+import os
+import shutil
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .columnar import (
+    BASE_EMBEDDINGS_FILE,
+    EMBEDDING_FILES,
+    KEYWORD_EMBEDDINGS_FILE,
+    KEYWORD_IDS_FILE,
+    KEYWORD_OFFSETS_FILE,
+    METADATA_FILE,
+    commit_index,
+    index_info,
+)
+from .ragged import NUM_BASE_VECTORS, RaggedEmbeddings, as_ragged
+from .vocabulary import KeywordVocabulary, occurrence_keywords
+
+STAGING_DIRECTORY = "staging"
+BASE_FILE = "base.f32"
+KEYWORDS_FILE = "keywords.f32"
+ASSEMBLY_BLOCK_SIZE = 4096
+
+
+class IndexWriter:
+    """
+    Append-only writer of index rows.
+
+    Rows are appended in their final order and their embeddings go straight
+    to raw files under `.lattice/staging`, the fixed name, definition and
+    description vectors in one and the vectors of keywords not seen before
+    in another, so the keyword count of the index doesn't need to be known up
+    front. Rows refer to their keywords by id in the keyword vocabulary the
+    writer builds. The metadata is written next to the index's metadata file
+    one row group per append. `finalize` copies the embedding files into the
+    index's block by block, so only the keyword ids are held in memory while
+    rows are appended, and `commit` swaps the new index in, together with the
+    files written to `staged_path`.
+    """
+
+    def __init__(self, directory: str, columns: Optional[List[str]] = None) -> None:
+        self.directory = directory
+        # the metadata columns of an index without rows
+        self.columns = columns or ["id"]
+        self.staging_path = os.path.join(directory, STAGING_DIRECTORY)
+        shutil.rmtree(self.staging_path, ignore_errors=True)
+        os.makedirs(self.staging_path)
+
+        self.dim: Optional[int] = None
+        self._info: Optional[dict] = None
+        self.metadata_path = os.path.join(directory, f"{METADATA_FILE}.tmp")
+        self._metadata: Optional[pq.ParquetWriter] = None
+        self.keyword_counts: List[np.ndarray] = []
+        self.keyword_ids: List[np.ndarray] = []
+        self.vocabulary = KeywordVocabulary()
+        # files built from the rows, swapped in by `commit`
+        self.staged_files: List[str] = []
+        self._base = open(os.path.join(self.staging_path, BASE_FILE), "wb")
+        self._keywords = open(os.path.join(self.staging_path, KEYWORDS_FILE), "wb")
+
+    @property
+    def num_rows(self) -> int:
+        return sum(len(counts) for counts in self.keyword_counts)
+
+    def append(
+        self,
+        metadata: pd.DataFrame,
+        embeddings: Union[np.ndarray, RaggedEmbeddings],
+    ) -> None:
+        if len(metadata) == 0:
+            return
+        embeddings = as_ragged(embeddings)
+        if self.dim is None:
+            self.dim = embeddings.dim
+        elif embeddings.dim != self.dim:
+            raise ValueError(
+                f"Embedding dimension {embeddings.dim} doesn't match {self.dim}"
+            )
+
+        base = np.ascontiguousarray(embeddings.base, dtype=np.float32)
+        keywords = np.ascontiguousarray(embeddings.keyword_vectors(), dtype=np.float32)
+        keyword_ids, added = self.vocabulary.add(
+            occurrence_keywords(metadata, embeddings.counts), keywords
+        )
+        self._base.write(base.tobytes())
+        self._keywords.write(keywords[added].tobytes())
+        self._write_metadata(metadata)
+        self.keyword_counts.append(embeddings.counts)
+        self.keyword_ids.append(keyword_ids)
+
+    def _write_metadata(self, metadata: pd.DataFrame) -> None:
+        # the columns of the writer come first, and the schema of the first
+        # rows is kept for all of them
+        columns = [
+            *self.columns,
+            *(column for column in metadata.columns if column not in self.columns),
+        ]
+        metadata = metadata.reindex(columns=columns).astype({"id": str})
+        if self._metadata is None:
+            schema = _without_null_types(
+                pa.Schema.from_pandas(metadata, preserve_index=False)
+            )
+            self._metadata = pq.ParquetWriter(self.metadata_path, schema)
+        table = pa.Table.from_pandas(
+            metadata, schema=self._metadata.schema, preserve_index=False
+        )
+        self._metadata.write_table(table)
+
+    def _close_metadata(self) -> None:
+        if self._metadata is not None:
+            self._metadata.close()
+            self._metadata = None
+
+    def _copy_staged(self, name: str, staged_name: str, shape: tuple) -> None:
+        # copying a staged raw file into a `.npy` file block by block to keep
+        # memory flat
+        path = os.path.join(self.directory, name)
+        target = np.lib.format.open_memmap(
+            f"{path}.tmp", mode="w+", dtype=np.float32, shape=shape
+        )
+        if target.size:
+            staged = np.memmap(
+                os.path.join(self.staging_path, staged_name),
+                dtype=np.float32,
+                mode="r",
+                shape=shape,
+            )
+            for start in range(0, shape[0], ASSEMBLY_BLOCK_SIZE):
+                target[start : start + ASSEMBLY_BLOCK_SIZE] = staged[
+                    start : start + ASSEMBLY_BLOCK_SIZE
+                ]
+            del staged
+        target.flush()
+        del target
+
+    def finalize(self) -> Tuple[pd.DataFrame, RaggedEmbeddings]:
+        """
+        Write the embedding files of the appended rows next to the index and
+        return the metadata, read back from its file, and the memory mapped
+        embeddings. Nothing replaces the current index before `commit`.
+        """
+        self._base.close()
+        self._keywords.close()
+
+        if self._metadata is None:
+            pd.DataFrame(columns=self.columns).to_parquet(
+                self.metadata_path, index=False
+            )
+        self._close_metadata()
+        metadata = pd.read_parquet(self.metadata_path, memory_map=True)
+        counts = (
+            np.concatenate(self.keyword_counts)
+            if self.keyword_counts
+            else np.zeros(0, dtype=np.int64)
+        )
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        keyword_ids = np.concatenate([np.zeros(0, dtype=np.int64), *self.keyword_ids])
+        num_rows, dim = len(counts), self.dim or 0
+
+        self._copy_staged(
+            BASE_EMBEDDINGS_FILE, BASE_FILE, (num_rows, NUM_BASE_VECTORS, dim)
+        )
+        self._copy_staged(
+            KEYWORD_EMBEDDINGS_FILE, KEYWORDS_FILE, (len(self.vocabulary), dim)
+        )
+        arrays = [(KEYWORD_IDS_FILE, keyword_ids), (KEYWORD_OFFSETS_FILE, offsets)]
+        for name, array in arrays:
+            with open(os.path.join(self.directory, f"{name}.tmp"), "wb") as f:
+                np.save(f, array)
+
+        base, keywords, keyword_ids, offsets = [
+            np.load(os.path.join(self.directory, f"{name}.tmp"), mmap_mode="r")
+            for name in EMBEDDING_FILES
+        ]
+        embeddings = RaggedEmbeddings(
+            base=base, keywords=keywords, offsets=offsets, keyword_ids=keyword_ids
+        )
+        self._info = index_info(embeddings)
+        return metadata, embeddings
+
+    def staged_path(self, name: str) -> str:
+        """
+        The path to write a file built from the rows to, such as a search
+        index, which `commit` moves to `name` along with the index.
+        """
+        self.staged_files.append(name)
+        return os.path.join(self.directory, f"{name}.tmp")
+
+    def commit(self) -> None:
+        commit_index(
+            self.directory, None, self._info, self.vocabulary, self.staged_files
+        )
+        shutil.rmtree(self.staging_path, ignore_errors=True)
+
+    def abort(self) -> None:
+        self._base.close()
+        self._keywords.close()
+        self._close_metadata()
+        shutil.rmtree(self.staging_path, ignore_errors=True)
+        for name in [*EMBEDDING_FILES, METADATA_FILE, *self.staged_files]:
+            path = os.path.join(self.directory, f"{name}.tmp")
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+def _without_null_types(schema: pa.Schema) -> pa.Schema:
+    # columns whose first rows hold no values at all are typed as strings, so
+    # that later rows with values can be written
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, field.with_type(pa.string()))
+        elif pa.types.is_list(field.type) and pa.types.is_null(field.type.value_type):
+            schema = schema.set(i, field.with_type(pa.list_(pa.string())))
+    return schema
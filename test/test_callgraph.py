@@ -0,0 +1,118 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.lattice.compiler.callgraph import SymbolTable, build_call_graph
+from src.lattice.compiler.digest import iterate_over_functions_project
+
+FILES = {
+    "pkg/__init__.py": "from .util import helper\n",
+    "pkg/util.py": """\
+def helper(x):
+    return x
+
+
+class Base:
+    def run(self):
+        return self.step()
+
+    def step(self):
+        return helper(1)
+
+
+class Child(Base):
+    def __init__(self):
+        self.value = len([])
+
+    def go(self):
+        def inner():
+            return helper(2)
+
+        return self.run() + inner()
+""",
+    "main.py": """\
+import pkg
+from pkg import util as u
+from pkg import helper
+
+
+def main():
+    child = u.Child()
+    child.go()
+    pkg.helper(3)
+    print(helper(4), unknown())
+""",
+}
+
+
+def write_files(directory: str) -> list:
+    file_paths = []
+    for name, source in FILES.items():
+        path = os.path.join(directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(source)
+        file_paths.append(path)
+    return file_paths
+
+
+class TestCallGraph(unittest.TestCase):
+    def test_calls_are_resolved_across_modules(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            file_paths = write_files(directory)
+            symbols, graph = build_call_graph(file_paths, directory)
+
+        names = [symbol.qualname for symbol in symbols]
+        calls = {
+            (names[source], names[target], line)
+            for source in range(graph.num_functions)
+            for target, line in zip(
+                graph.callees(source),
+                graph.line_numbers[graph.indptr[source] : graph.indptr[source + 1]],
+            )
+        }
+        self.assertEqual(
+            calls,
+            {
+                ("main", "Child.__init__", 7),
+                ("main", "helper", 9),
+                ("main", "helper", 10),
+                ("Base.run", "Base.step", 7),
+                ("Base.step", "helper", 10),
+                ("Child.go", "Base.run", 21),
+                ("Child.go", "Child.go.inner", 21),
+                ("Child.go.inner", "helper", 19),
+            },
+        )
+        self.assertEqual(graph.num_edges, len(calls))
+
+    def test_compiled_symbols_match_parsed_files(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            file_paths = write_files(directory)
+            expected_symbols, expected = build_call_graph(file_paths, directory)
+
+            for workers in [1, 2]:
+                call_symbols = SymbolTable()
+                list(
+                    iterate_over_functions_project(
+                        directory, workers=workers, call_symbols=call_symbols
+                    )
+                )
+                compiled = list(call_symbols.files)
+                self.assertEqual(sorted(compiled), sorted(file_paths))
+                _, parsed = build_call_graph(compiled, directory)
+                symbols, graph = build_call_graph(
+                    file_paths, directory, call_symbols
+                )
+
+                self.assertEqual(
+                    sorted(symbol.qualname for symbol in symbols),
+                    sorted(symbol.qualname for symbol in expected_symbols),
+                )
+                self.assertEqual(graph.num_edges, expected.num_edges)
+                for name in ["indptr", "targets", "line_numbers"]:
+                    np.testing.assert_array_equal(
+                        getattr(graph, name), getattr(parsed, name)
+                    )
@@ -0,0 +1,56 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from click.testing import CliRunner
+
+from src.lattice.cli.main import lattice
+from src.lattice.compiler.digest import iterate_over_functions_project
+from src.lattice.indexer.local import index_project
+from test.test_indexer import FakeEmbeddingClient, FakeLLMClient
+
+
+class TestSearch(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.project_path = os.path.join(self.directory.name, "project")
+        shutil.copytree("test/props/example_directory", self.project_path)
+        self.clients = {
+            "llm": {"client": FakeLLMClient(), "model": "llm"},
+            "embedding": {"client": FakeEmbeddingClient(), "model": "embedding"},
+        }
+        compiler_iter = iterate_over_functions_project(self.project_path)
+        index_project(compiler_iter, self.project_path, self.clients)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def search(self, *args: str):
+        with mock.patch(
+            "src.lattice.cli.main.get_ai_clients", return_value=self.clients
+        ):
+            return CliRunner().invoke(
+                lattice, ["search", self.project_path, "split words", *args]
+            )
+
+    def test_json_results_are_ranked(self) -> None:
+        result = self.search("--top-k", "3", "--json")
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        body = json.loads(result.output)
+        self.assertEqual(body["query"], "split words")
+        self.assertEqual(len(body["results"]), 3)
+        for entry in body["results"]:
+            self.assertEqual(
+                set(entry),
+                {"id", "function_name", "description", "definition", "scores"},
+            )
+        scores = [entry["scores"]["embedding"] for entry in body["results"]]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_top_k_must_be_positive(self) -> None:
+        result = self.search("--top-k", "0")
+        self.assertNotEqual(result.exit_code, 0)
@@ -1,3 +1,6 @@
+import os
+import tempfile
+import time
 import unittest
 import jedi
 
@@ -8,6 +11,7 @@ from src.lattice.compiler.digest import (
     iterate_over_functions_script,
     iterate_over_functions_project,
 )
+from src.lattice.compiler.source import SourceMap, get_source_map
 
 
 class TestDigest(unittest.TestCase):
@@ -59,9 +63,53 @@ class TestDigest(unittest.TestCase):
         for f in iterate_over_functions_project("test/props/example_directory"):
             self.assertIn(f.name, true_names)
 
+    def test_parallel_compile_matches_sequential(self) -> None:
+        sequential = list(iterate_over_functions_project("test/props"))
+        for workers, chunk_size in [(2, 1), (3, 2)]:
+            parallel = list(
+                iterate_over_functions_project(
+                    "test/props", workers=workers, chunk_size=chunk_size
+                )
+            )
+            self.assertEqual(parallel, sequential)
+
     def test_literal_to_standard(self) -> None:
         definition = "def main(*args):\n    print(sum(args))"
         semantic = literal_to_standard(definition)
 
         true_semantic = "def main(*args):\n    sum_args = sum(args)\n   print(sum_args)"
         self.assertEqual(semantic, true_semantic)
+
+
+class TestSourceMap(unittest.TestCase):
+    def test_read_matches_splitlines(self) -> None:
+        sources = [
+            "",
+            "a",
+            "a\nb\n",
+            "a\r\nb\r\n\nc",
+            "def f():\n    return 1\n\n\ndef g():\n    pass",
+        ]
+        for source in sources:
+            source_map = SourceMap(source)
+            lines = source.splitlines()
+            for start_line in range(1, len(lines) + 2):
+                for end_line in range(start_line - 1, len(lines) + 2):
+                    self.assertEqual(
+                        source_map.read(start_line, end_line),
+                        "\n".join(lines[start_line - 1 : end_line]),
+                    )
+
+    def test_source_map_is_cached_until_file_changes(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "script.py")
+            with open(path, "w") as f:
+                f.write("def f():\n    pass\n")
+
+            source_map = get_source_map(path)
+            self.assertIs(get_source_map(path), source_map)
+
+            with open(path, "w") as f:
+                f.write("def g():\n    return 1\n")
+            os.utime(path, ns=(time.time_ns(), time.time_ns() + 10**9))
+            self.assertEqual(get_source_map(path).read(1, 2), "def g():\n    return 1")
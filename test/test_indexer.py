@@ -0,0 +1,654 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from src.lattice.compiler.callgraph import (
+    CALL_GRAPH_FILE,
+    RELATIONSHIP_FILE,
+    SymbolTable,
+    load_call_graph,
+    relationship_frame,
+)
+from src.lattice.compiler.digest import iterate_over_functions_project
+from src.lattice.indexer.local import index, index_async, index_project
+from src.lattice.llm.parsing import LLMResponseError
+from src.lattice.retrieve import prompts
+from src.lattice.retrieve.retriever import get_query_embeddings
+from src.lattice.storage import (
+    IndexWriter,
+    KeywordVocabulary,
+    RaggedEmbeddings,
+    has_index,
+    load_index,
+    load_keyword_vocabulary,
+)
+
+
+def fake_embedding(text: str, dim: int = 8) -> list:
+    digest = hashlib.sha256(text.encode()).digest()
+    return [float(b) + 1.0 for b in digest[:dim]]
+
+
+class FakeLLMClient:
+    def __init__(self, malformed: int = 0) -> None:
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self.requests = 0
+        self.prompts = []
+        # number of replies to break before answering properly
+        self.malformed = malformed
+
+    def create(self, model, messages, **kwargs):
+        self.requests += 1
+        prompt = messages[0]["content"]
+        self.prompts.append(prompt)
+        if self.malformed:
+            self.malformed -= 1
+            content = "Sure! {'description': 'unfinished"
+        elif '"description_keywords"' in prompt and (
+            '"description":' in prompt or "can't be parsed" in prompt
+        ):
+            words = sorted(set(prompt.split()[-12:]))[:10]
+            reply = {
+                "description": f"describes {len(prompt)}",
+                "description_keywords": words,
+            }
+            content = f"```json\n{json.dumps(reply)}\n```"
+        elif '"description_keywords"' in prompt:
+            words = sorted(set(prompt.split()[-12:]))[:10]
+            content = json.dumps({"description_keywords": words})
+        else:
+            content = json.dumps({"description": f"describes {len(prompt)}"})
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class FakeEmbeddingClient:
+    def __init__(self) -> None:
+        self.embeddings = SimpleNamespace(create=self.create)
+        self.requests = 0
+        self.inputs = []
+
+    def create(self, input, model, **kwargs):
+        self.requests += 1
+        self.inputs.append(list(input))
+        data = [SimpleNamespace(embedding=fake_embedding(text)) for text in input]
+        return SimpleNamespace(data=data)
+
+
+def make_entity() -> pd.DataFrame:
+    return pd.DataFrame.from_dict(
+        data={
+            "id": ["a", "b", "c"],
+            "function_name": ["main", "parse", "plot"],
+            "namespace": ["project.default"] * 3,
+            "definition": [
+                "def main(*args):\n    print(sum(args))",
+                "def parse(text):\n    return text.split()",
+                "def plot(values):\n    return histogram(values)",
+            ],
+        }
+    )
+
+
+class TestIndexer(unittest.TestCase):
+    def setUp(self) -> None:
+        self.kwargs = dict(
+            description_extraction_prompt_template=prompts.description_extraction,
+            keyword_extraction_prompt_template=prompts.keyword_extraction,
+            together_llm_client=FakeLLMClient(),
+            together_llm_model_name="llm",
+            together_embedding_client=FakeEmbeddingClient(),
+            together_embedding_model_name="embedding",
+        )
+
+    def test_async_index_matches_sequential(self) -> None:
+        sequential = index(entity=make_entity(), **self.kwargs)
+        concurrent = asyncio.run(
+            index_async(entity=make_entity(), concurrency=4, **self.kwargs)
+        )
+
+        self.assertEqual(sequential.to_csv(index=False), concurrent.to_csv(index=False))
+
+    def test_index_batches_embedding_requests(self) -> None:
+        client = self.kwargs["together_embedding_client"]
+        entity = index(entity=make_entity(), batch_size=64, **self.kwargs)
+
+        # names, definitions, descriptions and keywords each fit in one batch
+        self.assertEqual(client.requests, 4)
+        self.assertEqual(entity["keyword_9_embedding"].notna().sum(), 3)
+
+    def test_keywords_are_embedded_once(self) -> None:
+        client = self.kwargs["together_embedding_client"]
+        entity = index(entity=make_entity(), batch_size=64, **self.kwargs)
+        keywords = entity[[f"keyword_{i}" for i in range(10)]].stack().tolist()
+        # the last request embeds every distinct keyword once
+        self.assertLess(len(set(keywords)), len(keywords))
+        self.assertEqual(sorted(client.inputs[-1]), sorted(set(keywords)))
+
+        # keywords the vocabulary holds aren't embedded at all
+        client.requests = 0
+        vectors = np.array([fake_embedding(keyword) for keyword in keywords])
+        vocabulary = KeywordVocabulary(keywords, vectors=vectors)
+        again = index(
+            entity=make_entity(),
+            batch_size=64,
+            keyword_vocabulary=vocabulary,
+            **self.kwargs,
+        )
+        self.assertEqual(client.requests, 3)
+        self.assertEqual(again["keyword_0"].tolist(), entity["keyword_0"].tolist())
+        self.assertEqual(again["keyword_0_embedding"][0], vectors[0].tolist())
+
+    def test_single_call_makes_one_request_per_function(self) -> None:
+        client = self.kwargs["together_llm_client"]
+        prompt = prompts.description_and_keyword_extraction
+        entity = index(
+            entity=make_entity(),
+            description_and_keyword_extraction_prompt_template=prompt,
+            **self.kwargs,
+        )
+
+        self.assertEqual(client.requests, 3)
+        self.assertTrue(entity["description"].str.startswith("describes").all())
+        self.assertEqual(entity["keyword_9_embedding"].notna().sum(), 3)
+
+    def test_single_call_repairs_malformed_responses(self) -> None:
+        self.kwargs["together_llm_client"] = client = FakeLLMClient(malformed=1)
+        entity = index(
+            entity=make_entity(),
+            description_and_keyword_extraction_prompt_template=(
+                prompts.description_and_keyword_extraction
+            ),
+            **self.kwargs,
+        )
+
+        # one extra request repairs the first reply
+        self.assertEqual(client.requests, 4)
+        self.assertEqual(entity["keyword_9_embedding"].notna().sum(), 3)
+
+        client.malformed = 2
+        with self.assertRaises(LLMResponseError):
+            index(
+                entity=make_entity().iloc[:1],
+                description_and_keyword_extraction_prompt_template=(
+                    prompts.description_and_keyword_extraction
+                ),
+                **self.kwargs,
+            )
+
+    def test_docstring_fast_path_skips_description_requests(self) -> None:
+        client = self.kwargs["together_llm_client"]
+        documented = (
+            "    def mean(values):\n"
+            '        """\n'
+            "        Average of the values, ignoring the missing ones.\n\n"
+            "        Parameters\n"
+            "        ----------\n"
+            "        values : list\n"
+            '        """\n'
+            "        return sum(values) / len(values)"
+        )
+        entity = make_entity()
+        entity.loc[0, "definition"] = documented
+        stats = {}
+        entity = index(
+            entity=entity, docstring_min_words=7, stats=stats, **self.kwargs
+        )
+
+        # the documented function only asks for its keywords
+        self.assertEqual(client.requests, 5)
+        self.assertEqual(stats, {"llm_calls_saved": 1})
+        self.assertTrue(entity.loc[0, "description"].startswith("main: Average"))
+        self.assertIn("    def mean(values):\n        return sum", client.prompts[0])
+        self.assertNotIn("missing ones", client.prompts[0].rsplit("Code:")[-1])
+
+        # summaries that are too short go to the LLM without the docstring
+        client.requests = 0
+        index(entity=make_entity().iloc[:1], docstring_min_words=8, **self.kwargs)
+        self.assertEqual(client.requests, 2)
+
+
+class TestIndexProject(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.project_path = os.path.join(self.directory.name, "project")
+        shutil.copytree("test/props/example_directory", self.project_path)
+        self.clients = {
+            "llm": {"client": FakeLLMClient(), "model": "llm"},
+            "embedding": {"client": FakeEmbeddingClient(), "model": "embedding"},
+        }
+        self.index_path = os.path.join(self.project_path, ".lattice")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def index_project(self, **kwargs) -> dict:
+        compiler_iter = iterate_over_functions_project(self.project_path)
+        return index_project(compiler_iter, self.project_path, self.clients, **kwargs)
+
+    def test_reindexing_only_touches_changed_functions(self) -> None:
+        summary = self.index_project()
+        self.assertEqual(
+            summary,
+            {
+                "indexed": 3,
+                "reused": 0,
+                "resumed": 0,
+                "removed": 0,
+                "llm_calls_saved": 0,
+            },
+        )
+        first, first_embeddings = load_index(self.index_path, mmap=False)
+
+        summary = self.index_project()
+        self.assertEqual(
+            summary,
+            {
+                "indexed": 0,
+                "reused": 3,
+                "resumed": 0,
+                "removed": 0,
+                "llm_calls_saved": 0,
+            },
+        )
+        second, second_embeddings = load_index(self.index_path, mmap=False)
+        self.assertTrue(first.equals(second))
+        self.assertTrue(first_embeddings.equals(second_embeddings))
+
+        # changing one function and deleting another
+        script_path = os.path.join(
+            self.project_path, "example_child", "example_deep_script.py"
+        )
+        with open(script_path) as f:
+            source = f.read()
+        with open(script_path, "w") as f:
+            f.write(source.replace("positive = []", "positive = list()"))
+        os.remove(os.path.join(self.project_path, "example_script.py"))
+
+        summary = self.index_project()
+        self.assertEqual(
+            summary,
+            {
+                "indexed": 1,
+                "reused": 1,
+                "resumed": 0,
+                "removed": 1,
+                "llm_calls_saved": 0,
+            },
+        )
+        second, second_embeddings = load_index(self.index_path, mmap=False)
+        self.assertEqual(second["id"].tolist(), first["id"].tolist()[1:])
+        self.assertTrue(second_embeddings[0].equals(first_embeddings[1]))
+        self.assertFalse(second_embeddings[1].equals(first_embeddings[2]))
+
+    def test_failed_commit_keeps_the_search_indexes_of_the_index(self) -> None:
+        self.index_project(ann_lists=2)
+        names = ["bm25.npz", CALL_GRAPH_FILE, RELATIONSHIP_FILE, "ann.npz"]
+
+        def read_all() -> list:
+            contents = []
+            for name in names:
+                with open(os.path.join(self.index_path, name), "rb") as f:
+                    contents.append(f.read())
+            return contents
+
+        indexes = read_all()
+        # an in-place edit keeps the row count the search indexes are checked by
+        script_path = os.path.join(
+            self.project_path, "example_child", "example_deep_script.py"
+        )
+        with open(script_path) as f:
+            source = f.read()
+        with open(script_path, "w") as f:
+            f.write(source.replace("positive = []", "positive = list()"))
+
+        path = "src.lattice.indexer.local.IndexWriter.commit"
+        with mock.patch(path, side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.index_project(ann_lists=2)
+        self.assertEqual(read_all(), indexes)
+        self.assertFalse(
+            [name for name in os.listdir(self.index_path) if name.endswith(".tmp")]
+        )
+
+    def test_pipeline_batches_do_not_change_the_index(self) -> None:
+        self.index_project()
+        expected, expected_embeddings = load_index(self.index_path, mmap=False)
+
+        # re-indexing with one function per batch, the middle one changed
+        script_path = os.path.join(
+            self.project_path, "example_child", "example_deep_script.py"
+        )
+        with open(script_path) as f:
+            source = f.read()
+        with open(script_path, "w") as f:
+            f.write(source.replace("positive = []", "positive = list()"))
+        summary = self.index_project(batch_size=1)
+        self.assertEqual(
+            summary,
+            {
+                "indexed": 1,
+                "reused": 2,
+                "resumed": 0,
+                "removed": 0,
+                "llm_calls_saved": 0,
+            },
+        )
+        metadata, embeddings = load_index(self.index_path, mmap=False)
+
+        changed = metadata["definition"] != expected["definition"]
+        self.assertEqual(changed.tolist(), [False, False, True])
+        self.assertEqual(metadata["id"].tolist(), expected["id"].tolist())
+        self.assertTrue(embeddings[:2].equals(expected_embeddings[:2]))
+        self.assertFalse(
+            os.path.exists(os.path.join(self.index_path, "staging"))
+        )
+
+    def test_enrichment_starts_with_the_first_function(self) -> None:
+        llm = self.clients["llm"]["client"]
+        create = llm.chat.completions.create
+        requested = threading.Event()
+
+        def create_and_signal(*args, **kwargs):
+            requested.set()
+            return create(*args, **kwargs)
+
+        llm.chat.completions.create = create_and_signal
+        functions = list(iterate_over_functions_project(self.project_path))
+
+        def slow_compiler():
+            # the rest of the project only compiles once the LLM was asked
+            yield functions[0]
+            self.assertTrue(requested.wait(timeout=10))
+            yield from functions[1:]
+
+        summary = index_project(slow_compiler(), self.project_path, self.clients)
+        self.assertEqual(summary["indexed"], 3)
+
+    def test_failed_run_keeps_previous_index(self) -> None:
+        self.index_project()
+        expected, _ = load_index(self.index_path, mmap=False)
+
+        def fail(*args, **kwargs):
+            raise RuntimeError("rate limited")
+
+        self.clients["llm"]["client"].chat.completions.create = fail
+        with open(os.path.join(self.project_path, "new.py"), "w") as f:
+            f.write("def new(x):\n    return x\n")
+        with self.assertRaises(RuntimeError):
+            self.index_project()
+
+        metadata, _ = load_index(self.index_path, mmap=False)
+        self.assertTrue(metadata.equals(expected))
+        self.assertEqual(
+            sorted(os.listdir(self.index_path)),
+            sorted(
+                name
+                for name in os.listdir(self.index_path)
+                if not name.endswith(".tmp") and name != "staging"
+            ),
+        )
+
+    def test_resume_skips_checkpointed_functions(self) -> None:
+        llm_client = self.clients["llm"]["client"]
+        create = llm_client.chat.completions.create
+        calls = []
+
+        def fail_after_first_function(*args, **kwargs):
+            # two calls describe one function
+            if len(calls) == 2:
+                raise ValueError("bad JSON reply")
+            calls.append(1)
+            return create(*args, **kwargs)
+
+        llm_client.chat.completions.create = fail_after_first_function
+        with self.assertRaises(ValueError):
+            self.index_project(batch_size=1)
+        self.assertFalse(has_index(self.index_path))
+
+        llm_client.chat.completions.create = create
+        summary = self.index_project(resume=True)
+        self.assertEqual(
+            summary,
+            {
+                "indexed": 2,
+                "reused": 0,
+                "resumed": 1,
+                "removed": 0,
+                "llm_calls_saved": 0,
+            },
+        )
+        self.assertFalse(
+            os.path.exists(os.path.join(self.index_path, "checkpoint"))
+        )
+
+        # the resumed index is the same as one built in a single run
+        metadata, embeddings = load_index(self.index_path, mmap=False)
+        shutil.rmtree(self.index_path)
+        self.index_project()
+        expected, expected_embeddings = load_index(self.index_path, mmap=False)
+        self.assertTrue(
+            metadata.drop(columns="id").equals(expected.drop(columns="id"))
+        )
+        self.assertTrue(embeddings.equals(expected_embeddings))
+
+    def test_resume_discards_checkpoint_of_other_settings(self) -> None:
+        llm_client = self.clients["llm"]["client"]
+        create = llm_client.chat.completions.create
+        calls = []
+
+        def fail_after_first_function(*args, **kwargs):
+            if len(calls) == 2:
+                raise ValueError("bad JSON reply")
+            calls.append(1)
+            return create(*args, **kwargs)
+
+        llm_client.chat.completions.create = fail_after_first_function
+        with self.assertRaises(ValueError):
+            self.index_project(batch_size=1)
+
+        # rows described with two calls are not reused in single call mode
+        llm_client.chat.completions.create = create
+        summary = self.index_project(resume=True, single_call=True)
+        self.assertEqual(summary["resumed"], 0)
+        self.assertEqual(summary["indexed"], 3)
+
+    def test_docstring_fast_path_is_reported(self) -> None:
+        summary = self.index_project(docstring_min_words=8)
+        self.assertEqual(summary["llm_calls_saved"], 2)
+        self.assertEqual(self.clients["llm"]["client"].requests, 4)
+
+    def test_call_graph_follows_index_rows(self) -> None:
+        call_symbols = SymbolTable()
+        compiler_iter = iterate_over_functions_project(
+            self.project_path, call_symbols=call_symbols
+        )
+        # the files are parsed once, by the compiler
+        with mock.patch.object(
+            SymbolTable, "add_file", side_effect=AssertionError("parsed")
+        ):
+            index_project(
+                compiler_iter,
+                self.project_path,
+                self.clients,
+                call_symbols=call_symbols,
+            )
+        metadata, _ = load_index(self.index_path, mmap=False)
+        graph = load_call_graph(os.path.join(self.index_path, CALL_GRAPH_FILE))
+        self.assertEqual(graph.num_functions, len(metadata))
+
+        relationship = pd.read_parquet(
+            os.path.join(self.index_path, RELATIONSHIP_FILE)
+        )
+        expected = relationship_frame(metadata, graph)
+        self.assertTrue(relationship.equals(expected))
+        names = dict(zip(metadata["id"], metadata["function_name"]))
+        calls = [
+            (names[source], names[target], line)
+            for source, target, line in zip(
+                relationship["source_id"],
+                relationship["target_id"],
+                relationship["line_number"],
+            )
+        ]
+        self.assertEqual(
+            sorted(calls),
+            [
+                ("analyze_text_reviews", "categorize_words", 21),
+                ("analyze_text_reviews", "extract_words", 20),
+            ],
+        )
+        self.assertIn("texts: List[str]", relationship["arguments"].tolist())
+
+    def test_csv_index_is_migrated(self) -> None:
+        self.index_project()
+        metadata, embeddings = load_index(self.index_path, mmap=False)
+        dense = embeddings.to_dense()
+
+        # writing the same index in the legacy CSV format
+        entity = metadata.drop(columns="keywords")
+        columns = ["function_name", "definition", "description"]
+        columns += [f"keyword_{i}" for i in range(dense.shape[1] - 3)]
+        for column_idx, column in enumerate(columns):
+            entity[f"{column}_embedding"] = [
+                str(emb.tolist()) for emb in dense[:, column_idx]
+            ]
+        shutil.rmtree(self.index_path)
+        os.makedirs(self.index_path)
+        entity.to_csv(os.path.join(self.index_path, "entity.csv"), index=False)
+
+        migrated, migrated_embeddings = load_index(self.index_path)
+        self.assertIsInstance(migrated_embeddings.base, np.memmap)
+        self.assertTrue(migrated_embeddings.equals(embeddings))
+        self.assertEqual(migrated["id"].tolist(), metadata["id"].tolist())
+        self.assertTrue(
+            os.path.isfile(os.path.join(self.index_path, "entity.csv.bak"))
+        )
+
+    def test_dense_index_is_migrated(self) -> None:
+        self.index_project()
+        metadata, embeddings = load_index(self.index_path, mmap=False)
+
+        # writing the same index in format version 1, with a missing keyword
+        dense = embeddings.to_dense()
+        dense[0, -1] = 0
+        legacy = metadata.drop(columns="keywords")
+        for keyword_idx in range(dense.shape[1] - 3):
+            legacy[f"keyword_{keyword_idx}"] = [
+                row[keyword_idx] if keyword_idx < len(row) else None
+                for row in metadata["keywords"]
+            ]
+        legacy.loc[0, f"keyword_{dense.shape[1] - 4}"] = None
+        for name in ["base.npy", "keywords.npy", "keyword_offsets.npy"]:
+            os.remove(os.path.join(self.index_path, name))
+        np.save(os.path.join(self.index_path, "embeddings.npy"), dense)
+        legacy.to_parquet(os.path.join(self.index_path, "entity.parquet"))
+        with open(os.path.join(self.index_path, "index.json"), "w") as f:
+            json.dump({"format_version": 1}, f)
+
+        migrated, migrated_embeddings = load_index(self.index_path)
+        self.assertTrue(
+            np.array_equal(migrated_embeddings.counts, embeddings.counts - [1, 0, 0])
+        )
+        self.assertTrue(migrated_embeddings[1:].equals(embeddings[1:]))
+        self.assertEqual(
+            migrated["keywords"][0].tolist(), list(metadata["keywords"][0][:-1])
+        )
+        self.assertFalse(
+            os.path.exists(os.path.join(self.index_path, "embeddings.npy"))
+        )
+
+    def test_keywords_are_stored_once(self) -> None:
+        self.index_project()
+        metadata, embeddings = load_index(self.index_path, mmap=False)
+        vocabulary = load_keyword_vocabulary(self.index_path, embeddings)
+
+        keywords = [keyword for row in metadata["keywords"] for keyword in row]
+        self.assertLess(len(vocabulary), len(keywords))
+        self.assertEqual(sorted(vocabulary.keywords), sorted(set(keywords)))
+        # every keyword of an entity refers to the vector of its text
+        for keyword, keyword_id in zip(keywords, embeddings.occurrence_ids()):
+            self.assertEqual(vocabulary.keywords[keyword_id], keyword)
+
+    def test_writer_writes_metadata_in_row_groups(self) -> None:
+        writer = IndexWriter(self.index_path, columns=["id", "keywords"])
+        # the first rows have no keywords to infer their type from
+        writer.append(
+            pd.DataFrame({"id": [1], "keywords": [[]]}),
+            RaggedEmbeddings(
+                base=np.ones((1, 3, 4)), keywords=np.ones((0, 4)), offsets=[0, 0]
+            ),
+        )
+        writer.append(
+            pd.DataFrame({"id": [2], "keywords": [["parse"]]}), np.ones((1, 4, 4))
+        )
+        metadata, _ = writer.finalize()
+        self.assertEqual(pq.ParquetFile(writer.metadata_path).num_row_groups, 2)
+        writer.commit()
+
+        stored, embeddings = load_index(self.index_path, mmap=False)
+        self.assertTrue(stored.equals(metadata))
+        self.assertEqual(stored["id"].tolist(), ["1", "2"])
+        self.assertEqual([list(row) for row in stored["keywords"]], [[], ["parse"]])
+        self.assertEqual(embeddings.counts.tolist(), [0, 1])
+
+    def test_ragged_index_is_migrated(self) -> None:
+        self.index_project()
+        metadata, embeddings = load_index(self.index_path, mmap=False)
+
+        # writing the same index in format version 2, one vector per keyword
+        np.save(
+            os.path.join(self.index_path, "keywords.npy"),
+            embeddings.keyword_vectors(),
+        )
+        for name in ["keyword_ids.npy", "keyword_vocabulary.parquet"]:
+            os.remove(os.path.join(self.index_path, name))
+        with open(os.path.join(self.index_path, "index.json"), "w") as f:
+            json.dump({"format_version": 2}, f)
+
+        migrated, migrated_embeddings = load_index(self.index_path)
+        self.assertTrue(migrated_embeddings.equals(embeddings))
+        self.assertEqual(
+            len(migrated_embeddings.keywords), len(embeddings.keywords)
+        )
+        self.assertEqual(migrated["id"].tolist(), metadata["id"].tolist())
+
+    def test_query_keywords_come_from_the_vocabulary(self) -> None:
+        self.index_project()
+        _, embeddings = load_index(self.index_path)
+        vocabulary = load_keyword_vocabulary(self.index_path, embeddings)
+        kwargs = dict(
+            keyword_extraction_prompt_template=prompts.keyword_extraction,
+            together_llm_client=self.clients["llm"]["client"],
+            together_llm_model_name="llm",
+            together_embedding_client=self.clients["embedding"]["client"],
+            together_embedding_model_name="embedding",
+            project_path=self.project_path,
+        )
+
+        # the query's keywords are words of the keyword extraction prompt,
+        # which every function's keywords share
+        client = self.clients["embedding"]["client"]
+        client.requests = 0
+        query_embeddings = get_query_embeddings(
+            query="sum numbers", keyword_vocabulary=vocabulary, **kwargs
+        )
+        prompt = prompts.keyword_extraction.format(description="sum numbers", code="")
+        words = sorted(set(prompt.split()[-12:]))[:10]
+        known = [word for word in words if word in vocabulary]
+        self.assertTrue(known)
+        self.assertEqual(client.requests, int(len(known) < len(words)))
+        np.testing.assert_allclose(
+            query_embeddings[words.index(known[0])], vocabulary.vector(known[0])
+        )
@@ -0,0 +1,165 @@
+import os
+import time
+import tempfile
+import unittest
+from email.utils import formatdate
+
+from src.lattice.llm.cache import ResponseCache
+from src.lattice.llm.governor import RequestGovernor
+from src.lattice.llm.parsing import LLMResponseError, extract_json_object
+from src.lattice.llm.together import (
+    get_together_chat_response,
+    get_together_embeddings,
+    set_request_governor,
+    set_response_cache,
+)
+from test.test_indexer import FakeEmbeddingClient, FakeLLMClient
+
+
+class StatusError(Exception):
+    def __init__(self, status_code: int, headers: dict = None) -> None:
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def flaky(errors: list, result="ok"):
+    def func(**kwargs):
+        if errors:
+            raise errors.pop(0)
+        return result
+
+    return func
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.directory.name, "cache")
+
+    def tearDown(self) -> None:
+        set_response_cache(None)
+        self.directory.cleanup()
+
+    def test_embeddings_are_served_from_cache(self) -> None:
+        set_response_cache(ResponseCache(self.cache_path))
+        client = FakeEmbeddingClient()
+
+        first = get_together_embeddings(["plot", "parse"], client, "embedding")
+        second = get_together_embeddings(["parse", "plot", "new"], client, "embedding")
+
+        self.assertEqual(client.requests, 2)
+        self.assertEqual(second[:2], [first[1], first[0]])
+
+        # a fresh cache object reads the entries written to disk
+        cache = ResponseCache(self.cache_path)
+        set_response_cache(cache)
+        get_together_embeddings(["plot", "parse", "new"], client, "embedding")
+        self.assertEqual(client.requests, 2)
+        self.assertEqual(cache.stats(), {"embedding": {"hits": 3, "misses": 0}})
+
+    def test_least_recently_used_entries_are_evicted(self) -> None:
+        cache = ResponseCache(self.cache_path, max_size=1000)
+        for i in range(10):
+            cache.set("chat", "llm", f"prompt {i}", "x" * 200)
+            cache.get("chat", "llm", "prompt 0")
+
+        self.assertIsNotNone(cache.get("chat", "llm", "prompt 0"))
+        self.assertIsNone(cache.get("chat", "llm", "prompt 1"))
+        self.assertLessEqual(cache._size, 1000)
+
+
+class TestJSONExtraction(unittest.TestCase):
+    def test_tolerates_common_reply_formats(self) -> None:
+        expected = {"description": "a {b}", "description_keywords": ["x"]}
+        replies = [
+            '{"description": "a {b}", "description_keywords": ["x"]}',
+            '```json\n{"description": "a {b}", "description_keywords": ["x"],}\n```',
+            "Here it is: {'description': 'a {b}', 'description_keywords': ['x']} Done.",
+        ]
+        for reply in replies:
+            self.assertEqual(
+                extract_json_object(reply, ["description", "description_keywords"]),
+                expected,
+            )
+
+    def test_missing_keys_raise(self) -> None:
+        with self.assertRaises(LLMResponseError) as context:
+            extract_json_object('{"description": "a"}', ["description_keywords"])
+        self.assertEqual(context.exception.response, '{"description": "a"}')
+        with self.assertRaises(LLMResponseError):
+            extract_json_object("no object here", ["description"])
+
+
+class TestRequestGovernor(unittest.TestCase):
+    def setUp(self) -> None:
+        self.delays = []
+        self.governor = RequestGovernor(
+            initial_concurrency=8, sleep=self.delays.append, base_delay=0.01
+        )
+
+    def tearDown(self) -> None:
+        set_request_governor(RequestGovernor())
+
+    def test_throttled_requests_are_retried_after_retry_after(self) -> None:
+        errors = [StatusError(429, {"retry-after": "2"}), StatusError(502)]
+        self.assertEqual(self.governor.call(flaky(errors)), "ok")
+
+        self.assertEqual(len(self.delays), 2)
+        self.assertGreaterEqual(self.delays[0], 2)
+        self.assertLess(self.delays[1], 0.02 + 1e-9)
+        # halved once by the 429, grown a little by the successful request
+        self.assertEqual(self.governor.stats()["concurrency"], 4)
+        self.assertEqual(self.governor.stats()["retries"], 2)
+
+    def test_permanent_errors_and_exhausted_retries_raise(self) -> None:
+        with self.assertRaises(StatusError):
+            self.governor.call(flaky([StatusError(400), StatusError(429)]))
+        self.assertEqual(self.delays, [])
+
+        self.governor.max_retries = 2
+        with self.assertRaises(StatusError):
+            self.governor.call(flaky([StatusError(500)] * 3))
+        self.assertEqual(len(self.delays), 2)
+        self.assertEqual(self.governor.in_flight, 0)
+
+    def test_only_successes_grow_concurrency(self) -> None:
+        self.governor.max_retries = 2
+        with self.assertRaises(StatusError):
+            self.governor.call(flaky([StatusError(500)] * 3))
+        self.assertEqual(self.governor.concurrency, 8.0)
+
+        self.governor.call(flaky([]))
+        self.assertGreater(self.governor.concurrency, 8.0)
+
+    def test_retry_after_dates_are_honoured(self) -> None:
+        retry_at = formatdate(time.time() + 30, usegmt=True)
+        self.governor.call(flaky([StatusError(503, {"Retry-After": retry_at})]))
+        self.assertGreater(self.delays[0], 25)
+
+    def test_budgets_delay_requests(self) -> None:
+        governor = RequestGovernor(requests_per_minute=2, tokens_per_minute=100)
+        governor._window.extend([[0.0, 10], [30.0, 80]])
+
+        # the oldest request leaves the window at 60s, the second at 90s
+        self.assertEqual(governor._budget_wait(tokens=10, now=40.0), 20.0)
+        governor.requests_per_minute = None
+        self.assertEqual(governor._budget_wait(tokens=10, now=40.0), 0.0)
+        self.assertEqual(governor._budget_wait(tokens=50, now=40.0), 50.0)
+
+    def test_chat_requests_go_through_the_governor(self) -> None:
+        set_request_governor(self.governor)
+        client = FakeLLMClient()
+        create = client.chat.completions.create
+        errors = [StatusError(503)]
+
+        def failing_create(**kwargs):
+            if errors:
+                raise errors.pop(0)
+            return create(**kwargs)
+
+        client.chat.completions.create = failing_create
+        response = get_together_chat_response("prompt", client, "llm")
+
+        self.assertIn("description", response)
+        self.assertEqual(self.governor.stats()["retries"], 1)
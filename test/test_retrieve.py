@@ -0,0 +1,471 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from rank_bm25 import BM25Okapi
+
+from src.lattice.compiler.digest import iterate_over_functions_project
+from src.lattice.indexer.local import index_project
+from src.lattice.retrieve import prompts
+from src.lattice.retrieve.ann import build_ivf_index
+from src.lattice.retrieve.retriever import (
+    FAST_BASE_VECTORS,
+    get_entity_embeddings,
+    get_fast_query_embeddings,
+    rank_entities,
+    retrieve,
+    retrieve_batch,
+    score_entities,
+    score_entities_batch,
+)
+from src.lattice.retrieve.bm25 import (
+    build_bm25_index,
+    load_bm25_index,
+    save_bm25_index,
+    tokenize_entity,
+)
+from src.lattice.retrieve.embedding_cache import EntityEmbeddingCache
+from src.lattice.retrieve.query_cache import QueryCache, legacy_query_path
+from src.lattice.retrieve.example_data_1 import ENTITY
+from src.lattice.storage import RaggedEmbeddings, load_index
+from src.lattice.storage.ragged import segment_top2
+from src.lattice.storage.vocabulary import KeywordVocabulary
+from test.test_indexer import FakeEmbeddingClient, FakeLLMClient
+
+
+class TestBM25(unittest.TestCase):
+    def setUp(self) -> None:
+        self.corpus = [definition.split() for definition in ENTITY["definition"]]
+        self.queries = [
+            "def visualize histogram of ratings".split(),
+            "return return words words = unknown_token".split(),
+            "plt.tight_layout() ax.bar( for".split(),
+            [],
+        ]
+
+    def test_scores_match_rank_bm25(self) -> None:
+        bm25 = BM25Okapi(self.corpus)
+        bm25_index = build_bm25_index(self.corpus)
+
+        for query in self.queries:
+            np.testing.assert_array_equal(
+                bm25_index.get_scores(query), bm25.get_scores(query)
+            )
+
+    def test_saved_index_scores_identically(self) -> None:
+        bm25_index = build_bm25_index(self.corpus)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bm25.npz")
+            save_bm25_index(path, bm25_index)
+            loaded = load_bm25_index(path)
+
+        self.assertEqual(loaded.vocabulary, bm25_index.vocabulary)
+        for query in self.queries:
+            np.testing.assert_array_equal(
+                loaded.get_scores(query), bm25_index.get_scores(query)
+            )
+
+
+class TestANN(unittest.TestCase):
+    def test_ivf_candidates_contain_exact_best_entity(self) -> None:
+        rng = np.random.default_rng(0)
+        topics = rng.standard_normal((20, 32))
+        vectors = topics[rng.integers(20, size=300)][:, None, :]
+        vectors = vectors + 0.1 * rng.standard_normal((300, 13, 32))
+        entity_embeddings = vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+        entity_embeddings = entity_embeddings.astype(np.float32)
+        queries = entity_embeddings[7, :4]
+
+        ivf_index = build_ivf_index(entity_embeddings, n_lists=16)
+        self.assertEqual(ivf_index.indptr[-1], 300 * 13)
+
+        # probing every list returns every entity
+        everything = ivf_index.search(queries, n_probe=16, num_candidates=300)
+        np.testing.assert_array_equal(np.sort(everything), np.arange(300))
+
+        best = np.argmax(score_entities(entity_embeddings, queries))
+        self.assertIn(best, ivf_index.search(queries, n_probe=2, num_candidates=10))
+
+        # n_probe bounds the lists probed for all the query vectors together
+        queries = entity_embeddings[[7, 50, 120, 250], 0]
+        closest = np.argmax((queries @ ivf_index.centroids.T).max(axis=0))
+        members = ivf_index.owners[
+            ivf_index.indptr[closest] : ivf_index.indptr[closest + 1]
+        ]
+        np.testing.assert_array_equal(
+            np.sort(ivf_index.search(queries, n_probe=1, num_candidates=300)),
+            np.unique(members),
+        )
+
+    def test_ann_candidates_are_ranked(self) -> None:
+        rng = np.random.default_rng(1)
+        vectors = rng.standard_normal((30, 13, 32))
+        entity_embeddings = vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+        entity_embeddings = entity_embeddings.astype(np.float32)
+        # only the first five entities share a word with the query
+        entity = pd.DataFrame(
+            {
+                "id": range(30),
+                "function_name": [f"function_{row}" for row in range(30)],
+                "description": [
+                    f"{'alpha' if row < 5 else 'other'} word{row}" for row in range(30)
+                ],
+                "definition": [f"def function_{row}(): pass" for row in range(30)],
+            }
+        )
+        queries = entity_embeddings[17, :4]
+        ivf_index = build_ivf_index(entity_embeddings, n_lists=8)
+
+        kwargs = dict(
+            entity=entity,
+            entity_embeddings=entity_embeddings,
+            query="alpha",
+            query_embeddings=queries,
+            num_bm25_candidates=5,
+        )
+        self.assertLess(rank_entities(**kwargs)[0]["id"], 5)
+        results = rank_entities(ann_index=ivf_index, n_probe=8, top_k=3, **kwargs)
+        self.assertEqual(results[0]["id"], 17)
+        scores = [result["scores"]["embedding"] for result in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+
+class TestRank(unittest.TestCase):
+    def test_top_k_results_are_the_best_bm25_candidates(self) -> None:
+        rng = np.random.default_rng(5)
+        entity_embeddings = rng.standard_normal((40, 13, 16)).astype(np.float32)
+        query_embeddings = rng.standard_normal((3, 16)).astype(np.float32)
+        entity = pd.DataFrame(
+            {
+                "id": range(40),
+                "function_name": [f"function_{row}" for row in range(40)],
+                "description": [
+                    " ".join(["plot"] * (row % 7) + [f"word{row}"]) for row in range(40)
+                ],
+                "definition": ["pass"] * 40,
+            }
+        )
+
+        results = rank_entities(
+            entity=entity,
+            entity_embeddings=entity_embeddings,
+            query="plot",
+            query_embeddings=query_embeddings,
+            top_k=4,
+            num_bm25_candidates=10,
+        )
+
+        bm25_scores = build_bm25_index(tokenize_entity(entity)).get_scores(["plot"])
+        candidates = np.argsort(-bm25_scores, kind="stable")[:10]
+        emb_scores = score_entities(entity_embeddings, query_embeddings)
+        expected = candidates[np.argsort(-emb_scores[candidates])[:4]]
+        self.assertEqual([result["id"] for result in results], expected.tolist())
+        for result in results:
+            self.assertAlmostEqual(
+                result["scores"]["embedding"], emb_scores[result["id"]], places=5
+            )
+            self.assertEqual(result["scores"]["bm25"], bm25_scores[result["id"]])
+
+
+class TestBatch(unittest.TestCase):
+    def test_batch_scores_match_single_scores(self) -> None:
+        rng = np.random.default_rng(0)
+        entity_embeddings = rng.standard_normal((50, 13, 16)).astype(np.float32)
+        queries = [rng.standard_normal((n, 16)) for n in [10, 3, 7, 1]]
+
+        # a tiny block size exercises scoring over several entity blocks
+        scores = score_entities_batch(entity_embeddings, queries, max_block_size=1000)
+        self.assertEqual(scores.shape, (4, 50))
+        for query, query_scores in zip(queries, scores):
+            np.testing.assert_allclose(
+                query_scores, score_entities(entity_embeddings, query), rtol=1e-5
+            )
+
+    def test_ragged_scores_match_dense_scores(self) -> None:
+        rng = np.random.default_rng(1)
+        dense = rng.standard_normal((40, 13, 16)).astype(np.float32)
+        # entities without keywords score like the dense tensor without them
+        counts = rng.integers(0, 11, size=40)
+        counts[:3] = 0
+        ragged = RaggedEmbeddings(
+            base=dense[:, :3],
+            keywords=np.concatenate(
+                [dense[row, 3 : 3 + count] for row, count in enumerate(counts)]
+            ),
+            offsets=np.concatenate([[0], np.cumsum(counts)]),
+        )
+        queries = [rng.standard_normal((n, 16)) for n in [10, 3, 1]]
+
+        scores = score_entities_batch(ragged, queries, max_block_size=500)
+        for query, query_scores in zip(queries, scores):
+            expected = [
+                score_entities(dense[row : row + 1, : 3 + count], query)[0]
+                for row, count in enumerate(counts)
+            ]
+            np.testing.assert_allclose(query_scores, expected, rtol=1e-5)
+            np.testing.assert_allclose(
+                score_entities(ragged, query), expected, rtol=1e-5
+            )
+        self.assertLess(ragged.nbytes, dense.nbytes)
+
+    def test_shared_keywords_score_like_dense_keywords(self) -> None:
+        rng = np.random.default_rng(3)
+        counts = rng.integers(0, 6, size=30)
+        ragged = RaggedEmbeddings(
+            base=rng.standard_normal((30, 3, 16)).astype(np.float32),
+            keywords=rng.standard_normal((7, 16)).astype(np.float32),
+            offsets=np.concatenate([[0], np.cumsum(counts)]),
+            keyword_ids=rng.integers(0, 7, size=counts.sum()),
+        )
+        query = rng.standard_normal((4, 16))
+
+        dense = ragged.to_dense()
+        expected = [
+            score_entities(dense[row : row + 1, : 3 + count], query)[0]
+            for row, count in enumerate(counts)
+        ]
+        np.testing.assert_allclose(score_entities(ragged, query), expected, rtol=1e-5)
+        rows = [4, 0, 17]
+        np.testing.assert_allclose(
+            score_entities(ragged[rows], query), np.array(expected)[rows], rtol=1e-5
+        )
+
+    def test_fast_scores_leave_out_definitions(self) -> None:
+        rng = np.random.default_rng(4)
+        dense = rng.standard_normal((20, 8, 16)).astype(np.float32)
+        query = rng.standard_normal((2, 16))
+        # the same entities without their definition vectors
+        expected = score_entities(np.delete(dense, 1, axis=1), query)
+
+        ragged = RaggedEmbeddings.from_dense(dense)
+        for embeddings in [dense, ragged]:
+            np.testing.assert_allclose(
+                score_entities(embeddings, query, FAST_BASE_VECTORS),
+                expected,
+                rtol=1e-5,
+            )
+        np.testing.assert_allclose(
+            score_entities_batch(ragged, [query], base_vectors=FAST_BASE_VECTORS)[0],
+            expected,
+            rtol=1e-5,
+        )
+
+    def test_segment_top2(self) -> None:
+        rng = np.random.default_rng(2)
+        values = rng.integers(0, 4, size=(30, 2)).astype(np.float64)
+        offsets = np.array([0, 0, 1, 5, 5, 12, 30])
+        second = np.full_like(values, -np.inf)
+
+        top1, top2 = segment_top2(values, second, offsets)
+        for segment in range(len(offsets) - 1):
+            rows = values[offsets[segment] : offsets[segment + 1]]
+            expected = np.sort(rows, axis=0)[::-1]
+            expected = np.vstack([expected, np.full((2, 2), -np.inf)])
+            np.testing.assert_array_equal(top1[segment], expected[0])
+            np.testing.assert_array_equal(top2[segment], expected[1])
+
+    def test_retrieve_batch_matches_retrieve(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            project_path = os.path.join(directory, "project")
+            shutil.copytree("test/props/example_directory", project_path)
+            clients = {
+                "llm": {"client": FakeLLMClient(), "model": "llm"},
+                "embedding": {"client": FakeEmbeddingClient(), "model": "embedding"},
+            }
+            compiler_iter = iterate_over_functions_project(project_path)
+            index_project(compiler_iter, project_path, clients)
+            index_path = os.path.join(project_path, ".lattice")
+            entity, entity_embeddings = load_index(index_path)
+
+            kwargs = dict(
+                entity=entity,
+                num_keywords=10,
+                keyword_extraction_prompt_template=prompts.keyword_extraction,
+                together_llm_client=clients["llm"]["client"],
+                together_llm_model_name="llm",
+                together_embedding_client=clients["embedding"]["client"],
+                together_embedding_model_name="embedding",
+                project_path=project_path,
+                entity_embeddings=entity_embeddings,
+                top_k=3,
+            )
+            queries = ["split words", "count ratings", "split words", "plot"]
+            batch_results = list(
+                retrieve_batch(queries=queries, chunk_size=3, **kwargs)
+            )
+
+            self.assertEqual([query for query, _ in batch_results], queries)
+            for query, results in batch_results:
+                expected = retrieve(query=query, **kwargs)
+                self.assertEqual(
+                    [result["id"] for result in results],
+                    [result["id"] for result in expected],
+                )
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.entity_path = os.path.join(self.directory.name, "entity.csv")
+        rng = np.random.default_rng(0)
+        columns = ["function_name", "definition", "description"]
+        columns += [f"keyword_{idx}" for idx in range(2)]
+        self.entity = pd.DataFrame(
+            {
+                "function_name": ["main", "plot", "parse"],
+                **{
+                    f"{column}_embedding": rng.standard_normal((3, 4)).tolist()
+                    for column in columns
+                },
+            }
+        )
+        self.entity.to_csv(self.entity_path, index=False)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def sidecars(self) -> list:
+        return sorted(
+            name for name in os.listdir(self.directory.name) if name.endswith(".npy")
+        )
+
+    def test_decoded_embeddings_are_reused(self) -> None:
+        cache = EntityEmbeddingCache()
+        entity, embeddings = cache.load(self.entity_path, num_keywords=2)
+        expected = get_entity_embeddings(entity, num_keywords=2)
+
+        self.assertEqual(embeddings.dtype, np.float32)
+        np.testing.assert_allclose(embeddings, expected, rtol=1e-6)
+        self.assertEqual(len(self.sidecars()), 1)
+        self.assertIs(cache.load(self.entity_path, num_keywords=2)[1], embeddings)
+
+        # a new process reads the sidecar instead of parsing the CSV
+        path = "src.lattice.retrieve.embedding_cache.get_entity_embeddings"
+        with mock.patch(path, side_effect=AssertionError("parsed")):
+            _, loaded = EntityEmbeddingCache().load(self.entity_path, num_keywords=2)
+        np.testing.assert_array_equal(loaded, embeddings)
+
+    def test_changed_csv_replaces_the_sidecar(self) -> None:
+        cache = EntityEmbeddingCache()
+        cache.load(self.entity_path, num_keywords=2)
+        first_sidecars = self.sidecars()
+
+        self.entity.iloc[:2].to_csv(self.entity_path, index=False)
+        os.utime(self.entity_path, ns=(0, 0))
+        entity, embeddings = cache.load(self.entity_path, num_keywords=2)
+
+        self.assertEqual(len(entity), 2)
+        self.assertEqual(embeddings.shape, (2, 5, 4))
+        self.assertEqual(len(self.sidecars()), 1)
+        self.assertNotEqual(self.sidecars(), first_sidecars)
+
+    def test_sidecars_of_other_keyword_counts_are_kept(self) -> None:
+        cache = EntityEmbeddingCache()
+        cache.load(self.entity_path, num_keywords=2)
+        cache.load(self.entity_path, num_keywords=3)
+        self.assertEqual(len(self.sidecars()), 2)
+
+        self.entity.iloc[:2].to_csv(self.entity_path, index=False)
+        os.utime(self.entity_path, ns=(0, 0))
+        cache.load(self.entity_path, num_keywords=2)
+        self.assertEqual(len(self.sidecars()), 1)
+
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.now = 1000.0
+        self.embeddings = np.arange(12, dtype=np.float32).reshape(3, 4)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def open(self, model: str = "embedding", **kwargs) -> QueryCache:
+        cache = QueryCache(
+            self.directory.name, model, clock=lambda: self.now, **kwargs
+        )
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_queries_are_cached(self) -> None:
+        cache = self.open()
+        self.assertIsNone(cache.get("plot values"))
+        cache.set("plot values", ["plot", "values", "chart"], self.embeddings)
+
+        keywords, embeddings = self.open().get("plot values")
+        self.assertEqual(keywords, ["plot", "values", "chart"])
+        np.testing.assert_array_equal(embeddings, self.embeddings)
+        self.assertFalse(
+            [name for name in os.listdir(self.directory.name) if name.endswith(".csv")]
+        )
+
+    def test_least_recently_used_queries_are_evicted(self) -> None:
+        entry_size = self.embeddings.nbytes + len('["a"]')
+        # room for three queries
+        cache = self.open(max_size=4 * entry_size - 1)
+        for query in ["first", "second", "third"]:
+            self.now += 1
+            cache.set(query, ["a"], self.embeddings)
+        self.now += 1
+        cache.get("first")
+        self.now += 1
+        cache.set("fourth", ["a"], self.embeddings)
+
+        self.assertIsNone(cache.get("second"))
+        for query in ["first", "third", "fourth"]:
+            self.assertIsNotNone(cache.get(query))
+        self.assertEqual(cache.stats()["size"], 3 * entry_size)
+
+    def test_queries_expire(self) -> None:
+        cache = self.open(ttl=60)
+        cache.set("plot values", ["plot"], self.embeddings[:1])
+        self.now += 59
+        self.assertIsNotNone(cache.get("plot values"))
+        self.now += 1
+        self.assertIsNone(cache.get("plot values"))
+
+    def test_embedding_model_change_clears_the_cache(self) -> None:
+        self.open().set("plot values", ["plot"], self.embeddings[:1])
+        self.assertIsNone(self.open(model="other").get("plot values"))
+        self.assertIsNone(self.open().get("plot values"))
+
+    def test_legacy_query_files_are_imported(self) -> None:
+        path = legacy_query_path(self.directory.name, "plot values")
+        pd.DataFrame(
+            {
+                "keyword": ["plot", "values"],
+                "embedding": [str(emb.tolist()) for emb in self.embeddings[:2]],
+            }
+        ).to_csv(path, index=False)
+
+        keywords, embeddings = self.open().get("plot values")
+        self.assertEqual(keywords, ["plot", "values"])
+        np.testing.assert_array_equal(embeddings, self.embeddings[:2])
+        self.assertFalse(os.path.exists(path))
+        self.assertIsNotNone(self.open().get("plot values"))
+
+    def test_fast_queries_are_cached_per_vocabulary(self) -> None:
+        client, cache = FakeEmbeddingClient(), self.open()
+        vectors = np.ones((2, 8), dtype=np.float32)
+
+        def embed(keywords: list) -> np.ndarray:
+            return get_fast_query_embeddings(
+                query="plot values",
+                together_embedding_client=client,
+                together_embedding_model_name="embedding",
+                project_path=self.directory.name,
+                keyword_vocabulary=KeywordVocabulary(keywords, vectors=vectors),
+                query_cache=cache,
+            )
+
+        self.assertEqual(len(embed(["plot", "parse"])), 2)
+        self.assertEqual(len(embed(["plot", "parse"])), 2)
+        self.assertEqual(client.requests, 1)
+
+        # a reindexed project whose keywords changed embeds the query again
+        self.assertEqual(len(embed(["plot", "values"])), 3)
+        self.assertEqual(client.requests, 2)
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from fastapi.testclient import TestClient
+
+from src.lattice.compiler.digest import iterate_over_functions_project
+from src.lattice.indexer.local import index_project
+from src.lattice.server import create_app
+from test.test_indexer import FakeEmbeddingClient, FakeLLMClient
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.project_path = os.path.join(self.directory.name, "project")
+        shutil.copytree("test/props/example_directory", self.project_path)
+        self.clients = {
+            "llm": {"client": FakeLLMClient(), "model": "llm"},
+            "embedding": {"client": FakeEmbeddingClient(), "model": "embedding"},
+        }
+        self.index_project()
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def index_project(self) -> None:
+        compiler_iter = iterate_over_functions_project(self.project_path)
+        index_project(compiler_iter, self.project_path, self.clients)
+
+    def test_search_reloads_changed_index(self) -> None:
+        client = TestClient(create_app(self.project_path, self.clients))
+
+        response = client.get("/search", params={"query": "split words", "top_k": 3})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["query"], "split words")
+        self.assertEqual(
+            sorted(result["function_name"] for result in body["results"]),
+            ["analyze_text_reviews", "categorize_words", "extract_words"],
+        )
+        embedding_scores = [result["scores"]["embedding"] for result in body["results"]]
+        self.assertEqual(embedding_scores, sorted(embedding_scores, reverse=True))
+        self.assertGreaterEqual(body["latency_ms"], 0)
+
+        # removing a script and re-indexing swaps the index under the server
+        os.remove(os.path.join(self.project_path, "example_script.py"))
+        shutil.rmtree(os.path.join(self.project_path, "example_child"))
+        with open(os.path.join(self.project_path, "only.py"), "w") as f:
+            f.write("def only(words):\n    return words.split()\n")
+        self.index_project()
+
+        response = client.get("/search", params={"query": "split words"})
+        results = response.json()["results"]
+        self.assertEqual([result["function_name"] for result in results], ["only"])
+
+    def test_fast_search_skips_the_llm(self) -> None:
+        client = TestClient(create_app(self.project_path, self.clients))
+        llm = self.clients["llm"]["client"]
+        embedding = self.clients["embedding"]["client"]
+        llm.requests = embedding.requests = 0
+
+        params = {"query": "split words", "top_k": 3, "fast": True}
+        response = client.get("/search", params=params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 3)
+        self.assertEqual((llm.requests, embedding.requests), (0, 1))
+
+        # the query embedding is cached
+        client.get("/search", params=params)
+        self.assertEqual((llm.requests, embedding.requests), (0, 1))
+
+    def test_top_k_must_be_positive(self) -> None:
+        client = TestClient(create_app(self.project_path, self.clients))
+
+        response = client.get("/search", params={"query": "split words", "top_k": 0})
+        self.assertEqual(response.status_code, 422)
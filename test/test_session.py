@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from src.lattice.compiler.digest import iterate_over_functions_project
+from src.lattice.compiler.session import DigestSession
+
+
+class TestDigestSession(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.project_path = os.path.join(self.directory.name, "project")
+        shutil.copytree("test/props/example_directory", self.project_path)
+        self.script_path = os.path.join(self.project_path, "example_script.py")
+        self.session = DigestSession(self.project_path)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_calls_are_resolved_across_files(self) -> None:
+        _, calls = self.session.analyze_function(
+            self.script_path, "analyze_text_reviews"
+        )
+        deep_script = os.path.join("example_child", "example_deep_script.py")
+        self.assertEqual(
+            [call["name"] for call in calls], ["extract_words", "categorize_words"]
+        )
+        for call in calls:
+            self.assertTrue(call["path"].endswith(deep_script))
+
+        with self.assertRaises(ValueError):
+            self.session.analyze_function(self.script_path, "random_name")
+
+    def test_scripts_are_cached_until_the_file_changes(self) -> None:
+        script = self.session.script(self.script_path)
+        self.assertIs(self.session.script(self.script_path), script)
+
+        with open(self.script_path, "a") as f:
+            f.write("\n\ndef added():\n    return analyze_text_reviews([])\n")
+        os.utime(self.script_path, ns=(time.time_ns(), time.time_ns() + 10**9))
+
+        self.assertIsNot(self.session.script(self.script_path), script)
+        definition = self.session.extract_definition(self.script_path, "added")
+        self.assertEqual(
+            definition, "def added():\n    return analyze_text_reviews([])"
+        )
+
+    def test_analyze_project(self) -> None:
+        functions = list(iterate_over_functions_project(self.project_path))
+        results = self.session.analyze_project(functions)
+
+        self.assertEqual(len(results), len(functions))
+        for function in functions:
+            source, _ = results[(function.path, function.name)]
+            self.assertEqual(source, function.definition)
@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+
+from src.lattice.compiler.walk import (
+    WalkStats,
+    iterate_over_project_files,
+    is_ignored,
+    parse_ignore_lines,
+)
+
+
+class TestIgnoreRules(unittest.TestCase):
+    def assertIgnored(self, lines, path, expected, is_dir=False) -> None:
+        rule_sets = [("", parse_ignore_lines(lines))]
+        self.assertEqual(is_ignored(rule_sets, path, is_dir), expected, path)
+
+    def test_gitignore_patterns(self) -> None:
+        self.assertIgnored(["*.py"], "a/b/c.py", True)
+        self.assertIgnored(["/c.py"], "a/c.py", False)
+        self.assertIgnored(["/c.py"], "c.py", True)
+        self.assertIgnored(["a/*.py"], "a/c.py", True)
+        self.assertIgnored(["a/*.py"], "a/b/c.py", False)
+        self.assertIgnored(["a/**/c.py"], "a/b/d/c.py", True)
+        self.assertIgnored(["**/build"], "x/build", True, is_dir=True)
+        self.assertIgnored(["build/"], "build", False)
+        self.assertIgnored(["build/"], "src/build", True, is_dir=True)
+        self.assertIgnored(["test_?.py"], "test_1.py", True)
+        self.assertIgnored(["test_[!0-9].py"], "test_1.py", False)
+        self.assertIgnored(["# *.py", ""], "c.py", False)
+        self.assertIgnored(["*.py", "!keep.py"], "keep.py", False)
+        self.assertIgnored(["!keep.py", "*.py"], "keep.py", True)
+
+
+class TestWalk(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = self.directory.name
+        files = {
+            "main.py": "",
+            "notes.txt": "12345",
+            ".gitignore": "build/\n*_generated.py\n",
+            "pkg/b.py": "",
+            "pkg/a.py": "",
+            "pkg/.latticeignore": "/a.py\n!keep_generated.py\n",
+            "pkg/keep_generated.py": "",
+            "pkg/drop_generated.py": "",
+            "build/out.py": "",
+            "node_modules/dep/index.py": "x" * 100,
+            "myenv/pyvenv.cfg": "",
+            "myenv/lib/site.py": "",
+            ".git/hooks/hook.py": "",
+        }
+        for name, content in files.items():
+            path = os.path.join(self.root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(content)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_walk_prunes_ignored_subtrees(self) -> None:
+        stats = WalkStats()
+        files = [
+            os.path.relpath(path, self.root)
+            for path in iterate_over_project_files(self.root, stats=stats)
+        ]
+
+        self.assertEqual(
+            files,
+            [
+                "main.py",
+                os.path.join("pkg", "b.py"),
+                os.path.join("pkg", "keep_generated.py"),
+            ],
+        )
+        self.assertEqual(stats.files, 3)
+        # .gitignore, notes.txt, .latticeignore, a.py and drop_generated.py
+        self.assertEqual(stats.skipped_files, 5)
+        self.assertEqual(stats.pruned_directories, 4)
+        # only files of visited directories, not the 100 bytes under node_modules
+        skipped = [".gitignore", "notes.txt", os.path.join("pkg", ".latticeignore")]
+        skipped_bytes = sum(
+            os.path.getsize(os.path.join(self.root, name)) for name in skipped
+        )
+        self.assertEqual(stats.skipped_bytes, skipped_bytes)
+
+    def test_single_excluded_directory(self) -> None:
+        for exclude in ["pkg", ["pkg"]]:
+            files = [
+                os.path.relpath(path, self.root)
+                for path in iterate_over_project_files(self.root, exclude=exclude)
+            ]
+            self.assertEqual(files, ["main.py"])